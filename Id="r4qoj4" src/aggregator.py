@@ -0,0 +1,370 @@
+from __future__ import annotations
+"""
+Merkez toplama düğümü: gateway'lerin (dashboard.py EXPORT_GATEWAY_ID, demo gateway'leri)
+çerçevelerini federation.Aggregator ile birleştirir ve global görünümü HTTP'den sunar.
+
+Uç noktalar:
+  /view                           gateway'ler, watermark'lar, sağlık sayıları, son şehir noktası (JSON)
+  /city?n=300                     şehir toplamı serisi
+  /site?id=S&res=60&span=3600     site serisi (res=0: son ham noktalar, aksi halde rollup)
+  /metrics                        Prometheus text
+
+--demo N: aynı makinede LocalBroker (veya soket) + N gateway process'i (simüle saatle
+sentetik paket -> pipeline -> GatewayExporter) çalıştırır; her gateway'in bir sitesinin cihaz
+saati DEMO_CLOCK_LAG_S geridedir. Sonunda merkezde birleşen nokta sayıları, şehir toplamları ve
+model state'i gateway'lerin kendi değerleriyle karşılaştırılır; geç sayılan nokta olmamalıdır.
+
+ÇALIŞTIRMA:
+  python src/aggregator.py --mqtt 127.0.0.1:1883 --http 8060
+  python src/aggregator.py --listen 127.0.0.1:7070 --http 8060 --snapshot data/central_snapshot.bin
+  python src/aggregator.py --demo 3 --sites 20 --modules 6 --seconds 120 --transport mqtt
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import multiprocessing as mp
+import threading
+import time
+import numpy as np
+
+from federation import Aggregator, serve_mqtt, serve_socket
+from metrics import METRICS
+from rollup import pick_resolution
+
+HTTP_PORT = 8060
+SITE_MAX_POINTS = 300
+DEMO_CLOCK_LAG_S = 3 # --demo: her gateway'in ikinci sitesinin cihaz saati bu kadar geride
+
+
+def _host_port(s: str) -> Tuple[str, int]:
+    host, _, port = s.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _cols(d: Optional[Dict[str, np.ndarray]], fields) -> Optional[dict]:
+    return None if d is None else {f: d[f].tolist() for f in fields}
+
+
+def _make_handler(agg: Aggregator):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send(self, body: str, ctype: str = "application/json", code: int = 200) -> None:
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                if url.path == "/view":
+                    self._send(json.dumps(agg.summary()))
+                elif url.path == "/city":
+                    d = agg.city_series(int(q.get("n", 300)))
+                    self._send(json.dumps(_cols(d, ("ts", "flow", "sites"))))
+                elif url.path == "/site":
+                    self._send(json.dumps(_site(agg, q["id"], int(q.get("res", 0)), int(q.get("span", 3600)))))
+                elif url.path == "/metrics":
+                    self._send(METRICS.render(), "text/plain; version=0.0.4")
+                else:
+                    self._send(json.dumps({"error": "not found"}), code=404)
+            except (KeyError, ValueError) as e:
+                self._send(json.dumps({"error": str(e)}), code=400)
+
+    return Handler
+
+
+def _site(agg: Aggregator, site_id: str, res: int, span: int) -> Optional[dict]:
+    if res <= 0:
+        return _cols(agg.site_series(site_id, SITE_MAX_POINTS), ("ts", "flow", "ratio", "n_used"))
+    with agg.lock:
+        last = agg.site_last.get(site_id)
+        if last is None:
+            return None
+        res = res if res in agg.rollups.res.tolist() else pick_resolution(span, SITE_MAX_POINTS)
+        d = agg.rollups.query(site_id, last - span, last, res)
+    return _cols(d, ("ts", "mean", "min", "max", "ratio", "count"))
+
+
+def serve_http(agg: Aggregator, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("0.0.0.0", port), _make_handler(agg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _register_gauges(agg: Aggregator) -> None:
+    def gateways():
+        now = time.time()
+        with agg.lock:
+            return {
+                "live": sum(now - g.last_seen <= agg.stale_s for g in agg.gateways.values()),
+                "known": len(agg.gateways),
+            }
+
+    METRICS.gauge("fed_gateways", gateways, "Known / live gateways")
+    METRICS.gauge(
+        "fed_lag_seconds",
+        lambda: {g.gateway_id: max(int(time.time()) - g.watermark, 0) for g in list(agg.gateways.values())},
+        "Wall clock minus gateway watermark",
+    )
+    METRICS.gauge("fed_late_points", lambda: agg.late_points, "Points that arrived after the city total was emitted")
+
+
+def _print_summary(agg: Aggregator) -> None:
+    s = agg.summary()
+    gws = " ".join(
+        f"{g['gateway_id']}(wm={g['watermark']} pts={g['points']} dup={g['dup_frames']} lost={g['lost_frames']}"
+        f"{'' if g['live'] else ' STALE'})"
+        for g in s["gateways"]
+    )
+    city = s["city_last"]
+    city = "-" if city is None else f"{city['flow']:.1f}@{city['ts']}"
+    print(
+        f"[aggregator] sites={s['sites']} city_wm={s['city_watermark']} city={city} late={s['late_points']} "
+        f"modules={s['health']['modules']} offline={s['health']['offline']} | {gws}"
+    )
+
+
+# --- demo ---------------------------------------------------------------------------------
+
+
+def _demo_gateway(idx: int, cfg: dict, out: mp.Queue) -> None:
+    # pipeline state'i bu process'e ait: import'lar process içinde
+    import anomaly
+    from common import StepPacket
+    from federation import GatewayExporter, MqttSink, SocketSink
+    from fusion import THR as FUSION_THR
+    from replay import Replayer
+
+    gw_id = f"GW{idx:02d}"
+    rng = np.random.default_rng(cfg["seed"] + idx)
+    sites = [f"{gw_id}_S{i:03d}" for i in range(cfg["sites"])]
+    modules = [f"MOD_{m:02d}" for m in range(cfg["modules"])]
+    sink = MqttSink(gw_id, "127.0.0.1", cfg["port"]) if cfg["transport"] == "mqtt" else SocketSink("127.0.0.1", cfg["port"])
+    exp = GatewayExporter(gw_id)
+    rp = Replayer(collect=True)
+    speed = cfg["speed"] * (1.0 + 0.5 * idx) # gateway'ler farklı hızda ilerler (watermark birleştirme)
+
+    sent_frames: List[bytes] = []
+    done = 0 # rp.result.fused'tan export edilen
+
+    def export(now_ts: int, final: bool = False) -> None:
+        nonlocal done
+        fused = rp.result.fused
+        exp.add_fused(fused[done:], now_ts, FUSION_THR.close_lag_s, final=final)
+        done = len(fused)
+        frames = exp.fused_frames(now_ts)
+        if (now_ts - start) % cfg["health_every"] == 0 or final:
+            frames.append(exp.health_frame(full=final, now_ts=now_ts))
+        if (now_ts - start) % cfg["model_every"] == 0 or final:
+            frames.append(exp.model_frame(now_ts))
+        for f in frames:
+            if f is not None:
+                sink.send(f)
+                sent_frames.append(f)
+
+    start = cfg["start_ts"]
+    t_wall = time.time()
+    for ts in range(start, start + cfg["seconds"]):
+        total = rng.poisson(cfg["base_flow"], size=(len(sites), len(modules)))
+        d1 = rng.binomial(total, 0.5)
+        pkts = [
+            StepPacket(site, mod, ts - (DEMO_CLOCK_LAG_S if i == 1 else 0), 1, int(d1[i, j]), int(total[i, j] - d1[i, j]))
+            for i, site in enumerate(sites)
+            for j, mod in enumerate(modules)
+            if not (i == 0 and j == 0 and ts - start >= cfg["seconds"] // 2) # ilk modül yarıda susar
+        ]
+        rp.feed(pkts)
+        if (ts - start) % cfg["export_every"] == 0:
+            export(ts)
+        if speed > 0:
+            delay = t_wall + (ts - start + 1) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    res = rp.finish()
+    export(rp.clock + 1, final=True)
+    sink.send(sent_frames[0]) # bilinçli tekrar: merkez seq ile atmalı
+    time.sleep(0.5)
+    sink.close()
+
+    per_ts: Dict[int, float] = {}
+    for _, ts, flow, _, _ in res.fused:
+        per_ts[ts] = per_ts.get(ts, 0.0) + float(np.float32(flow))
+    seas = anomaly.SEASONAL_STORE
+    out.put({
+        "gateway_id": gw_id,
+        "points": len(res.fused),
+        "frames": exp.seq,
+        "bytes": sum(len(f) for f in sent_frames),
+        "per_ts": per_ts,
+        "model_site": sites[0],
+        "model": seas.stats[seas.index[sites[0]]].tolist(),
+    })
+
+
+def demo(args) -> int:
+    agg = Aggregator(stale_s=args.stale, expected=[f"GW{i:02d}" for i in range(args.demo)])
+    broker = server = client = None
+    if args.transport == "mqtt":
+        from localbroker import LocalBroker
+
+        broker = LocalBroker(port=0).start()
+        port = broker.port
+        client = serve_mqtt(agg, "127.0.0.1", port)
+        time.sleep(0.5) # SUBSCRIBE
+    else:
+        server = serve_socket(agg)
+        port = server.server_address[1]
+    if args.http:
+        serve_http(agg, args.http)
+
+    cfg = {
+        "transport": args.transport,
+        "port": port,
+        "sites": args.sites,
+        "modules": args.modules,
+        "seconds": args.seconds,
+        "start_ts": int(time.time()) - args.seconds,
+        "speed": args.speed,
+        "seed": args.seed,
+        "base_flow": 3.0,
+        "export_every": 2,
+        "health_every": 6,
+        "model_every": 30,
+    }
+    print(
+        f"[aggregator] demo: {args.demo} gateways x {args.sites} sites x {args.modules} modules, "
+        f"{args.seconds} simulated s, transport={args.transport}:{port}"
+    )
+    out = mp.Queue()
+    procs = [mp.Process(target=_demo_gateway, args=(i, cfg, out), daemon=True) for i in range(args.demo)]
+    for p in procs:
+        p.start()
+    results = []
+    next_print = time.time() + 2
+    while len(results) < len(procs):
+        try:
+            results.append(out.get(timeout=0.5))
+        except Exception:
+            pass
+        agg.tick()
+        if time.time() >= next_print:
+            _print_summary(agg)
+            next_print += 2
+    for p in procs:
+        p.join()
+    time.sleep(1.0) # yoldaki çerçeveler
+    agg.tick()
+    _print_summary(agg)
+
+    # doğrulama: merkez = gateway'lerin kendi çıktılarının birleşimi
+    ok = True
+    s = agg.summary()
+    by_gw = {g["gateway_id"]: g for g in s["gateways"]}
+    for r in sorted(results, key=lambda r: r["gateway_id"]):
+        g = by_gw.get(r["gateway_id"], {})
+        good = g.get("points") == r["points"] and g.get("dup_frames") == 1 and g.get("lost_frames") == 0
+        ok &= good
+        print(
+            f"  {r['gateway_id']}: points {r['points']} -> {g.get('points')}, frames={r['frames']} "
+            f"({r['bytes'] / 1e3:.1f} KB), dup={g.get('dup_frames')} lost={g.get('lost_frames')} "
+            f"{'OK' if good else 'MISMATCH'}"
+        )
+        m = agg.model(r["model_site"])
+        good = m is not None and np.allclose(m[0], np.array(r["model"]))
+        ok &= good
+        print(f"    model {r['model_site']}: {'OK' if good else 'MISMATCH'}")
+
+    expected: Dict[int, float] = {}
+    for r in results:
+        for ts, flow in r["per_ts"].items():
+            expected[ts] = expected.get(ts, 0.0) + flow
+    city = agg.city_series()
+    got = dict(zip(city["ts"].tolist(), city["flow"].tolist()))
+    missing = [ts for ts in expected if ts not in got]
+    worst = max((abs(got[ts] - v) for ts, v in expected.items() if ts in got), default=0.0)
+    good = not missing and worst < 1e-2 * max(args.sites * args.demo, 1) and s["late_points"] == 0
+    ok &= good
+    print(
+        f"  city: {len(got)}/{len(expected)} seconds, max |diff|={worst:.4f}, late={s['late_points']} "
+        f"{'OK' if good else 'MISMATCH'}"
+    )
+    print(f"  health: {s['health']}")
+
+    if client is not None:
+        client.loop_stop()
+        client.disconnect()
+    if broker is not None:
+        broker.stop()
+    if server is not None:
+        server.shutdown()
+    print(f"[aggregator] demo {'OK' if ok else 'FAILED'}")
+    return 0 if ok else 1
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mqtt", default=None, help="host:port; FED_TOPIC/+ abonesi")
+    ap.add_argument("--listen", default=None, help="host:port; uzunluk önekli TCP çerçeveleri")
+    ap.add_argument("--http", type=int, default=HTTP_PORT, help="0 = HTTP yok")
+    ap.add_argument("--expect", default="", help="virgüllü gateway id'leri; ilk çerçeveleri gelene kadar beklenir")
+    ap.add_argument("--stale", type=float, default=30.0, help="bu kadar sn çerçeve göndermeyen gateway beklenmez")
+    ap.add_argument("--print-every", type=float, default=10.0)
+    ap.add_argument("--snapshot", default=None, help="birleştirilmiş model snapshot'ının yazılacağı yol")
+    ap.add_argument("--snapshot-every", type=float, default=300.0)
+    ap.add_argument("--demo", type=int, default=0, metavar="N", help="N yerel gateway process'iyle uçtan uca deneme")
+    ap.add_argument("--transport", choices=("mqtt", "socket"), default="mqtt", help="--demo taşıması")
+    ap.add_argument("--sites", type=int, default=20, help="--demo: gateway başına site")
+    ap.add_argument("--modules", type=int, default=6)
+    ap.add_argument("--seconds", type=int, default=120, help="--demo: simüle süre")
+    ap.add_argument("--speed", type=float, default=40.0, help="--demo: duvar saniyesi başına simüle saniye (0 = sınırsız)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    if args.demo:
+        if args.http == HTTP_PORT:
+            args.http = 0
+        raise SystemExit(demo(args))
+
+    if not args.mqtt and not args.listen:
+        ap.error("--mqtt veya --listen gerekli")
+    agg = Aggregator(stale_s=args.stale, expected=[g for g in args.expect.split(",") if g])
+    _register_gauges(agg)
+    if args.mqtt:
+        serve_mqtt(agg, *_host_port(args.mqtt))
+    if args.listen:
+        serve_socket(agg, *_host_port(args.listen))
+    if args.http:
+        serve_http(agg, args.http)
+        print(f"[aggregator] http://127.0.0.1:{args.http}/view")
+
+    next_print = next_snap = time.time()
+    while True:
+        time.sleep(1.0)
+        agg.tick()
+        now = time.time()
+        if now >= next_print:
+            _print_summary(agg)
+            next_print = now + args.print_every
+        if args.snapshot and now >= next_snap + args.snapshot_every:
+            import anomaly
+            from snapshot import write_snapshot
+
+            n = agg.load_model(anomaly.SEASONAL_STORE, anomaly.EWMA_STORE)
+            if n:
+                write_snapshot(args.snapshot)
+            next_snap = now
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+from __future__ import annotations
+"""
+Alarm motoru: (type, site_id, module_id) anahtarı başına yaşam döngüsü + tekrar bastırma + rate limit,
+ve yayınlanan olaylar için kompakt, indeksli bellek içi depo.
+
+Yaşam döngüsü:
+  open     anahtar için ilk alarm (veya çözülmüş anahtarın yeniden açılması)
+  ongoing  aktif anahtar alarm üretmeye devam ediyor; en fazla repeat_every_s'de bir yayınlanır
+  resolved anahtar resolve_after_s boyunca alarm üretmedi
+
+Aradaki tekrarlar (ör. her 3 sn'de bir SENSOR_OFFLINE, her pakette STUCK_*) yalnızca sayılır.
+Açılışlar anahtar başına token bucket ile sınırlanır (flapping sensörler); limit aşılırsa anahtar
+sessizce aktif kalır ve token geldiğinde açılır.
+
+Zaman: olay zamanı alarmın ts'i, yaşam döngüsü saati process() çağrısının now_ts'idir
+(sensör saatinden bağımsız).
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import heapq
+import itertools
+import numpy as np
+
+from history import alert_value
+from ringbuf import RingBuffer
+
+OPEN, ONGOING, RESOLVED = "open", "ongoing", "resolved"
+STATES = (OPEN, ONGOING, RESOLVED)
+
+AlertKey = Tuple[str, str, str] # (type, site_id, module_id)
+
+STORE_FIELDS = [
+    ("seq", np.int64),
+    ("ts", np.int64),
+    ("type", np.int16),
+    ("site", np.int32),
+    ("module", np.int32),
+    ("state", np.int8),
+    ("value", np.float64), # float32 SENSOR_OFFLINE last_ts'ini ~128 sn'ye yuvarlar
+    ("count", np.int32),
+    ("alert_id", np.int64),
+]
+
+
+@dataclass(frozen=True)
+class AlertPolicy:
+    repeat_every_s: int = 60 # aktif anahtar için ongoing yayın aralığı
+    resolve_after_s: int = 10 # bu kadar alarm gelmezse resolved (HEALTH_SWEEP_S'den büyük olmalı)
+    open_burst: int = 3 # anahtar başına art arda izin verilen açılış
+    open_refill_s: int = 300 # bir açılış hakkının yenilenme süresi
+
+
+@dataclass
+class ActiveAlert:
+    alert_id: int
+    first_ts: int
+    last_ts: int
+    last_seen: int # now_ts saatiyle
+    alert: dict
+    count: int = 1
+    last_emit: Optional[int] = None # None: henüz açılış yayınlanmadı (rate limit)
+
+
+@dataclass
+class _Tokens:
+    tokens: float
+    stamp: int
+
+
+class AlertStore:
+    """
+    Yayınlanan olayların sabit kapasiteli kolonsal deposu. type/site/module tamsayı koda çevrilir;
+    site ve tip başına seq indeksleri sayesinde "bu sitenin son N olayı" sorgusu O(N)'dir.
+    Hata metinleri (BAD_MSG, PIPELINE_ERROR "error" alanı) seq -> metin olarak ayrıca tutulur,
+    ring'den düşen olaylarınki silinir.
+    """
+
+    def __init__(self, capacity: int = 10000, index_capacity: int = 500):
+        self.rows = RingBuffer(capacity, STORE_FIELDS, ts_field="ts")
+        self.index_capacity = index_capacity
+        self.seq = 0 # eklenen toplam olay (panel değişim tespiti için de kullanılır)
+        self.codes: Dict[str, Dict[str, int]] = {"type": {}, "site": {}, "module": {}}
+        self.names: Dict[str, List[str]] = {"type": [], "site": [], "module": []}
+        self.by_site: Dict[int, Deque[int]] = {}
+        self.by_type: Dict[int, Deque[int]] = {}
+        self.errors: Dict[int, str] = {} # seq -> hata metni, seq sırasıyla
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def code(self, kind: str, name: str) -> int:
+        c = self.codes[kind].get(name)
+        if c is None:
+            c = self.codes[kind][name] = len(self.names[kind])
+            self.names[kind].append(name)
+        return c
+
+    def add(self, ev: dict) -> None:
+        t = self.code("type", ev["type"])
+        s = self.code("site", ev.get("site_id", ""))
+        seq = self.seq
+        self.rows.append(
+            seq,
+            ev.get("ts", 0),
+            t,
+            s,
+            self.code("module", ev.get("module_id", "")),
+            STATES.index(ev["state"]),
+            alert_value(ev),
+            ev["count"],
+            ev["alert_id"],
+        )
+        for idx, c in ((self.by_site, s), (self.by_type, t)):
+            q = idx.get(c)
+            if q is None:
+                q = idx[c] = deque(maxlen=self.index_capacity)
+            q.append(seq)
+        if "error" in ev:
+            self.errors[seq] = str(ev["error"])
+        first = seq + 1 - self.rows.capacity
+        while self.errors and next(iter(self.errors)) < first:
+            del self.errors[next(iter(self.errors))]
+        self.seq = seq + 1
+
+    def query(
+        self,
+        site_id: Optional[str] = None,
+        alert_type: Optional[str] = None,
+        t0: Optional[int] = None,
+        limit: int = 12,
+    ) -> List[dict]:
+        """
+        En yeni önde, en fazla limit olay. site_id/alert_type verilirse ilgili seq indeksi gezilir;
+        t0 verilirse ts < t0 olan olayda durulur (olaylar yaklaşık ts sırasıyla eklenir).
+        """
+        if not len(self.rows):
+            return []
+        cols = self.rows.last()
+        first = int(cols["seq"][0])
+        if site_id is not None:
+            c = self.codes["site"].get(site_id)
+            seqs = self.by_site.get(c, ()) if c is not None else ()
+        elif alert_type is not None:
+            c = self.codes["type"].get(alert_type)
+            seqs = self.by_type.get(c, ()) if c is not None else ()
+        else:
+            seqs = range(first, self.seq)
+        t_code = self.codes["type"].get(alert_type, -1) if alert_type is not None else None
+
+        out: List[dict] = []
+        for seq in reversed(seqs):
+            i = seq - first
+            if i < 0:
+                break # ring'den düşmüş
+            if t0 is not None and cols["ts"][i] < t0:
+                break
+            if t_code is not None and cols["type"][i] != t_code:
+                continue
+            out.append(self._row(cols, i))
+            if len(out) >= limit:
+                break
+        return out
+
+    def _row(self, cols: Dict[str, np.ndarray], i: int) -> dict:
+        row = {
+            "ts": int(cols["ts"][i]),
+            "type": self.names["type"][cols["type"][i]],
+            "site_id": self.names["site"][cols["site"][i]],
+            "module_id": self.names["module"][cols["module"][i]],
+            "state": STATES[cols["state"][i]],
+            "value": float(cols["value"][i]),
+            "count": int(cols["count"][i]),
+            "alert_id": int(cols["alert_id"][i]),
+        }
+        error = self.errors.get(int(cols["seq"][i]))
+        if error is not None:
+            row["error"] = error
+        return row
+
+    def counts(self, t0: Optional[int] = None) -> Dict[str, int]:
+        """
+        Tip bazında olay sayıları (t0 verilirse ts >= t0 olanlar).
+        """
+        cols = self.rows.last() if t0 is None else self.rows.since(t0)
+        n = np.bincount(cols["type"], minlength=len(self.names["type"]))
+        return {name: int(n[c]) for name, c in self.codes["type"].items() if n[c]}
+
+
+class AlertEngine:
+    """
+    Ham alarm listelerini (pipeline/health çıktısı) yayınlanacak olaylara çevirir.
+    Thread-safe değildir; çağıran kilitler (dashboard.ALERT_LOCK).
+    """
+
+    def __init__(self, policy: AlertPolicy = AlertPolicy(), store: Optional[AlertStore] = None):
+        self.policy = policy
+        self.store = store if store is not None else AlertStore()
+        self.active: Dict[AlertKey, ActiveAlert] = {}
+        self.tokens: Dict[AlertKey, _Tokens] = {} # yalnızca dolu olmayan bucket'lar (bkz. _prune_tokens)
+        self.next_token_prune = 0
+        # çözülme deadline indeksi: (last_seen + resolve_after_s, key) min-heap, eski kayıtlar atlanır
+        self.heap: List[Tuple[int, AlertKey]] = []
+        self.suppressed = 0 # yayınlanmayan tekrarlar
+        self.rate_limited = 0 # token olmadığı için ertelenen açılışlar
+        self._ids = itertools.count(1)
+
+    def _take_token(self, key: AlertKey, now_ts: int) -> bool:
+        p = self.policy
+        tb = self.tokens.get(key)
+        if tb is None:
+            tb = self.tokens[key] = _Tokens(float(p.open_burst), now_ts)
+        tb.tokens = min(float(p.open_burst), tb.tokens + (now_ts - tb.stamp) / max(p.open_refill_s, 1))
+        tb.stamp = now_ts
+        if tb.tokens < 1.0:
+            return False
+        tb.tokens -= 1.0
+        return True
+
+    def _prune_tokens(self, now_ts: int) -> None:
+        """
+        Yeniden dolmuş bucket'ları siler (yokluğu dolu bucket demektir); open_refill_s'de bir.
+        """
+        if now_ts < self.next_token_prune:
+            return
+        p = self.policy
+        refill = max(p.open_refill_s, 1)
+        full = [k for k, tb in self.tokens.items() if tb.tokens + (now_ts - tb.stamp) / refill >= p.open_burst]
+        for k in full:
+            del self.tokens[k]
+        self.next_token_prune = now_ts + refill
+
+    @staticmethod
+    def _event(act: ActiveAlert, state: str, ts: int) -> dict:
+        ev = dict(act.alert)
+        ev.update(state=state, ts=ts, first_ts=act.first_ts, count=act.count, alert_id=act.alert_id)
+        return ev
+
+    def process(self, alerts: Iterable[dict], now_ts: int) -> List[dict]:
+        """
+        Önce süresi dolan anahtarları çözer, sonra yeni alarmları işler. Returns: yayınlanan
+        olaylar (store'a da eklenir), bu sırayla.
+        """
+        p = self.policy
+        events = self.expire(now_ts)
+        for a in alerts:
+            key = (a.get("type", ""), a.get("site_id", ""), a.get("module_id", ""))
+            ts = int(a.get("ts", now_ts))
+            act = self.active.get(key)
+            if act is None:
+                act = self.active[key] = ActiveAlert(next(self._ids), ts, ts, now_ts, a)
+                heapq.heappush(self.heap, (now_ts + p.resolve_after_s, key))
+            else:
+                act.count += 1
+                act.last_ts = max(act.last_ts, ts)
+                act.alert = a
+                if act.last_seen != now_ts: # saniyede en fazla bir heap kaydı
+                    act.last_seen = now_ts
+                    heapq.heappush(self.heap, (now_ts + p.resolve_after_s, key))
+
+            if act.last_emit is None:
+                if self._take_token(key, now_ts):
+                    act.last_emit = now_ts
+                    events.append(self._event(act, OPEN, ts))
+                else:
+                    self.rate_limited += 1
+            elif now_ts - act.last_emit >= p.repeat_every_s:
+                act.last_emit = now_ts
+                events.append(self._event(act, ONGOING, ts))
+            else:
+                self.suppressed += 1
+
+        for ev in events:
+            self.store.add(ev)
+        return events
+
+    def expire(self, now_ts: int) -> List[dict]:
+        """
+        Deadline'ı geçmiş anahtarları çözer (store'a eklemez; process() ekler).
+        """
+        self._prune_tokens(now_ts)
+        out: List[dict] = []
+        heap = self.heap
+        while heap and heap[0][0] <= now_ts:
+            deadline, key = heapq.heappop(heap)
+            act = self.active.get(key)
+            if act is None or act.last_seen + self.policy.resolve_after_s != deadline:
+                continue # eski kayıt
+            del self.active[key]
+            if act.last_emit is not None:
+                out.append(self._event(act, RESOLVED, act.last_ts))
+        return out
+
+    def active_counts(self) -> Dict[str, int]:
+        n: Dict[str, int] = {}
+        for (t, _, _) in self.active:
+            n[t] = n.get(t, 0) + 1
+        return n
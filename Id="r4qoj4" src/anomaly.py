@@ -1,11 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Dict, List, Sequence, Tuple
 import math
-import time
+import numpy as np
 
-from seasonal import SeasonalModel
+from common import SLOTS
+from seasonal import N_SLOTS, SeasonalModel, SeasonalStore, hour_of_week, hour_of_week_batch, key_rounds
 
 
 @dataclass
@@ -29,7 +30,7 @@ class Thresholds:
     low_demand_hours: Tuple[int, int] = (0, 5) # local hours inclusive
 
 
-@dataclass
+@dataclass(**SLOTS)
 class EwmaState:
     n: int = 0
     mean: float = 0.0
@@ -53,22 +54,81 @@ class EwmaState:
         return (float(x) - self.mean) / sd
 
 
+class EwmaStore:
+    """
+    Tüm sitelerin EWMA state'i tek dizide: state[row] = (n, mean, var).
+    Skaler yol satırı EwmaState olarak okur/yazar; batch yol dizi üzerinde çalışır.
+    """
+
+    def __init__(self, capacity: int = 16):
+        self.state = np.zeros((max(capacity, 1), 3))
+        self.state[:, 2] = 1.0
+        self.index: Dict[str, int] = {}
+        self.sites: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    def site(self, site_id: str) -> int:
+        """
+        site_id -> satır indeksi (yoksa eklenir).
+        """
+        row = self.index.get(site_id)
+        if row is None:
+            row = self.index[site_id] = len(self.sites)
+            self.sites.append(site_id)
+            if row >= len(self.state):
+                grown = np.zeros((2 * len(self.state), 3))
+                grown[:, 2] = 1.0
+                grown[: len(self.state)] = self.state
+                self.state = grown
+        return row
+
+    def get(self, row: int) -> EwmaState:
+        n, mean, var = self.state[row].tolist()
+        return EwmaState(int(n), mean, var)
+
+    def put(self, row: int, st: EwmaState) -> None:
+        self.state[row] = (st.n, st.mean, st.var)
+
+    def load(self, sites: Sequence[str], state: np.ndarray) -> None:
+        """
+        Tüm içeriği (snapshot'tan) verilen sitelerle değiştirir.
+        """
+        self.sites = list(sites)
+        self.index = {s: i for i, s in enumerate(self.sites)}
+        self.state = np.zeros((max(len(self.sites), 16), 3))
+        self.state[:, 2] = 1.0
+        self.state[: len(self.sites)] = state
+
+
 # global per-site states (simple demo implementation)
-SEASONAL: Dict[str, SeasonalModel] = {}
-EWMA: Dict[str, EwmaState] = {}
+SEASONAL_STORE = SeasonalStore() # tüm sitelerin slot istatistikleri (sites x 168 x 3)
+SEASONAL: Dict[str, SeasonalModel] = {} # site_id -> SEASONAL_STORE satırına view
+EWMA_STORE = EwmaStore() # tüm sitelerin EWMA state'i (sites x 3)
 THR = Thresholds()
 
 
 def _get_seasonal(site_id: str) -> SeasonalModel:
     if site_id not in SEASONAL:
-        SEASONAL[site_id] = SeasonalModel()
+        SEASONAL[site_id] = SeasonalModel(store=SEASONAL_STORE, site_id=site_id)
     return SEASONAL[site_id]
 
 
-def _get_ewma(site_id: str) -> EwmaState:
-    if site_id not in EWMA:
-        EWMA[site_id] = EwmaState()
-    return EWMA[site_id]
+def get_ewma(site_id: str) -> EwmaState:
+    """
+    Sitenin EWMA state'inin kopyası.
+    """
+    return EWMA_STORE.get(EWMA_STORE.site(site_id))
+
+
+def reset_state() -> None:
+    """
+    Tüm seasonal/EWMA state'ini sıfırlar (replay, restore ve testler için).
+    """
+    SEASONAL_STORE.load([], np.zeros((0, N_SLOTS, 3)))
+    EWMA_STORE.load([], np.zeros((0, 3)))
+    SEASONAL.clear()
 
 
 def detect(
@@ -92,13 +152,16 @@ def detect(
     alerts: List[dict] = []
     dbg = {"flow": flow, "ratio": ratio}
 
+    how = hour_of_week(ts)
     sm = _get_seasonal(site_id)
-    z_seas = sm.zscore(ts, flow)
-    sm.update(ts, flow)
+    z_seas = sm.zscore_slot(how, flow)
+    sm.update_slot(how, flow)
     dbg["z_seasonal"] = z_seas
 
-    ew = _get_ewma(site_id)
+    row = EWMA_STORE.site(site_id)
+    ew = EWMA_STORE.get(row)
     ew.update(flow, thr.ewma_alpha)
+    EWMA_STORE.put(row, ew)
     z_ew = ew.z(flow)
     dbg["z_ewma"] = z_ew
 
@@ -111,8 +174,120 @@ def detect(
     if flow >= thr.one_sided_flow_min and (ratio >= thr.one_sided_ratio_hi or ratio <= (1 - thr.one_sided_ratio_hi)):
         alerts.append({"type": "ONE_SIDED", "ratio": float(ratio), "flow": float(flow)})
 
-    lt = time.localtime(ts)
-    if thr.low_demand_hours[0] <= lt.tm_hour <= thr.low_demand_hours[1] and flow >= thr.low_demand_flow:
-        alerts.append({"type": "LOW_DEMAND_CROWD", "hour": int(lt.tm_hour), "flow": float(flow)})
+    hour = how % 24
+    if thr.low_demand_hours[0] <= hour <= thr.low_demand_hours[1] and flow >= thr.low_demand_flow:
+        alerts.append({"type": "LOW_DEMAND_CROWD", "hour": int(hour), "flow": float(flow)})
 
     return alerts, dbg
+
+
+ALERT_TYPES = ("SPIKE_EWMA", "SPIKE_SEASONAL", "ONE_SIDED", "LOW_DEMAND_CROWD")
+
+# detect_batch çıktısı: row = giriş dizisindeki örnek indeksi, type = ALERT_TYPES indeksi.
+# z yalnızca SPIKE_* için, hour yalnızca LOW_DEMAND_CROWD için anlamlıdır.
+ALERT_DTYPE = np.dtype(
+    [
+        ("row", "i8"),
+        ("site_idx", "i8"),
+        ("ts", "i8"),
+        ("type", "u1"),
+        ("z", "f8"),
+        ("flow", "f8"),
+        ("ratio", "f8"),
+        ("hour", "i1"),
+    ]
+)
+
+
+def detect_batch(
+    site_ids: Sequence[str],
+    site_idx: np.ndarray,
+    ts: np.ndarray,
+    steps1: np.ndarray,
+    steps2: np.ndarray,
+    window_s: np.ndarray,
+    thr: Thresholds = THR,
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    detect'in dizi karşılığı: satır sırası her site için zaman sırası kabul edilir.
+    site_idx, site_ids listesine indekstir. EWMA/seasonal state'i skaler yol ile
+    aynı global'lerde güncellenir; sonuçlar skaler detect çağrılarıyla birebir aynıdır.
+    Returns: (alerts [ALERT_DTYPE], debug dizileri)
+    """
+    site_idx = np.asarray(site_idx, dtype=np.int64)
+    ts = np.asarray(ts, dtype=np.int64)
+    s1 = np.maximum(np.asarray(steps1, dtype=np.int64), 0)
+    s2 = np.maximum(np.asarray(steps2, dtype=np.int64), 0)
+    flow = (s1 + s2) / np.maximum(np.asarray(window_s, dtype=np.int64), 1)
+    ratio = s1 / np.maximum(s1 + s2, 1)
+    n = len(ts)
+
+    z_seas = np.zeros(n)
+    z_ew = np.zeros(n)
+    how = hour_of_week_batch(ts)
+
+    if n:
+        # seasonal: store satırları üzerinde zscore + Welford (sitelerden bağımsız)
+        rows_of = np.array([_get_seasonal(s).row for s in site_ids], dtype=np.int64)
+        z_seas = SEASONAL_STORE.score_and_update(rows_of[site_idx], how, flow)
+
+        # EWMA: store dizisi üzerinde, site başına sıra turlarla korunur
+        ew_rows = np.array([EWMA_STORE.site(s) for s in site_ids], dtype=np.int64)[site_idx]
+        st = EWMA_STORE.state
+        alpha = thr.ewma_alpha
+        for rows in key_rounds(site_idx):
+            x = flow[rows]
+            r = ew_rows[rows]
+
+            # EWMA update, sonra z
+            first = st[r, 0] == 0
+            prev = st[r, 1]
+            new_mean = np.where(first, x, alpha * x + (1 - alpha) * prev)
+            new_var = np.where(first, 1.0, alpha * ((x - prev) ** 2) + (1 - alpha) * st[r, 2])
+            st[r, 0] += 1
+            st[r, 1] = new_mean
+            st[r, 2] = new_var
+            z_ew[rows] = (x - new_mean) / np.sqrt(np.maximum(new_var, 1e-6))
+
+    hour = how % 24
+    spike_ok = flow >= thr.flow_min_spike
+    fired = np.stack(
+        [
+            spike_ok & (z_ew >= thr.ewma_z_spike),
+            spike_ok & (z_seas >= thr.seasonal_z_spike),
+            (flow >= thr.one_sided_flow_min)
+            & ((ratio >= thr.one_sided_ratio_hi) | (ratio <= (1 - thr.one_sided_ratio_hi))),
+            (thr.low_demand_hours[0] <= hour) & (hour <= thr.low_demand_hours[1]) & (flow >= thr.low_demand_flow),
+        ],
+        axis=1,
+    )
+    rows, types = np.nonzero(fired)
+
+    alerts = np.zeros(len(rows), dtype=ALERT_DTYPE)
+    alerts["row"] = rows
+    alerts["site_idx"] = site_idx[rows]
+    alerts["ts"] = ts[rows]
+    alerts["type"] = types
+    alerts["z"] = np.select([types == 0, types == 1], [z_ew[rows], z_seas[rows]], np.nan)
+    alerts["flow"] = flow[rows]
+    alerts["ratio"] = ratio[rows]
+    alerts["hour"] = np.where(types == 3, hour[rows], -1)
+
+    dbg = {"flow": flow, "ratio": ratio, "z_seasonal": z_seas, "z_ewma": z_ew}
+    return alerts, dbg
+
+
+def alerts_to_dicts(alerts: np.ndarray) -> List[dict]:
+    """
+    detect_batch çıktısı -> detect ile aynı şekilli alarm dict'leri (satır sırasıyla).
+    """
+    out: List[dict] = []
+    for a in alerts:
+        kind = ALERT_TYPES[a["type"]]
+        if kind == "ONE_SIDED":
+            out.append({"type": kind, "ratio": float(a["ratio"]), "flow": float(a["flow"])})
+        elif kind == "LOW_DEMAND_CROWD":
+            out.append({"type": kind, "hour": int(a["hour"]), "flow": float(a["flow"])})
+        else:
+            out.append({"type": kind, "z": float(a["z"]), "flow": float(a["flow"])})
+    return out
@@ -0,0 +1,77 @@
+from __future__ import annotations
+"""
+Decode throughput benchmark:
+- JSON decode_packet vs binary decode_packet_bin vs decode_batch_bin
+
+ÇALIŞTIRMA:
+  python src/bench_codec.py --packets 200000
+"""
+
+import argparse
+import random
+import time
+
+from common import (
+    StepPacket,
+    encode_packet,
+    encode_packet_bin,
+    decode_packet,
+    decode_packet_bin,
+    decode_batch_bin,
+)
+
+
+def make_packets(n: int, n_sites: int, n_modules: int, seed: int):
+    rnd = random.Random(seed)
+    t0 = 1_700_000_000
+    out = []
+    for i in range(n):
+        total = rnd.randint(0, 20)
+        d1 = rnd.randint(0, total)
+        out.append(
+            StepPacket(
+                site_id=f"SITE_{rnd.randrange(n_sites):04d}",
+                module_id=f"MOD_{rnd.randrange(n_modules):02d}",
+                ts=t0 + i // (n_sites * n_modules),
+                window_s=1,
+                steps_dir1=d1,
+                steps_dir2=total - d1,
+            )
+        )
+    return out
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--packets", type=int, default=200_000)
+    ap.add_argument("--sites", type=int, default=100)
+    ap.add_argument("--modules", type=int, default=24)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    pkts = make_packets(args.packets, args.sites, args.modules, args.seed)
+    js = [encode_packet(p) for p in pkts]
+    bins = [encode_packet_bin(p) for p in pkts]
+    buf = b"".join(bins)
+
+    assert [decode_packet(x) for x in js[:1000]] == pkts[:1000]
+    assert [decode_packet_bin(x) for x in bins[:1000]] == pkts[:1000]
+
+    n = len(pkts)
+    t_json = timed(lambda: [decode_packet(x) for x in js])
+    t_bin = timed(lambda: [decode_packet_bin(x) for x in bins])
+    t_batch = timed(lambda: decode_batch_bin(buf))
+
+    print(f"[bench_codec] packets={n} json={sum(map(len, js)) / n:.0f} B/pkt bin={len(bins[0])} B/pkt")
+    for name, t in (("json", t_json), ("bin", t_bin), ("bin batch", t_batch)):
+        print(f"  {name:<10}: {t * 1e3:8.1f} ms  ({n / t:,.0f} pkt/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+from __future__ import annotations
+"""
+Uçtan uca pipeline benchmark'ı (broker gerekmez):
+- Site / modül sayısı / geçmiş uzunluğu kombinasyonları için sentetik JSON akış
+- Aşama bazında çağrı gecikmesi (p50/p99): decode_packet, health_alerts_for_packet, ingest,
+  fuse_ready, rollup, detect (detect_batch), check_offline, check_outliers, refresh_ui (figür kurulumu)
+- Sonuçlar JSON'a yazılır ve kayıtlı baseline ile karşılaştırılır: her konfigürasyon --repeat kez
+  koşulur ve medyanı alınır; ölçülen her saniyede sabit bir referans iş yükü de zamanlanır
+  ("reference" satırı) ve baseline iki taraftaki referans süre oranıyla ölçeklenir, böylece makine hızı /
+  yük farkı (aynı anda ölçüldüğü için CPU frekansı değişimleri de) regresyon sayılmaz
+
+"history" ölçümden önce pipeline'dan geçirilen (zamanlanmayan) saniye sayısıdır;
+ring buffer'ları, seasonal slotları ve health pencerelerini doldurur.
+
+ÇALIŞTIRMA:
+  python src/bench_pipeline.py                                  # varsayılan grid, baseline ile karşılaştır
+  python src/bench_pipeline.py --sites 100,1000 --modules 12 --history 300 --out results.json
+  python src/bench_pipeline.py --save-baseline                  # mevcut sonuçları baseline yap
+"""
+
+from typing import Dict, List
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+import fusion
+import health
+import rollup
+from common import StepPacket, decode_packet, encode_packet
+from pipeline import HEALTH_THR, detect_fused, reset_state
+
+DEFAULT_BASELINE = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "pipeline_baseline.json")
+)
+STAGES = (
+    "decode_packet",
+    "health_alerts_for_packet",
+    "ingest",
+    "fuse_ready",
+    "rollup",
+    "detect",
+    "check_offline",
+    "check_outliers",
+    "refresh_ui",
+)
+REFERENCE = "reference" # her ölçülen saniyede zamanlanan reference_work(); aşama değil, ölçek
+HEALTH_EVERY_S = 3 # dashboard.HEALTH_SWEEP_S
+MIN_DELTA_US = 2.0 # mikro-saniyelik aşamalarda ölçüm gürültüsü için mutlak pay
+
+
+def make_second(rnd: random.Random, n_sites: int, n_modules: int, ts: int) -> List[str]:
+    """
+    Bir saniyelik JSON payload'lar (site başına ortak akış + modül gürültüsü, ara sıra spike).
+    """
+    out = []
+    for s in range(n_sites):
+        base = 6 if rnd.random() > 0.01 else 40
+        for m in range(n_modules):
+            total = max(0, int(rnd.gauss(base, 2)))
+            d1 = rnd.randint(0, total)
+            out.append(encode_packet(StepPacket(f"SITE_{s:05d}", f"MOD_{m:02d}", ts, 1, d1, total - d1)))
+    return out
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {k: [] for k in STAGES + (REFERENCE,)}
+
+    def summary(self) -> Dict[str, dict]:
+        out = {}
+        for k, v in self.samples.items():
+            if not v:
+                continue
+            a = np.array(v) * 1e6
+            out[k] = {
+                "n": len(a),
+                "p50_us": round(float(np.percentile(a, 50)), 3),
+                "p99_us": round(float(np.percentile(a, 99)), 3),
+                "total_ms": round(float(a.sum()) / 1000, 3),
+            }
+        return out
+
+
+def _load_ui():
+    try:
+        import dashboard
+    except ImportError: # dash/plotly yoksa refresh_ui aşaması atlanır
+        return None
+    return dashboard
+
+
+def run_config(n_sites: int, n_modules: int, history_s: int, seconds: int, seed: int, ui) -> dict:
+    reset_state()
+    if ui is not None:
+        ui.FLOW_BUF.clear()
+        ui.VIEWS = ui.ViewPublisher()
+    rnd = random.Random(seed)
+    t0 = 1_700_000_000
+    lag = fusion.THR.close_lag_s
+    sites = [f"SITE_{s:05d}" for s in range(n_sites)]
+    timer = StageTimer()
+    pc = time.perf_counter
+
+    def step(ts: int, timed: bool) -> None:
+        if timed:
+            a = pc()
+            reference_work()
+            timer.samples[REFERENCE].append(pc() - a)
+        payloads = make_second(rnd, n_sites, n_modules, ts)
+        t_dec = timer.samples["decode_packet"]
+        t_hp = timer.samples["health_alerts_for_packet"]
+        t_ing = timer.samples["ingest"]
+        for raw in payloads:
+            a = pc()
+            pkt = decode_packet(raw)
+            b = pc()
+            health.health_alerts_for_packet(pkt, HEALTH_THR)
+            c = pc()
+            fusion.ingest(pkt)
+            d = pc()
+            if timed:
+                t_dec.append(b - a)
+                t_hp.append(c - b)
+                t_ing.append(d - c)
+
+        a = pc()
+        fused = fusion.fuse_ready(now_ts=ts)
+        b = pc()
+        rollup.ROLLUPS.update(fused)
+        c = pc()
+        detect_fused(fused)
+        d = pc()
+        if timed:
+            timer.samples["fuse_ready"].append(b - a)
+            timer.samples["rollup"].append(c - b)
+            timer.samples["detect"].append(d - c)
+        if ui is not None:
+            for site_id, ts_, flow, ratio, n_used in fused:
+                ui.FLOW_BUF[site_id].append(ts_, flow, ratio, n_used)
+            ui.publish_view({row[0] for row in fused})
+
+        if (ts - t0) % HEALTH_EVERY_S == 0:
+            a = pc()
+            health.check_offline(ts, HEALTH_THR)
+            b = pc()
+            health.check_outliers_changed(HEALTH_THR)
+            c = pc()
+            if timed:
+                timer.samples["check_offline"].append(b - a)
+                timer.samples["check_outliers"].append(c - b)
+
+        if timed and ui is not None and ts - t0 > lag:
+            site = sites[(ts - t0) % n_sites]
+            sv = ui.VIEWS.current.by_site[site]
+            a = pc()
+            ui._build_figure(site, *ui._range_data(sv, site, "15m"))
+            timer.samples["refresh_ui"].append(pc() - a)
+
+    for i in range(history_s):
+        step(t0 + i, timed=False)
+
+    start = pc()
+    for i in range(history_s, history_s + seconds):
+        step(t0 + i, timed=True)
+    elapsed = pc() - start
+
+    n_packets = n_sites * n_modules * seconds
+    return {
+        "sites": n_sites,
+        "modules": n_modules,
+        "history_s": history_s,
+        "seconds": seconds,
+        "packets": n_packets,
+        "elapsed_s": round(elapsed, 4),
+        "pkt_per_s": round(n_packets / elapsed, 1),
+        "stages": timer.summary(),
+    }
+
+
+_REF_ARRAY = np.arange(4096, dtype=np.float64)
+
+
+def reference_work() -> None:
+    """
+    Makine hızı ölçüsü olarak zamanlanan sabit iş yükü (pipeline'a benzer dict/str döngüsü + küçük numpy).
+    """
+    rnd = random.Random(0)
+    d: Dict[str, float] = {}
+    for i in range(1000):
+        k = f"k{i % 50}"
+        d[k] = d.get(k, 0.0) + rnd.random()
+    for _ in range(10):
+        np.median(_REF_ARRAY[::-1] * 1.5)
+
+
+def median_of(runs: List[dict]) -> dict:
+    """
+    Tekrarların medyanı: throughput ve aşama yüzdelikleri ayrı ayrı (tek bir gürültülü koşu
+    sonucu belirlemez).
+    """
+    out = dict(runs[0])
+    out["repeat"] = len(runs)
+    out["elapsed_s"] = round(float(np.median([r["elapsed_s"] for r in runs])), 4)
+    out["pkt_per_s"] = round(float(np.median([r["pkt_per_s"] for r in runs])), 1)
+    out["stages"] = {
+        k: dict(v, **{q: round(float(np.median([r["stages"][k][q] for r in runs])), 3) for q in ("p50_us", "p99_us", "total_ms")})
+        for k, v in out["stages"].items()
+    }
+    return out
+
+
+def _key(r: dict) -> str:
+    return f"{r['sites']}x{r['modules']}/h{r['history_s']}"
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    Baseline'a göre regresyonlar: throughput (1 - tol) altına düşerse veya bir aşamanın
+    p50'si (1 + tol) üstüne çıkarsa. Baseline süreleri konfigürasyonun referans p50 oranıyla
+    (scale = bu koşu / baseline) çarpılır, throughput bölünür. Yalnızca iki tarafta da bulunan
+    konfigürasyonlar ve aşamalar karşılaştırılır.
+    """
+    base = {_key(r): r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        ref, b_ref = r["stages"].get(REFERENCE), b["stages"].get(REFERENCE)
+        scale = ref["p50_us"] / b_ref["p50_us"] if ref and b_ref else 1.0
+        b_pps = b["pkt_per_s"] / scale
+        if r["pkt_per_s"] < b_pps * (1 - tolerance):
+            problems.append(f"{_key(r)} pkt/s {r['pkt_per_s']:,.0f} < baseline {b_pps:,.0f}")
+        for stage, s in r["stages"].items():
+            bs = b["stages"].get(stage)
+            if stage != REFERENCE and bs and s["p50_us"] > bs["p50_us"] * scale * (1 + tolerance) + MIN_DELTA_US:
+                problems.append(f"{_key(r)} {stage} p50 {s['p50_us']:.1f} us > baseline {bs['p50_us'] * scale:.1f} us")
+    return problems
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sites", type=_ints, default=[25, 100])
+    ap.add_argument("--modules", type=_ints, default=[4, 12])
+    ap.add_argument("--history", type=_ints, default=[60, 300], help="ölçüm öncesi simüle saniye")
+    ap.add_argument("--seconds", type=int, default=10, help="ölçülen simüle saniye")
+    ap.add_argument("--repeat", type=int, default=5, help="konfigürasyon başına tekrar (medyanı alınır)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--no-ui", action="store_true", help="refresh_ui aşamasını atla")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--save-baseline", action="store_true")
+    args = ap.parse_args()
+
+    ui = None if args.no_ui else _load_ui()
+    results = []
+    for n_sites in args.sites:
+        for n_modules in args.modules:
+            for history_s in args.history:
+                r = median_of(
+                    [run_config(n_sites, n_modules, history_s, args.seconds, args.seed, ui) for _ in range(args.repeat)]
+                )
+                results.append(r)
+                stages = "  ".join(f"{k}={v['p50_us']:.1f}/{v['p99_us']:.1f}" for k, v in r["stages"].items())
+                print(f"[bench_pipeline] {_key(r):>14}  {r['pkt_per_s']:>10,.0f} pkt/s  p50/p99 us: {stages}")
+
+    doc = {
+        "meta": {
+            "created_ts": int(time.time()),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=1)
+    print(f"[bench_pipeline] results -> {args.out}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=1)
+        print(f"[bench_pipeline] baseline -> {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("[bench_pipeline] no baseline; run with --save-baseline to create one")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        problems = compare(results, json.load(f)["results"], args.tolerance)
+    if problems:
+        for p in problems:
+            print(f"  REGRESSION {p}")
+        raise SystemExit(1)
+    print(f"[bench_pipeline] no regressions vs baseline (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
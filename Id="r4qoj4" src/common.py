@@ -1,16 +1,55 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 import json
+import struct
+import sys
+import numpy as np
+
+from ids import IDS
+
+# sık oluşturulan kayıtlar __slots__'lu (dict'siz); slots parametresi Python 3.10+
+SLOTS: Dict[str, bool] = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 REQUIRED_FIELDS = {"site_id", "module_id", "ts", "window_s", "steps_dir1", "steps_dir2"}
 
+# Binary wire format (v1): sabit uzunluklu, little-endian kayıt (vcap float32).
+# İlk byte versiyondur; JSON payload'lar '{' ile başladığından ikisi ilk byte'tan ayrılır.
+# Binary publisher'lar TOPIC + BIN_TOPIC_SUFFIX kullanır.
+BIN_VERSION = 1
+BIN_TOPIC_SUFFIX = "/bin"
+SITE_ID_LEN = 24
+MODULE_ID_LEN = 16
+FLAG_VCAP = 0x01
+
+_BIN_STRUCT = struct.Struct(f"<BBHqHHf{SITE_ID_LEN}s{MODULE_ID_LEN}s")
+BIN_PACKET_SIZE = _BIN_STRUCT.size
+
+PACKET_DTYPE = np.dtype(
+    [
+        ("version", "u1"),
+        ("flags", "u1"),
+        ("window_s", "<u2"),
+        ("ts", "<i8"),
+        ("steps_dir1", "<u2"),
+        ("steps_dir2", "<u2"),
+        ("vcap", "<f4"),
+        ("site_id", f"S{SITE_ID_LEN}"),
+        ("module_id", f"S{MODULE_ID_LEN}"),
+    ]
+)
+assert PACKET_DTYPE.itemsize == BIN_PACKET_SIZE
+
+# raw id bytes -> interned str (aynı id her pakette aynı str nesnesi)
+_ID_CACHE: Dict[bytes, str] = {}
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, **SLOTS)
 class StepPacket:
     """
     StepPacket: sensörden (veya fake publisher'dan) MQTT ile gelen tek pencere (window_s) özet verisi.
+    key: ids.IDS (site, modül) anahtarı; decode sırasında atanır, elle oluşturulan paketlerde -1.
     """
     site_id: str
     module_id: str
@@ -19,6 +58,11 @@ class StepPacket:
     steps_dir1: int
     steps_dir2: int
     vcap: Optional[float] = None # optional energy metric
+    key: int = field(default=-1, compare=False, repr=False)
+
+    def __reduce__(self):
+        # key süreç yereldir: başka process'e (pickle) taşınmaz
+        return (StepPacket, (self.site_id, self.module_id, self.ts, self.window_s, self.steps_dir1, self.steps_dir2, self.vcap))
 
 
 def decode_packet(payload: str) -> StepPacket:
@@ -39,14 +83,16 @@ def decode_packet(payload: str) -> StepPacket:
         raise ValueError(f"Missing fields: {sorted(missing)}")
 
     try:
+        site_id, module_id, key = IDS.resolve(str(obj["site_id"]), str(obj["module_id"]))
         pkt = StepPacket(
-            site_id=str(obj["site_id"]),
-            module_id=str(obj["module_id"]),
+            site_id=site_id,
+            module_id=module_id,
             ts=int(obj["ts"]),
             window_s=int(obj["window_s"]),
             steps_dir1=int(obj["steps_dir1"]),
             steps_dir2=int(obj["steps_dir2"]),
             vcap=float(obj["vcap"]) if "vcap" in obj and obj["vcap"] is not None else None,
+            key=key,
         )
     except Exception as e:
         raise ValueError(f"Bad field types: {e}") from e
@@ -75,4 +121,108 @@ def encode_packet(pkt: StepPacket) -> str:
     }
     if pkt.vcap is not None:
         d["vcap"] = pkt.vcap
-    return json.dumps(d, separators
+    return json.dumps(d, separators=(",", ":"))
+
+
+def _intern_id(raw: bytes) -> str:
+    name = _ID_CACHE.get(raw)
+    if name is None:
+        name = _ID_CACHE[raw] = sys.intern(raw.rstrip(b"\0").decode("utf-8"))
+    return name
+
+
+def encode_packet_bin(pkt: StepPacket) -> bytes:
+    """
+    StepPacket -> sabit uzunluklu binary kayıt (BIN_PACKET_SIZE byte)
+    """
+    site = pkt.site_id.encode("utf-8")
+    module = pkt.module_id.encode("utf-8")
+    if len(site) > SITE_ID_LEN or len(module) > MODULE_ID_LEN:
+        raise ValueError(f"site_id/module_id too long for binary format ({SITE_ID_LEN}/{MODULE_ID_LEN} bytes)")
+    try:
+        return _BIN_STRUCT.pack(
+            BIN_VERSION,
+            FLAG_VCAP if pkt.vcap is not None else 0,
+            pkt.window_s,
+            pkt.ts,
+            pkt.steps_dir1,
+            pkt.steps_dir2,
+            pkt.vcap if pkt.vcap is not None else 0.0,
+            site,
+            module,
+        )
+    except struct.error as e:
+        raise ValueError(f"Field out of range for binary format: {e}") from e
+
+
+def decode_packet_bin(payload: bytes) -> StepPacket:
+    """
+    Binary kayıt -> StepPacket
+    Format hatalarında ValueError fırlatır.
+    """
+    if len(payload) != BIN_PACKET_SIZE:
+        raise ValueError(f"Binary packet must be {BIN_PACKET_SIZE} bytes, got {len(payload)}")
+    version, flags, window_s, ts, s1, s2, vcap, site, module = _BIN_STRUCT.unpack(payload)
+    if version != BIN_VERSION:
+        raise ValueError(f"Unsupported binary version: {version}")
+    if window_s <= 0:
+        raise ValueError("window_s must be > 0")
+    if ts <= 0:
+        raise ValueError("ts must be a Unix epoch seconds integer > 0")
+
+    site_id, module_id, key = IDS.resolve(_intern_id(site), _intern_id(module))
+    return StepPacket(
+        site_id=site_id,
+        module_id=module_id,
+        ts=ts,
+        window_s=window_s,
+        steps_dir1=s1,
+        steps_dir2=s2,
+        vcap=vcap if flags & FLAG_VCAP else None,
+        key=key,
+    )
+
+
+def decode_payload(payload: bytes) -> StepPacket:
+    """
+    MQTT payload -> StepPacket. İlk byte'a göre binary veya JSON decoder seçilir.
+    """
+    if payload[:1] == bytes((BIN_VERSION,)):
+        return decode_packet_bin(payload)
+    return decode_packet(payload.decode("utf-8"))
+
+
+def decode_batch_bin(buf: bytes) -> Dict[str, Any]:
+    """
+    Art arda eklenmiş binary kayıtlar -> kolon dizileri (paket başına nesne oluşturmadan).
+    Returns: ts, window_s, steps_dir1, steps_dir2, vcap (yoksa NaN) dizileri;
+    site_idx/module_idx ile bunların indekslediği sites/modules isim listeleri.
+    """
+    if len(buf) % BIN_PACKET_SIZE:
+        raise ValueError(f"Buffer length {len(buf)} is not a multiple of {BIN_PACKET_SIZE}")
+    arr = np.frombuffer(buf, dtype=PACKET_DTYPE)
+
+    if arr.size and not (arr["version"] == BIN_VERSION).all():
+        raise ValueError("Unsupported binary version in batch")
+    if (arr["window_s"] == 0).any():
+        raise ValueError("window_s must be > 0")
+    if (arr["ts"] <= 0).any():
+        raise ValueError("ts must be a Unix epoch seconds integer > 0")
+
+    site_raw, site_idx = np.unique(arr["site_id"], return_inverse=True)
+    mod_raw, mod_idx = np.unique(arr["module_id"], return_inverse=True)
+    sites: List[str] = [_intern_id(bytes(x)) for x in site_raw]
+    modules: List[str] = [_intern_id(bytes(x)) for x in mod_raw]
+
+    has_vcap = (arr["flags"] & FLAG_VCAP) != 0
+    return {
+        "ts": arr["ts"],
+        "window_s": arr["window_s"],
+        "steps_dir1": arr["steps_dir1"],
+        "steps_dir2": arr["steps_dir2"],
+        "vcap": np.where(has_vcap, arr["vcap"], np.nan),
+        "site_idx": site_idx,
+        "module_idx": mod_idx,
+        "sites": sites,
+        "modules": modules,
+    }
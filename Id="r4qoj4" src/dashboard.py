@@ -2,8 +2,10 @@ from __future__ import annotations
 """
 Dashboard:
 - MQTT'den StepPacket alır
-- health + fusion + anomaly çalıştırır
+- health + fusion + rollup + anomaly çalıştırır
 - Dash/Plotly ile canlı grafik + alarm listesi basar
+- EXPORT_GATEWAY_ID verilirse gateway olarak merkeze (aggregator.py) export eder
+- OUTBOUND_ENABLED ise fused akışı ve alarm olaylarını dış tüketicilere MQTT ile yayınlar (outbound.py)
 
 ÇALIŞTIRMA (Windows/Anaconda Prompt):
   python src/dashboard.py
@@ -13,95 +15,383 @@ Gerekenler:
 - requirements kurulmuş
 """
 
+import functools
+import os
 import threading
 import time
-from collections import deque, defaultdict
+from collections import defaultdict
 
 import paho.mqtt.client as mqtt
-from dash import Dash, html, dcc
-from dash.dependencies import Input, Output
+from dash import Dash, html, dcc, no_update
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+import numpy as np
 import plotly.graph_objects as go
-
-from common import decode_packet
-from anomaly import detect
-from fusion import ingest, fuse_ready
-from health import health_alerts_for_packet, check_offline, check_outliers, HealthThresholds
+from flask import Response, request
+
+import anomaly
+import fusion
+import health
+from alerts import AlertEngine
+from common import decode_payload, BIN_TOPIC_SUFFIX
+from federation import GatewayExporter, MqttSink, SocketSink
+from outbound import OutboundPublisher
+from fusion import FUSED_FIELDS, FUSED_HISTORY, pop_corrections
+from history import HistoryStore
+from ringbuf import RingBuffer
+from pipeline import process_packets, process_tick, health_sweep
+from rollup import ROLLUPS, aggregate, pick_resolution
+from sharded import ShardedPipeline
+from view import Memo, ViewPublisher, module_rows_of
+from snapshot import restore, write_snapshot
+from ingest_queue import IngestQueue
+from metrics import METRICS, PROFILER
 
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
 TOPIC = "piyon/v1/steps"
 
-FLOW_BUF = defaultdict(lambda: deque(maxlen=600)) # site_id -> (ts, flow, ratio, n_used)
-ALERT_BUF = deque(maxlen=300) # list of dict
-MODULE_LAST = {} # (site, mod) -> last dict
-
-HEALTH_THR = HealthThresholds()
+FLOW_BUF_LEN = 600
+FLOW_BUF = defaultdict(lambda: RingBuffer(FLOW_BUF_LEN, FUSED_FIELDS, ts_field="ts")) # site_id -> (ts, flow, ratio, n_used)
+ALERTS = AlertEngine() # ham alarmlar -> open/ongoing/resolved olayları + indeksli depo (ALERTS.store)
+ALERT_LOCK = threading.Lock() # push_alerts birden çok thread'den çağrılır
+MODULE_LAST = defaultdict(dict) # site -> mod -> last dict (MQTT thread yazar)
+MODULE_DIRTY = set() # son görünüm yayınından beri paket gelen siteler
+
+# Dash callback'leri canlı global'ler yerine tick başına yayınlanan değişmez görünümü okur;
+# figür/panel çıktıları (site, versiyon) anahtarıyla tüm istemciler arasında paylaşılır
+VIEWS = ViewPublisher()
+RENDER_MEMO = Memo(maxsize=512)
+
+# grafik aralıkları: "live" FLOW_BUF'tan artımlı (extendData), diğerleri tam figür; aralık
+# GRAPH_MAX_POINTS'i aşmayan en ince rollup çözünürlüğünden okunur (rollup.pick_resolution)
+GRAPH_RANGES = {"live": ("Canlı", 0), "15m": ("15 dk", 900), "24h": ("24 saat", 86400), "7d": ("7 gün", 7 * 86400)}
+GRAPH_MAX_POINTS = 300
+
+# kalıcı geçmiş: fused noktalar, modül toplamları, alarmlar (repo root'tan çalıştırılınca data/history)
+HISTORY_DIR = "data/history"
+HISTORY_FLUSH_S = 5
+HISTORY_MAINT_S = 3600
+HISTORY = None # HistoryStore (main() içinde açılır)
+
+# anomali model state'i (seasonal + EWMA): açılışta yüklenir, periyodik yazılır
+SNAPSHOT_PATH = "data/model_snapshot.bin"
+SNAPSHOT_EVERY_S = 300
+
+FUSE_TICK_S = 0.5 # ready bucket kontrol periyodu
+HEALTH_SWEEP_S = 3
+PIPELINE_LOCK = threading.Lock() # pipeline state: mqtt thread <-> fusion/health tick thread'leri
+
+INGEST_SHARDS = 0 # >0: health/fusion/anomaly site bazında bu kadar worker process'te çalışır
+SHARDS = None # ShardedPipeline (main() içinde kurulur)
+
+# merkez düğüme (aggregator.py) export: fused noktalar, sağlık özetleri, model state'i
+EXPORT_GATEWAY_ID = None # ör. "GW_KADIKOY"; None: export kapalı
+EXPORT_TRANSPORT = "mqtt" # "mqtt": EXPORT_ADDR'deki broker (FED_TOPIC/<id>), "socket": aggregator --listen
+EXPORT_ADDR = (MQTT_HOST, MQTT_PORT)
+EXPORT_EVERY_S = 2
+EXPORT_HEALTH_EVERY_S = 10
+EXPORT_MODEL_EVERY_S = 60
+EXPORT_SITE_IDLE_S = 30 # bu kadar sn fused noktası gelmeyen site export watermark'ını tutmaz
+EXPORTER = None # GatewayExporter (main() içinde kurulur)
+
+# dış tüketicilere çıkış: site başına batch'lenmiş fused akış + alarm olayları (OUT_TOPIC/flow|alerts/<site>)
+OUTBOUND_ENABLED = False
+OUTBOUND_ADDR = (MQTT_HOST, MQTT_PORT)
+OUTBOUND_QOS = 1
+OUTBOUND_FLUSH_S = 5.0 # fused batch penceresi
+OUTBOUND_ALERT_FLUSH_S = 1.0
+OUTBOUND_OUTBOX_DIR = "data/outbox" # broker kesintisinde batch'lerin bekletildiği dizin
+OUTBOUND = None # OutboundPublisher (main() içinde kurulur)
+
+# MQTT callback -> işleme thread'i arası sınırlı kuyruk
+INGEST_QUEUE = IngestQueue(maxsize=20000, policy="drop_oldest")
+INGEST_BATCH = 1024
+
+
+def push_alerts(alerts) -> None:
+    """
+    Ham alarmları alarm motorundan geçirir; tekrarlar bastırılır, yalnızca yaşam döngüsü
+    olayları (open/ongoing/resolved) depolanır. Boş liste de çağrılabilir (süresi dolanları çözer).
+    """
+    for a in alerts:
+        METRICS.inc("alerts_total", type=a.get("type", ""))
+    with ALERT_LOCK:
+        events = ALERTS.process(alerts, int(time.time()))
+    for ev in events:
+        METRICS.inc("alert_events_total", type=ev["type"], state=ev["state"])
+    if HISTORY is not None and events:
+        HISTORY.add_alerts(ev for ev in events if ev["state"] != "resolved")
+    if OUTBOUND is not None and events:
+        OUTBOUND.add_alerts(events)
 
 
 def mqtt_worker():
     def on_message(client, userdata, msg):
         try:
-            pkt = decode_packet(msg.payload.decode("utf-8"))
+            t0 = time.perf_counter()
+            pkt = decode_payload(msg.payload)
+            METRICS.observe("decode", time.perf_counter() - t0)
+            METRICS.inc("packets_received_total")
 
-            MODULE_LAST[(pkt.site_id, pkt.module_id)] = {
+            MODULE_LAST[pkt.site_id][pkt.module_id] = {
                 "ts": pkt.ts,
                 "steps1": pkt.steps_dir1,
                 "steps2": pkt.steps_dir2,
                 "vcap": pkt.vcap,
             }
+            MODULE_DIRTY.add(pkt.site_id)
 
-            # packet-level health checks (stuck vs)
-            for a in health_alerts_for_packet(pkt, HEALTH_THR):
-                a["ts"] = pkt.ts
-                ALERT_BUF.appendleft(a)
-
-            ingest(pkt)
-
-            # fuse any ready buckets
-            for (site_id, ts, flow, ratio, n_used) in fuse_ready(now_ts=int(time.time())):
-                FLOW_BUF[site_id].append((ts, flow, ratio, n_used))
-
-                # anomaly expects steps1/steps2, we reconstruct from fused flow+ratio
-                s1 = int(round(flow * ratio))
-                s2 = int(round(flow * (1.0 - ratio)))
-
-                alerts, dbg = detect(site_id, s1, s2, 1, ts)
-                for a in alerts:
-                    a["ts"] = ts
-                    a["site_id"] = site_id
-                    a["n_used"] = n_used
-                    ALERT_BUF.appendleft(a)
+            # işleme ingest_processor thread'inde; paho network loop'u bloklanmaz
+            INGEST_QUEUE.put(pkt)
 
         except Exception as e:
-            ALERT_BUF.appendleft({"type": "BAD_MSG", "error": str(e), "ts": int(time.time())})
+            METRICS.inc("bad_msgs_total")
+            push_alerts([{"type": "BAD_MSG", "error": str(e), "ts": int(time.time())}])
 
     client = mqtt.Client()
     client.on_message = on_message
     client.connect(MQTT_HOST, MQTT_PORT, 60)
-    client.subscribe(TOPIC)
+    client.subscribe([(TOPIC, 0), (TOPIC + BIN_TOPIC_SUFFIX, 0)])
     client.loop_forever()
 
 
+def ingest_processor():
+    """
+    INGEST_QUEUE'dan batch'ler halinde paket çekip pipeline'a (veya shard'lara) verir.
+    """
+    while True:
+        batch = INGEST_QUEUE.get_batch(INGEST_BATCH, timeout=0.5)
+        if not batch:
+            continue
+        try:
+            if HISTORY is not None:
+                HISTORY.add_packets(batch)
+            with PIPELINE_LOCK:
+                if SHARDS is not None:
+                    for pkt in batch:
+                        SHARDS.submit(pkt)
+                    continue
+                alerts = process_packets(batch)
+            push_alerts(alerts)
+        except Exception as e:
+            push_alerts([{"type": "PIPELINE_ERROR", "error": str(e), "ts": int(time.time())}])
+
+
+def periodic_fusion():
+    """
+    Kapanan bucket'ları on_message yerine sabit periyotta fuse eder ve anomali tespitini çalıştırır.
+    """
+    prev_ts = int(time.time())
+    while True:
+        try:
+            now_ts = int(time.time())
+            if SHARDS is not None:
+                with PIPELINE_LOCK:
+                    SHARDS.tick(now_ts)
+                fused, alerts = SHARDS.drain()
+                with PIPELINE_LOCK:
+                    # worker'ların rollup'ları bu process'te görünmez: dashboard kendi kopyasını tutar
+                    ROLLUPS.update(fused)
+                # drain() önceki tick'in sonuçlarını garanti eder, bu tick'inkini değil
+                export_ts = prev_ts
+            else:
+                with PIPELINE_LOCK:
+                    fused, alerts = process_tick(now_ts)
+                    corrections = pop_corrections()
+                if corrections and HISTORY is not None:
+                    HISTORY.add_corrections(corrections)
+                export_ts = now_ts
+            prev_ts = now_ts
+
+            if EXPORTER is not None:
+                EXPORTER.add_fused(fused, export_ts, fusion.THR.close_lag_s)
+            if OUTBOUND is not None:
+                OUTBOUND.add_fused(fused)
+            for (site_id, ts, flow, ratio, n_used) in fused:
+                FLOW_BUF[site_id].append(ts, flow, ratio, n_used)
+            if HISTORY is not None:
+                HISTORY.add_fused(fused)
+            push_alerts(alerts)
+            publish_view({row[0] for row in fused})
+        except Exception as e:
+            push_alerts([{"type": "FUSION_ERROR", "error": str(e), "ts": int(time.time())}])
+
+        time.sleep(FUSE_TICK_S)
+
+
+def publish_view(flow_changed) -> None:
+    """
+    Tick sonunda değişmez görünümü yayınlar (yalnızca periodic_fusion thread'inden; FLOW_BUF'ın tek yazarı).
+    """
+    dirty = set()
+    while MODULE_DIRTY:
+        try:
+            dirty.add(MODULE_DIRTY.pop())
+        except KeyError:
+            break
+    VIEWS.publish(FLOW_BUF, flow_changed, module_rows_of(dirty, MODULE_LAST), ALERTS.store.seq)
+
+
+def periodic_export():
+    """
+    Bekleyen fused noktaları her EXPORT_EVERY_S'de, değişen sağlık özetlerini ve model state'ini
+    daha seyrek merkeze gönderir. Sharded modda health/model state'i worker'lardadır: yalnızca fused.
+    """
+    if EXPORT_TRANSPORT == "mqtt":
+        sink = MqttSink(EXPORT_GATEWAY_ID, *EXPORT_ADDR)
+    else:
+        sink = SocketSink(*EXPORT_ADDR)
+    last_health = last_model = 0.0
+    while True:
+        time.sleep(EXPORT_EVERY_S)
+        try:
+            t0 = time.perf_counter()
+            frames = EXPORTER.fused_frames()
+            now = time.time()
+            if SHARDS is None and now - last_health >= EXPORT_HEALTH_EVERY_S:
+                with PIPELINE_LOCK:
+                    frames.append(EXPORTER.health_frame(full=not last_health))
+                last_health = now
+            if SHARDS is None and now - last_model >= EXPORT_MODEL_EVERY_S:
+                with PIPELINE_LOCK:
+                    frames.append(EXPORTER.model_frame())
+                last_model = now
+            for f in frames:
+                if f is not None:
+                    sink.send(f)
+                    METRICS.inc("export_bytes_total", len(f))
+            METRICS.observe("export", time.perf_counter() - t0)
+        except Exception as e:
+            push_alerts([{"type": "EXPORT_ERROR", "error": str(e), "ts": int(time.time())}])
+
+
 def periodic_health_checks():
     while True:
         now_ts = int(time.time())
 
-        # offline check
-        for a in check_offline(now_ts, HEALTH_THR):
-            a["ts"] = now_ts
-            ALERT_BUF.appendleft(a)
+        # sharded modda sonuçlar periodic_fusion'daki drain() ile gelir
+        with PIPELINE_LOCK:
+            if SHARDS is not None:
+                SHARDS.health_sweep(now_ts)
+            else:
+                push_alerts(health_sweep(now_ts))
 
-        # outlier check per site
-        sites = {s for (s, _) in MODULE_LAST.keys()}
-        for s in sites:
-            for a in check_outliers(s, HEALTH_THR):
-                a["ts"] = now_ts
-                ALERT_BUF.appendleft(a)
+        time.sleep(HEALTH_SWEEP_S)
 
-        time.sleep(3)
+
+def periodic_history():
+    """
+    Geçmiş tamponlarını diske yazar; saatlik retention + compaction.
+    """
+    last_maint = 0.0
+    while True:
+        time.sleep(HISTORY_FLUSH_S)
+        try:
+            HISTORY.flush()
+            if time.time() - last_maint >= HISTORY_MAINT_S:
+                HISTORY.maintenance(int(time.time()))
+                last_maint = time.time()
+        except Exception as e:
+            push_alerts([{"type": "HISTORY_ERROR", "error": str(e), "ts": int(time.time())}])
+
+
+def periodic_snapshot():
+    """
+    Model state'ini arka planda snapshot'lar; kilit yalnızca kısa satır parçaları için tutulur.
+    """
+    while True:
+        time.sleep(SNAPSHOT_EVERY_S)
+        try:
+            if SHARDS is not None:
+                SHARDS.snapshot(SNAPSHOT_PATH)
+            else:
+                write_snapshot(SNAPSHOT_PATH, lock=PIPELINE_LOCK)
+        except Exception as e:
+            push_alerts([{"type": "SNAPSHOT_ERROR", "error": str(e), "ts": int(time.time())}])
+
+
+def _memory_bytes():
+    """
+    Başlıca yapıların yaklaşık bellek kullanımı (NumPy tamponları).
+    """
+    return {
+        "flow_buf": sum(rb.nbytes for rb in list(FLOW_BUF.values())),
+        "fused_history": sum(rb.nbytes for rb in list(FUSED_HISTORY.values())),
+        "rollups": ROLLUPS.nbytes,
+        "health_totals": health.TOTALS.nbytes,
+        "seasonal_store": anomaly.SEASONAL_STORE.stats.nbytes,
+        "ewma_store": anomaly.EWMA_STORE.state.nbytes,
+    }
+
+
+METRICS.gauge("ingest_queue", INGEST_QUEUE.metrics, "Ingest queue depth/lag and drop counters")
+METRICS.gauge(
+    "open_buckets",
+    lambda: {"buckets": sum(len(b) for b in list(fusion.BUCKETS.values())), "heap": len(fusion.BUCKET_HEAP)},
+    "Open fusion buckets",
+)
+METRICS.gauge(
+    "health_modules",
+    lambda: {"known": len(health.MODULES), "offline": len(health.OFFLINE), "heap": len(health.OFFLINE_HEAP)},
+    "Tracked modules",
+)
+METRICS.gauge("memory_bytes", _memory_bytes, "Approximate memory per structure")
+METRICS.gauge(
+    "view",
+    lambda: {"version": VIEWS.current.version, "sites": len(VIEWS.current.sites), "memo_hits": RENDER_MEMO.hits, "memo_misses": RENDER_MEMO.misses},
+    "Published dashboard view and render cache",
+)
+METRICS.gauge(
+    "alerts",
+    lambda: {"active": len(ALERTS.active), "stored": len(ALERTS.store), "suppressed": ALERTS.suppressed, "rate_limited": ALERTS.rate_limited},
+    "Alert engine state",
+)
+METRICS.gauge(
+    "outbound",
+    lambda: OUTBOUND.metrics() if OUTBOUND is not None else {},
+    "Outbound MQTT publisher (batches, outbox, unacked)",
+)
+
+
+def _timed(stage):
+    """
+    Dash callback'lerinin süresini (PreventUpdate dahil) METRICS'e yazar.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                METRICS.observe(stage, time.perf_counter() - t0)
+        return wrapper
+    return deco
 
 
 app = Dash(__name__)
+
+
+@app.server.route("/metrics")
+def metrics_endpoint():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.server.route("/debug/profile")
+def profile_endpoint():
+    """
+    ?action=start|stop|clear; yanıt: collapsed stack'ler (flamegraph girdisi).
+    """
+    action = request.args.get("action")
+    if action == "start":
+        PROFILER.start()
+    elif action == "stop":
+        PROFILER.stop()
+    elif action == "clear":
+        PROFILER.clear()
+    return Response(PROFILER.collapsed(), mimetype="text/plain")
+
 app.layout = html.Div(
     [
         html.H2("PİYON — Canlı Yoğunluk & Anomali Dashboard"),
@@ -111,12 +401,26 @@ app.layout = html.Div(
             ],
             style={"width": "420px"},
         ),
+        dcc.RadioItems(
+            id="range-select",
+            options=[{"label": label, "value": key} for key, (label, _) in GRAPH_RANGES.items()],
+            value="live",
+            inline=True,
+        ),
         dcc.Graph(id="flow-graph"),
         dcc.Interval(id="tick", interval=1000, n_intervals=0),
+        # istemci başına son gönderilen durum: artımlı güncelleme ve panel değişim tespiti
+        dcc.Store(id="graph-state"),
+        dcc.Store(id="panel-state"),
         html.H4("Son Alarmlar"),
         html.Div(id="alerts"),
         html.H4("Modül Durumu (son paket)"),
         html.Div(id="modules"),
+        html.H4("Ingest Kuyruğu"),
+        html.Div(id="ingest"),
+        html.H4("Metrikler"),
+        dcc.Checklist(id="profiler-toggle", options=[{"label": "Sampling profiler", "value": "on"}], value=[]),
+        html.Pre(id="metrics", style={"fontSize": "12px"}),
     ],
     style={"fontFamily": "Arial", "margin": "18px"},
 )
@@ -129,65 +433,258 @@ app.layout = html.Div(
     Input("site-select", "value"),
 )
 def refresh_sites(_, current):
-    sites = sorted(FLOW_BUF.keys())
-    opts = [{"label": s, "value": s} for s in sites]
-    if current in sites:
+    view = VIEWS.current
+    opts = list(view.site_options)
+    if current in view.by_site:
         return opts, current
-    return opts, (sites[0] if sites else None)
+    return opts, (view.sites[0] if view.sites else None)
+
+
+def _build_figure(site_id, ts, flow, ratio, peak=None):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=ts, y=flow, mode="lines+markers", name="Flow (fused)" if peak is None else "Flow (ort.)"))
+    if peak is not None:
+        fig.add_trace(go.Scatter(x=ts, y=peak, mode="lines", name="Flow (maks.)", line=dict(dash="dot")))
+    fig.add_trace(go.Scatter(x=ts, y=ratio, mode="lines", name="Dir1 Ratio", yaxis="y2"))
+    fig.update_layout(
+        title=f"Site: {site_id}",
+        xaxis_title="Unix Time (s)",
+        yaxis_title="Flow (steps/s proxy)",
+        yaxis2=dict(title="Dir1 Ratio", overlaying="y", side="right", range=[0, 1]),
+        height=420,
+    )
+    return fig
+
+
+def _range_data(sv, site_id, range_key):
+    """
+    Seçilen aralığın (ts, flow, ratio, peak) dizileri. Canlı mod görünümdeki ham noktalar (peak=None);
+    diğerleri rollup periyotları: flow = periyot ortalaması, peak = periyot maksimumu.
+    Rollup ring'lerinden eski kısım (ör. yeniden başlatma sonrası) HISTORY'den toplanır.
+    """
+    if range_key == "live":
+        d = sv.flow
+        return d["ts"].tolist(), d["flow"].tolist(), d["ratio"].tolist(), None
+    span = GRAPH_RANGES[range_key][1]
+    res = pick_resolution(span, GRAPH_MAX_POINTS)
+    last_ts = sv.last_ts
+    t0 = (last_ts - span) // res * res
+
+    parts = []
+    first = ROLLUPS.earliest(site_id, res)
+    if HISTORY is not None and (first is None or first > t0):
+        # rollup'ın ilk periyodu yarım olabilir: o periyot da HISTORY'den toplanır
+        t_split = last_ts + 1 if first is None else first + res
+        h = HISTORY.query_fused(site_id, t0, t_split - 1)
+        if len(h):
+            parts.append(aggregate(h["ts"], h["flow"], h["ratio"], res))
+        t0 = t_split
+    with PIPELINE_LOCK:
+        d = ROLLUPS.query(site_id, t0, last_ts, res)
+    if d is not None:
+        parts.append(d)
+    if not parts:
+        return [], [], [], []
+    cols = {k: np.concatenate([p[k] for p in parts]) for k in ("ts", "mean", "ratio", "max")}
+    return cols["ts"].tolist(), cols["mean"].tolist(), cols["ratio"].tolist(), cols["max"].tolist()
 
 
 @app.callback(
     Output("flow-graph", "figure"),
-    Output("alerts", "children"),
-    Output("modules", "children"),
+    Output("flow-graph", "extendData"),
+    Output("graph-state", "data"),
     Input("tick", "n_intervals"),
     Input("site-select", "value"),
+    Input("range-select", "value"),
+    State("graph-state", "data"),
 )
-def refresh_ui(_, site_id):
-    fig = go.Figure()
+@_timed("render_graph")
+def refresh_graph(_, site_id, range_key, state):
+    """
+    Site/aralık değişince tam figür; canlı modda sonraki tick'lerde yalnızca
+    istemcinin son ts'inden sonraki noktalar extendData ile eklenir.
+    """
+    view = VIEWS.current
+    sv = view.by_site.get(site_id) if site_id else None
+    if sv is None or sv.last_ts is None:
+        if state and state.get("site") is None:
+            raise PreventUpdate
+        fig = go.Figure()
+        fig.update_layout(title="Veri bekleniyor...", height=420)
+        return fig, no_update, {"site": None}
+
+    last_ts = sv.last_ts
+    same_view = bool(state) and state.get("site") == site_id and state.get("range") == range_key
+    if same_view and state.get("last_ts") == last_ts:
+        raise PreventUpdate
+
+    if same_view and range_key == "live":
+        def delta():
+            d = sv.since(state["last_ts"] + 1)
+            ts = d["ts"].tolist()
+            return ({"x": [ts, ts], "y": [d["flow"].tolist(), d["ratio"].tolist()]}, [0, 1], FLOW_BUF_LEN)
+
+        ext = RENDER_MEMO.get(("extend", site_id, state["last_ts"], sv.version), delta)
+        return no_update, ext, {"site": site_id, "range": range_key, "last_ts": last_ts}
+
+    if same_view:
+        # rollup görünümü: bir periyot kadar yeni veri birikince yenile
+        step = pick_resolution(GRAPH_RANGES[range_key][1], GRAPH_MAX_POINTS)
+        if last_ts - state["last_ts"] < step:
+            raise PreventUpdate
+
+    fig = RENDER_MEMO.get(
+        ("figure", site_id, range_key, sv.version),
+        lambda: _build_figure(site_id, *_range_data(sv, site_id, range_key)),
+    )
+    return fig, no_update, {"site": site_id, "range": range_key, "last_ts": last_ts}
+
+
+def _alert_items(site_id):
+    with ALERT_LOCK:
+        events = ALERTS.store.query(site_id=site_id, limit=12)
+    return [
+        html.Div(
+            f"{e['ts']} [{e['state']}] {e['type']} {e['site_id']}/{e['module_id']} x{e['count']}"
+            + ("" if e["value"] != e["value"] else f" value={e['value']:.2f}")
+            + (f" error={e['error']}" if "error" in e else ""),
+            style={"borderBottom": "1px solid #ddd", "padding": "6px 0"},
+        )
+        for e in events
+    ]
+
 
-    # graph
-    if site_id and site_id in FLOW_BUF and len(FLOW_BUF[site_id]) > 0:
-        data = list(FLOW_BUF[site_id])
-        ts = [x[0] for x in data]
-        flow = [x[1] for x in data]
-        ratio = [x[2] for x in data]
-
-        fig.add_trace(go.Scatter(x=ts, y=flow, mode="lines+markers", name="Flow (fused)"))
-        fig.add_trace(go.Scatter(x=ts, y=ratio, mode="lines", name="Dir1 Ratio", yaxis="y2"))
-        fig.update_layout(
-            title=f"Site: {site_id}",
-            xaxis_title="Unix Time (s)",
-            yaxis_title="Flow (steps/s proxy)",
-            yaxis2=dict(title="Dir1 Ratio", overlaying="y", side="right", range=[0, 1]),
-            height=420,
+def _module_items(view, site_id):
+    if site_id is None:
+        rows = [r for s in view.sites for r in view.by_site[s].modules[:25]][:25]
+    else:
+        sv = view.by_site.get(site_id)
+        rows = sv.modules[:25] if sv is not None else ()
+    return [
+        html.Div(
+            f"{s}/{m} ts={ts} s1={s1} s2={s2} vcap={vcap}",
+            style={"borderBottom": "1px solid #eee", "padding": "4px 0"},
         )
+        for (s, m, ts, s1, s2, vcap) in rows
+    ]
+
+
+@app.callback(
+    Output("alerts", "children"),
+    Output("modules", "children"),
+    Output("panel-state", "data"),
+    Input("tick", "n_intervals"),
+    Input("site-select", "value"),
+    State("panel-state", "data"),
+)
+@_timed("render_panels")
+def refresh_panels(_, site_id, state):
+    """
+    Alarm/modül panelleri yalnızca içerikleri değiştiğinde gönderilir.
+    """
+    state = state or {}
+    view = VIEWS.current
+
+    # module status rows
+    if site_id is None:
+        mod_sig = ["all", view.version]
     else:
-        fig.update_layout(title="Veri bekleniyor...", height=420)
+        sv = view.by_site.get(site_id)
+        mod_sig = [site_id, sv.modules_version if sv is not None else None]
+    alert_seq = [site_id, view.alert_seq]
+
+    alert_items = no_update
+    if state.get("alerts") != alert_seq:
+        alert_items = RENDER_MEMO.get(("alerts",) + tuple(alert_seq), lambda: _alert_items(site_id))
+
+    mod_items = no_update
+    if state.get("modules") != mod_sig:
+        mod_items = RENDER_MEMO.get(("modules",) + tuple(mod_sig), lambda: _module_items(view, site_id))
+
+    if alert_items is no_update and mod_items is no_update:
+        raise PreventUpdate
+    return alert_items, mod_items, {"alerts": alert_seq, "modules": mod_sig}
+
+
+@app.callback(
+    Output("ingest", "children"),
+    Input("tick", "n_intervals"),
+)
+def refresh_ingest(_):
+    m = INGEST_QUEUE.metrics()
+    return (
+        f"depth={m['depth']} max={m['max_depth']} lag={m['lag_s']:.2f}s "
+        f"in={m['enqueued']} out={m['dequeued']} dropped={m['dropped']} coalesced={m['coalesced']} "
+        f"batch={m['last_batch_size']} batch_lag={m['last_batch_lag_s']:.2f}s"
+    )
+
+
+@app.callback(
+    Input("profiler-toggle", "value"),
+    prevent_initial_call=True,
+)
+def toggle_profiler(profiler):
+    """
+    Profiler yalnızca kutu değiştiğinde başlatılır/durdurulur: tick'te değil, böylece
+    /debug/profile ile başlatılan profil ve farklı sekmelerin kutu durumu birbirini ezmez.
+    """
+    if "on" in (profiler or []):
+        PROFILER.start()
+    elif PROFILER.running:
+        PROFILER.stop()
 
-    # alerts list
-    alert_items = []
-    for a in list(ALERT_BUF)[:12]:
-        alert_items.append(html.Div(str(a), style={"borderBottom": "1px solid #ddd", "padding": "6px 0"}))
-
-    # module status list
-    mod_items = []
-    items = [(k, v) for k, v in MODULE_LAST.items() if (site_id is None or k[0] == site_id)]
-    items = sorted(items, key=lambda kv: (kv[0][0], kv[0][1]))
-    for (s, m), v in items[:25]:
-        mod_items.append(
-            html.Div(
-                f"{s}/{m} ts={v['ts']} s1={v['steps1']} s2={v['steps2']} vcap={v.get('vcap')}",
-                style={"borderBottom": "1px solid #eee", "padding": "4px 0"},
-            )
-        )
 
-    return fig, alert_items, mod_items
+@app.callback(
+    Output("metrics", "children"),
+    Input("tick", "n_intervals"),
+)
+def refresh_metrics(_):
+    """
+    Aşama gecikmeleri, sayaçlar ve (açıksa) profiler'ın en sıcak fonksiyonları.
+    """
+    lines = [f"{'stage':<16}{'count':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+    for stage, st in METRICS.stage_summary().items():
+        lines.append(f"{stage:<16}{st['count']:>10}{st['p50'] * 1e3:>10.3f}{st['p99'] * 1e3:>10.3f}")
+    lines.append("")
+    for (name, labels), v in sorted(METRICS.counter_values().items()):
+        label = ",".join(f"{k}={x}" for k, x in labels)
+        lines.append(f"{name}{'{' + label + '}' if label else ''} = {v:g}")
+    mem = _memory_bytes()
+    lines.append("memory: " + "  ".join(f"{k}={v / 1e6:.1f}MB" for k, v in mem.items()))
+    if PROFILER.samples:
+        lines.append("")
+        lines.append(f"profiler ({PROFILER.samples} samples):")
+        lines.extend(f"  {share:6.1%}  {fn}" for fn, share in PROFILER.top(10))
+    return "\n".join(lines)
 
 
 def main():
+    global SHARDS, HISTORY, EXPORTER, OUTBOUND
+    HISTORY = HistoryStore(HISTORY_DIR)
+    if INGEST_SHARDS > 0:
+        SHARDS = ShardedPipeline(INGEST_SHARDS, snapshot_path=SNAPSHOT_PATH)
+    elif os.path.exists(SNAPSHOT_PATH):
+        restore([SNAPSHOT_PATH])
+    # periodic_fusion ilk tick'ten itibaren dışa aktarır/yayınlar: exporter ve outbound
+    # publisher thread'lerden önce kurulur
+    if EXPORT_GATEWAY_ID:
+        EXPORTER = GatewayExporter(EXPORT_GATEWAY_ID, site_idle_s=EXPORT_SITE_IDLE_S)
+    if OUTBOUND_ENABLED:
+        OUTBOUND = OutboundPublisher(
+            *OUTBOUND_ADDR,
+            qos=OUTBOUND_QOS,
+            flush_s=OUTBOUND_FLUSH_S,
+            alert_flush_s=OUTBOUND_ALERT_FLUSH_S,
+            outbox_dir=OUTBOUND_OUTBOX_DIR,
+        ).start()
     threading.Thread(target=mqtt_worker, daemon=True).start()
+    threading.Thread(target=ingest_processor, daemon=True).start()
+    threading.Thread(target=periodic_fusion, daemon=True).start()
     threading.Thread(target=periodic_health_checks, daemon=True).start()
+    threading.Thread(target=periodic_history, daemon=True).start()
+    threading.Thread(target=periodic_snapshot, daemon=True).start()
+    if EXPORTER is not None:
+        threading.Thread(target=periodic_export, daemon=True).start()
     app.run_server(debug=False)
 
 
@@ -3,16 +3,26 @@ from __future__ import annotations
 Fake publisher:
 - Sensör yokken MQTT'ye StepPacket basar
 - Demo için spike pencereleri üretir
+- --load: çok site x modül ile yük üretimi (çok process, önceden encode, burst publish,
+  spike/stuck/offline/outlier arıza enjeksiyonu, publish hızı ve gecikme yüzdelikleri)
 
 ÇALIŞTIRMA:
   python src/fake_publisher.py
+  python src/fake_publisher.py --load --sites 2000 --modules 20 --procs 4 --binary --duration 60
+  python src/fake_publisher.py --load --broker local     # Mosquitto yerine süreç içi broker (1883)
 """
 
+from typing import Dict, List
+import argparse
+import json
+import multiprocessing as mp
 import time
 import random
+import threading
+import numpy as np
 import paho.mqtt.client as mqtt
 
-from common import StepPacket, encode_packet
+from common import StepPacket, encode_packet, encode_packet_bin, BIN_TOPIC_SUFFIX, BIN_VERSION, PACKET_DTYPE
 
 MQTT_HOST = "127.0.0.1"
 MQTT_PORT = 1883
@@ -26,14 +36,29 @@ SPIKE_FLOW = 12
 SPIKE_EVERY_S = 30
 SPIKE_LEN_S = 5
 
+BINARY = False # True: compact binary format (TOPIC + BIN_TOPIC_SUFFIX)
 
-def main():
+
+# --load arıza tipleri: süreler health.HealthThresholds / anomaly eşiklerini aşacak şekilde
+FAULT_LEN_S = {
+    "spike": 5, # site akışı x SPIKE_FACTOR (SPIKE_EWMA / SPIKE_SEASONAL)
+    "stuck": 40, # modül 0 basar (STUCK_ZERO, stuck_zero_s=30)
+    "offline": 20, # modül susar (SENSOR_OFFLINE, offline_s=10)
+    "outlier": 40, # modül x OUTLIER_FACTOR (OUTLIER_MODULE, outlier_window=30)
+}
+SPIKE_FACTOR = 5.0
+OUTLIER_FACTOR = 6.0
+
+
+def demo():
     client = mqtt.Client()
     client.connect(MQTT_HOST, MQTT_PORT, 60)
     client.loop_start()
 
     t0 = int(time.time())
-    print(f"[fake_publisher] publishing to {MQTT_HOST}:{MQTT_PORT} topic={TOPIC}")
+    topic = TOPIC + BIN_TOPIC_SUFFIX if BINARY else TOPIC
+    encode = encode_packet_bin if BINARY else encode_packet
+    print(f"[fake_publisher] publishing to {MQTT_HOST}:{MQTT_PORT} topic={topic}")
 
     while True:
         ts = int(time.time())
@@ -57,10 +82,241 @@ def main():
                 steps_dir2=d2,
                 vcap=None,
             )
-            client.publish(TOPIC, encode_packet(pkt), qos=0, retain=False)
+            client.publish(topic, encode(pkt), qos=0, retain=False)
 
         time.sleep(1)
 
 
+class _Faults:
+    """
+    Bir fault tipinin hedef bazında (site veya modül) bitiş zamanları.
+    Her saniye hedef başına rate/60 olasılıkla yeni arıza başlar.
+    """
+
+    def __init__(self, kind: str, n_targets: int, rate_per_min: float, rng: np.random.Generator):
+        self.kind = kind
+        self.p = rate_per_min / 60.0
+        self.until = np.zeros(n_targets, dtype=np.int64)
+        self.rng = rng
+
+    def step(self, now: int) -> np.ndarray:
+        """
+        Yeni başlayan arızaların hedef indeksleri; sonrasında active(now) geçerlidir.
+        """
+        if self.p <= 0:
+            return np.zeros(0, dtype=np.int64)
+        new = np.flatnonzero((self.until <= now) & (self.rng.random(len(self.until)) < self.p))
+        self.until[new] = now + FAULT_LEN_S[self.kind]
+        return new
+
+    def active(self, now: int) -> np.ndarray:
+        return self.until > now
+
+
+def _load_worker(idx: int, cfg: dict, sites: List[str], port: int, out: mp.Queue) -> None:
+    rng = np.random.default_rng(cfg["seed"] + idx)
+    n_mod = cfg["modules"]
+    modules = [f"MOD_{m:02d}" for m in range(n_mod)]
+    n = len(sites) * n_mod
+    site_of = np.repeat(np.arange(len(sites)), n_mod)
+
+    # sabit alanlar bir kez encode edilir; her burst'te yalnızca ts/adım kolonları yazılır
+    if cfg["binary"]:
+        topic = cfg["topic"] + BIN_TOPIC_SUFFIX
+        rec = np.zeros(n, dtype=PACKET_DTYPE)
+        rec["version"] = BIN_VERSION
+        rec["window_s"] = 1
+        rec["site_id"] = [s.encode("utf-8") for s in sites for _ in modules]
+        rec["module_id"] = [m.encode("utf-8") for _ in sites for m in modules]
+    else:
+        topic = cfg["topic"]
+        prefix = [f'{{"site_id":"{s}","module_id":"{m}","ts":' for s in sites for m in modules]
+
+    faults = {
+        "spike": _Faults("spike", len(sites), cfg["spike"], rng),
+        "stuck": _Faults("stuck", n, cfg["stuck"], rng),
+        "offline": _Faults("offline", n, cfg["offline"], rng),
+        "outlier": _Faults("outlier", n, cfg["outlier"], rng),
+    }
+    truth: List[dict] = []
+
+    sent_at: Dict[int, float] = {}
+    early: Dict[int, float] = {} # publish() dönmeden gelen PUBACK'ler: mid -> varış zamanı
+    ack_lock = threading.Lock()
+    latencies: List[float] = []
+
+    def on_publish(_c, _u, mid):
+        now = time.perf_counter()
+        with ack_lock:
+            t = sent_at.pop(mid, None)
+            if t is None:
+                early[mid] = now
+        if t is not None:
+            latencies.append(now - t)
+
+    client = mqtt.Client()
+    client.on_publish = on_publish
+    client.max_inflight_messages_set(1000)
+    client.connect(cfg["host"], port, 60)
+    client.loop_start()
+
+    sent = bursts = late = 0
+    sample = cfg["latency_sample"]
+    interval = cfg["interval"]
+    t_end = time.time() + cfg["duration"]
+    t_next = time.time()
+    while t_next < t_end:
+        now = int(t_next)
+        for kind, f in faults.items():
+            for i in f.step(now).tolist():
+                site = sites[i] if kind == "spike" else sites[site_of[i]]
+                module = "" if kind == "spike" else modules[i % n_mod]
+                truth.append({"type": kind, "site_id": site, "module_id": module, "start": now, "end": int(f.until[i])})
+
+        lam = np.full(n, cfg["base_flow"], dtype=np.float64)
+        lam[faults["spike"].active(now)[site_of]] *= SPIKE_FACTOR
+        lam[faults["outlier"].active(now)] *= OUTLIER_FACTOR
+        total = rng.poisson(lam)
+        total[faults["stuck"].active(now)] = 0
+        d1 = rng.binomial(total, 0.5)
+        d2 = total - d1
+        live = np.flatnonzero(~faults["offline"].active(now))
+
+        if cfg["binary"]:
+            rec["ts"] = now
+            rec["steps_dir1"] = d1
+            rec["steps_dir2"] = d2
+            buf = rec.tobytes()
+            size = PACKET_DTYPE.itemsize
+            payloads = [buf[i * size : (i + 1) * size] for i in live.tolist()]
+        else:
+            a, b = d1.tolist(), d2.tolist()
+            payloads = [f'{prefix[i]}{now},"window_s":1,"steps_dir1":{a[i]},"steps_dir2":{b[i]}}}' for i in live.tolist()]
+
+        # burst: tüm paketler art arda; her sample'ıncı paket QoS 1 (PUBACK ile gecikme ölçümü)
+        for k, payload in enumerate(payloads):
+            if sample and (sent + k) % sample == 0:
+                t = time.perf_counter()
+                info = client.publish(topic, payload, qos=1)
+                # on_publish paho'nun kilidi altında çağrılır: publish ack_lock dışında tutulur
+                with ack_lock:
+                    acked = early.pop(info.mid, None)
+                    if acked is None:
+                        sent_at[info.mid] = t
+                if acked is not None:
+                    latencies.append(acked - t)
+            else:
+                client.publish(topic, payload, qos=0)
+        sent += len(payloads)
+        bursts += 1
+
+        t_next += interval
+        delay = t_next - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            late += 1
+
+    deadline = time.time() + 5
+    while sent_at and time.time() < deadline:
+        time.sleep(0.05)
+    client.loop_stop()
+    client.disconnect()
+    out.put({"worker": idx, "sent": sent, "bursts": bursts, "late": late, "latencies": latencies, "truth": truth})
+
+
+def load(args) -> None:
+    broker = None
+    port = args.port
+    if args.broker == "local":
+        from localbroker import LocalBroker
+
+        # dashboard aynı porta bağlanabilir; --port 0 ile boş port seçilir
+        broker = LocalBroker(args.host, args.port).start()
+        port = broker.port
+
+    sites = [f"SITE_{i:05d}" for i in range(args.sites)]
+    procs = max(1, min(args.procs, len(sites)))
+    cfg = {
+        "host": args.host,
+        "topic": TOPIC,
+        "binary": args.binary,
+        "modules": args.modules,
+        "interval": args.interval,
+        "duration": args.duration,
+        "base_flow": args.base_flow,
+        "seed": args.seed,
+        "latency_sample": args.latency_sample,
+        "spike": args.spike,
+        "stuck": args.stuck,
+        "offline": args.offline,
+        "outlier": args.outlier,
+    }
+    print(
+        f"[fake_publisher] load: {args.sites} sites x {args.modules} modules / {args.interval}s "
+        f"= {args.sites * args.modules / args.interval:,.0f} pkt/s target, {procs} procs, "
+        f"{'binary' if args.binary else 'json'}, broker={args.host if broker is None else 'local'}:{port}"
+    )
+
+    out = mp.Queue()
+    workers = [
+        mp.Process(target=_load_worker, args=(i, cfg, sites[i::procs], port, out), daemon=True) for i in range(procs)
+    ]
+    start = time.time()
+    for w in workers:
+        w.start()
+    results = [out.get() for _ in workers]
+    elapsed = time.time() - start
+    for w in workers:
+        w.join()
+
+    sent = sum(r["sent"] for r in results)
+    late = sum(r["late"] for r in results)
+    lat = np.array([x for r in results for x in r["latencies"]]) * 1000
+    print(f"[fake_publisher] sent={sent} in {elapsed:.1f}s -> {sent / elapsed:,.0f} pkt/s (late bursts: {late})")
+    if len(lat):
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        print(f"  QoS1 publish->PUBACK latency (n={len(lat)}): p50={p50:.2f} ms p95={p95:.2f} ms p99={p99:.2f} ms max={lat.max():.2f} ms")
+    if broker is not None:
+        print(f"  local broker received={broker.received} delivered={broker.delivered}")
+        broker.stop()
+
+    truth = [t for r in results for t in r["truth"]]
+    counts = {k: sum(t["type"] == k for t in truth) for k in FAULT_LEN_S}
+    print(f"  injected faults: {counts}")
+    if args.truth:
+        with open(args.truth, "w", encoding="utf-8") as f:
+            for t in sorted(truth, key=lambda t: (t["start"], t["site_id"], t["module_id"])):
+                f.write(json.dumps(t, separators=(",", ":")) + "\n")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--load", action="store_true", help="yük üretimi modu (yoksa tek site demo)")
+    ap.add_argument("--sites", type=int, default=1000)
+    ap.add_argument("--modules", type=int, default=12)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--interval", type=float, default=1.0, help="burst aralığı (s)")
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--binary", action="store_true", default=BINARY)
+    ap.add_argument("--broker", choices=("mqtt", "local"), default="mqtt")
+    ap.add_argument("--host", default=MQTT_HOST)
+    ap.add_argument("--port", type=int, default=MQTT_PORT)
+    ap.add_argument("--base-flow", type=float, default=BASE_FLOW)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--latency-sample", type=int, default=100, help="her N pakette bir QoS 1 (0 = ölçme)")
+    ap.add_argument("--spike", type=float, default=0.0, help="site başına dakikada spike olasılığı")
+    ap.add_argument("--stuck", type=float, default=0.0, help="modül başına dakikada stuck olasılığı")
+    ap.add_argument("--offline", type=float, default=0.0, help="modül başına dakikada offline olasılığı")
+    ap.add_argument("--outlier", type=float, default=0.0, help="modül başına dakikada outlier olasılığı")
+    ap.add_argument("--truth", default=None, help="enjekte edilen arızaların yazılacağı JSONL")
+    args = ap.parse_args()
+
+    if args.load:
+        load(args)
+    else:
+        demo()
+
+
 if __name__ == "__main__":
     main()
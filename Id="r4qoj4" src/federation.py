@@ -0,0 +1,658 @@
+from __future__ import annotations
+"""
+Çok gateway'li hiyerarşik toplama: edge (dashboard / gateway) -> merkez (aggregator.py).
+
+Gateway tarafı (GatewayExporter) üç tür çerçeve üretir:
+  FUSED   fused noktalar (site tablosu + sabit uzunluklu kayıtlar), her export turunda;
+          nokta yoksa da gönderilir (watermark kalp atışı)
+  HEALTH  modül sağlık özetleri; yalnızca son gönderimden beri değişen modüller
+  MODEL   son gönderimden beri güncellenen sitelerin birleştirilebilir model state'i
+          (seasonal Welford (n, mean, m2) slotları + EWMA (n, mean, var))
+
+Her çerçevede gateway id, epoch (gateway başlangıcı), seq ve watermark vardır: watermark'a
+kadar (dahil) olan tüm fused noktalar gönderilmiştir. Watermark cihaz event time'ıdır ve canlı
+sitelerin fused akışından türetilir (GatewayExporter.add_fused). Merkez (Aggregator) tekrar eden seq'leri
+atar, gateway başına watermark tutar ve şehir toplamını yalnızca canlı tüm gateway'lerin
+geçtiği saniyeler için üretir. Taşıma MQTT (FED_TOPIC/<gateway_id>, LocalBroker ile de) veya
+uzunluk önekli TCP soketidir.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+
+import anomaly
+import health
+from common import SLOTS
+from fusion import FUSED_FIELDS
+from health import HealthThresholds
+from ids import IDS
+from metrics import METRICS
+from ringbuf import RingBuffer
+from rollup import RollupStore
+from seasonal import N_SLOTS
+
+Fused = Tuple[str, int, float, float, int]
+
+FED_TOPIC = "piyon/v1/gw" # + "/<gateway_id>"
+FRAME_MAGIC = b"PGWF"
+FRAME_VERSION = 1
+KIND_FUSED, KIND_HEALTH, KIND_MODEL = 1, 2, 3
+KIND_NAMES = {KIND_FUSED: "fused", KIND_HEALTH: "health", KIND_MODEL: "model"}
+FLAG_ZLIB = 0x01
+ZLIB_MIN_BYTES = 1024 # bundan küçük gövdeler sıkıştırılmaz
+
+# magic | version | kind | flags | epoch | seq | sent_ts | watermark | gateway id uzunluğu
+_HEADER = struct.Struct("<4sBBBqIqqB")
+_LEN = struct.Struct("<I") # soket çerçeve öneki
+
+FUSED_WIRE = np.dtype([("site", "<u4"), ("ts", "<i8"), ("flow", "<f4"), ("ratio", "<f4"), ("n_used", "<u2")])
+HEALTH_WIRE = np.dtype(
+    [
+        ("site", "<u4"),
+        ("module", "<u4"),
+        ("last_ts", "<i8"),
+        ("last_total", "<i4"),
+        ("zero_run", "<i4"),
+        ("const_run", "<i4"),
+        ("offline", "u1"),
+    ]
+)
+
+
+def _pack_names(names: Sequence[str]) -> bytes:
+    out = bytearray(_LEN.pack(len(names)))
+    for name in names:
+        b = name.encode("utf-8")
+        out += struct.pack("<H", len(b))
+        out += b
+    return bytes(out)
+
+
+def _unpack_names(buf: bytes, pos: int) -> Tuple[List[str], int]:
+    (n,) = _LEN.unpack_from(buf, pos)
+    pos += _LEN.size
+    names: List[str] = []
+    for _ in range(n):
+        (k,) = struct.unpack_from("<H", buf, pos)
+        pos += 2
+        names.append(sys.intern(buf[pos : pos + k].decode("utf-8")))
+        pos += k
+    return names, pos
+
+
+def _names_index(names: Iterable[str]) -> Tuple[List[str], Dict[str, int]]:
+    index: Dict[str, int] = {}
+    for name in names:
+        if name not in index:
+            index[name] = len(index)
+    return list(index), index
+
+
+@dataclass
+class Frame:
+    kind: int
+    gateway_id: str
+    epoch: int
+    seq: int
+    sent_ts: int
+    watermark: int
+    sites: List[str] = field(default_factory=list)
+    modules: List[str] = field(default_factory=list)
+    rows: Optional[np.ndarray] = None # FUSED_WIRE / HEALTH_WIRE kayıtları
+    seasonal: Optional[np.ndarray] = None # (len(sites), N_SLOTS, 3)
+    ewma: Optional[np.ndarray] = None # (len(sites), 3)
+
+
+def encode_frame(
+    kind: int, gateway_id: str, epoch: int, seq: int, sent_ts: int, watermark: int, body: bytes
+) -> bytes:
+    flags = 0
+    if len(body) >= ZLIB_MIN_BYTES:
+        packed = zlib.compress(body, 1)
+        if len(packed) < len(body):
+            body, flags = packed, FLAG_ZLIB
+    gw = gateway_id.encode("utf-8")
+    if len(gw) > 255:
+        raise ValueError("gateway_id too long (255 bytes)")
+    return _HEADER.pack(FRAME_MAGIC, FRAME_VERSION, kind, flags, epoch, seq, sent_ts, watermark, len(gw)) + gw + body
+
+
+def decode_frame(payload: bytes) -> Frame:
+    """
+    Çerçeve -> Frame. Format hatalarında ValueError fırlatır.
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError(f"Frame too short: {len(payload)} bytes")
+    magic, version, kind, flags, epoch, seq, sent_ts, watermark, gw_len = _HEADER.unpack_from(payload)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a gateway frame")
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version: {version}")
+    if kind not in KIND_NAMES:
+        raise ValueError(f"Unknown frame kind: {kind}")
+    pos = _HEADER.size
+    gateway_id = payload[pos : pos + gw_len].decode("utf-8")
+    body = payload[pos + gw_len :]
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise ValueError(f"Bad compressed body: {e}") from e
+
+    fr = Frame(kind, sys.intern(gateway_id), epoch, seq, sent_ts, watermark)
+    try:
+        fr.sites, pos = _unpack_names(body, 0)
+        if kind == KIND_FUSED:
+            fr.rows = np.frombuffer(body, dtype=FUSED_WIRE, offset=pos)
+        elif kind == KIND_HEALTH:
+            fr.modules, pos = _unpack_names(body, pos)
+            fr.rows = np.frombuffer(body, dtype=HEALTH_WIRE, offset=pos)
+        else:
+            n = len(fr.sites)
+            end = pos + n * N_SLOTS * 3 * 8
+            fr.seasonal = np.frombuffer(body[pos:end], dtype="<f8").reshape(n, N_SLOTS, 3)
+            fr.ewma = np.frombuffer(body[end:], dtype="<f8").reshape(n, 3)
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Bad {KIND_NAMES[kind]} frame body: {e}") from e
+    if fr.rows is not None and len(fr.rows) and int(fr.rows["site"].max()) >= len(fr.sites):
+        raise ValueError("Site index out of range")
+    return fr
+
+
+def merge_welford(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    (..., 3) (n, mean, m2) state'lerinin paralel birleştirmesi (Chan vd.); ayrık
+    gözlem kümeleri için tek akışla hesaplanmış state'e eşittir.
+    """
+    na, ma, m2a = a[..., 0], a[..., 1], a[..., 2]
+    nb, mb, m2b = b[..., 0], b[..., 1], b[..., 2]
+    n = na + nb
+    w = np.divide(nb, n, out=np.zeros_like(n), where=n > 0)
+    d = mb - ma
+    return np.stack([n, ma + d * w, m2a + m2b + d * d * na * w], axis=-1)
+
+
+def merge_ewma(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    (..., 3) (n, mean, var) EWMA state'lerinin n ağırlıklı karışımı (yaklaşık: EWMA'nın
+    zaman ağırlıkları birleştirilemez). Boş taraf diğerini değiştirmez.
+    """
+    na, nb = a[..., 0], b[..., 0]
+    n = na + nb
+    wb = np.divide(nb, n, out=np.zeros_like(n), where=n > 0)
+    wa = 1.0 - wb
+    mean = wa * a[..., 1] + wb * b[..., 1]
+    var = wa * (a[..., 2] + (a[..., 1] - mean) ** 2) + wb * (b[..., 2] + (b[..., 1] - mean) ** 2)
+    out = np.stack([n, mean, var], axis=-1)
+    return np.where((n > 0)[..., None], out, a)
+
+
+class GatewayExporter:
+    """
+    Gateway tarafı. add_fused() tick thread'inden, *_frame() export thread'inden çağrılır;
+    health_frame/model_frame pipeline state'ini okur, çağıran PIPELINE_LOCK'u tutmalıdır.
+    """
+
+    def __init__(
+        self, gateway_id: str, max_points: int = 8192, epoch: Optional[int] = None, site_idle_s: int = 30
+    ):
+        self.gateway_id = gateway_id
+        self.max_points = max_points
+        self.site_idle_s = site_idle_s
+        self.epoch = int(time.time()) if epoch is None else epoch
+        self.seq = 0
+        self.watermark = 0
+        self.sent_watermark = 0 # son gönderilen çerçevenin watermark'ı
+        self.pending: List[Fused] = []
+        self.site_last: Dict[str, Tuple[int, int]] = {} # site -> (son fused ts, görüldüğü now_ts)
+        self.first_now: Optional[int] = None # ilk add_fused'un now_ts'i
+        self.model_dirty: Set[str] = set()
+        self.health_sent: Dict[int, Tuple[int, int, int, int, bool]] = {} # health key -> son gönderilen satır
+        self._lock = threading.Lock()
+
+    def add_fused(self, fused: Sequence[Fused], now_ts: int, close_lag_s: int, final: bool = False) -> int:
+        """
+        Watermark fused noktaların event time'ından türetilir (duvar saatinden değil): fusion bir
+        sitenin bucket'larını ts sırasıyla kapatır, yani sitenin sonraki noktaları son fused ts'inden
+        büyüktür. Watermark = son site_idle_s içinde noktası gelen sitelerin son fused ts'lerinin
+        en küçüğü, en fazla now_ts - close_lag_s. Saati geride olan ya da paketleri geç gelen site
+        watermark'ı kendi hızına çeker; site_idle_s'den uzun susan site beklenmez, döndüğünde
+        watermark'ın gerisindeki noktaları merkezde geç sayılır (late_points). Geç kalma bu yüzden
+        site_idle_s ile sınırlıdır. Hiç canlı site yokken watermark ilk site_idle_s boyunca
+        ilerlemez (başlangıçta geride kalan sitelerin ilk noktaları için), sonra now_ts -
+        close_lag_s'dir. final=True: gateway kapanıyor, tüm noktalar gönderildi.
+        Returns: yeni watermark
+        """
+        with self._lock:
+            if self.first_now is None:
+                self.first_now = now_ts
+            self.pending.extend(fused)
+            self.model_dirty.update(row[0] for row in fused)
+            for site_id, ts, *_ in fused:
+                self.site_last[site_id] = (ts, now_ts)
+            for site_id in [s for s, (_, seen) in self.site_last.items() if now_ts - seen > self.site_idle_s]:
+                del self.site_last[site_id]
+            if final:
+                watermark = max((ts for ts, _ in self.site_last.values()), default=now_ts)
+            elif not self.site_last and now_ts - self.first_now < self.site_idle_s:
+                watermark = self.watermark
+            else:
+                watermark = min([ts for ts, _ in self.site_last.values()] + [now_ts - close_lag_s])
+            self.watermark = max(self.watermark, watermark)
+            return self.watermark
+
+    def _frame(self, kind: int, body: bytes, now_ts: Optional[int]) -> bytes:
+        seq = self.seq
+        self.seq += 1
+        sent_ts = int(time.time()) if now_ts is None else now_ts
+        return encode_frame(kind, self.gateway_id, self.epoch, seq, sent_ts, self.sent_watermark, body)
+
+    def fused_frames(self, now_ts: Optional[int] = None) -> List[bytes]:
+        """
+        Bekleyen noktaları max_points'lik çerçevelere böler; nokta yoksa tek boş çerçeve.
+        Yeni watermark yalnızca son çerçevede taşınır (önceki parçaların noktaları geç sayılmasın).
+        """
+        with self._lock:
+            pending, self.pending = self.pending, []
+            out: List[bytes] = []
+            for lo in range(0, max(len(pending), 1), self.max_points):
+                chunk = pending[lo : lo + self.max_points]
+                if lo + self.max_points >= len(pending):
+                    self.sent_watermark = self.watermark
+                sites, index = _names_index(row[0] for row in chunk)
+                rows = np.zeros(len(chunk), dtype=FUSED_WIRE)
+                if chunk:
+                    rows["site"] = [index[r[0]] for r in chunk]
+                    rows["ts"] = [r[1] for r in chunk]
+                    rows["flow"] = [r[2] for r in chunk]
+                    rows["ratio"] = [r[3] for r in chunk]
+                    rows["n_used"] = [r[4] for r in chunk]
+                out.append(self._frame(KIND_FUSED, _pack_names(sites) + rows.tobytes(), now_ts))
+            return out
+
+    def health_frame(self, full: bool = False, now_ts: Optional[int] = None) -> Optional[bytes]:
+        """
+        Son gönderimden beri değişen modüllerin özetleri (full=True: hepsi); değişiklik yoksa None.
+        """
+        changed = []
+        for st in health.MODULES:
+            row = (st.last_ts, st.last_total, st.zero_run, st.const_run, st.key in health.OFFLINE)
+            if full or self.health_sent.get(st.key) != row:
+                self.health_sent[st.key] = row
+                changed.append((IDS.names(st.key), row))
+        if not changed:
+            return None
+        sites, s_index = _names_index(names[0] for names, _ in changed)
+        modules, m_index = _names_index(names[1] for names, _ in changed)
+        rows = np.zeros(len(changed), dtype=HEALTH_WIRE)
+        rows["site"] = [s_index[names[0]] for names, _ in changed]
+        rows["module"] = [m_index[names[1]] for names, _ in changed]
+        for j, f in enumerate(("last_ts", "last_total", "zero_run", "const_run", "offline")):
+            rows[f] = [row[j] for _, row in changed]
+        with self._lock:
+            return self._frame(KIND_HEALTH, _pack_names(sites) + _pack_names(modules) + rows.tobytes(), now_ts)
+
+    def model_frame(self, now_ts: Optional[int] = None) -> Optional[bytes]:
+        """
+        add_fused'tan beri güncellenen sitelerin seasonal + EWMA state'i; yoksa None.
+        """
+        with self._lock:
+            dirty, self.model_dirty = self.model_dirty, set()
+        seas, ew = anomaly.SEASONAL_STORE, anomaly.EWMA_STORE
+        sites = sorted(s for s in dirty if s in seas.index and s in ew.index)
+        if not sites:
+            return None
+        stats = seas.stats[[seas.index[s] for s in sites]].astype("<f8")
+        state = ew.state[[ew.index[s] for s in sites]].astype("<f8")
+        with self._lock:
+            return self._frame(KIND_MODEL, _pack_names(sites) + stats.tobytes() + state.tobytes(), now_ts)
+
+
+@dataclass(**SLOTS)
+class GatewayState:
+    gateway_id: str
+    epoch: int = 0
+    seq: int = -1 # son kabul edilen seq
+    watermark: int = 0
+    last_seen: float = 0.0 # aggregator saatiyle
+    frames: int = 0
+    dup_frames: int = 0
+    lost_frames: int = 0 # seq boşlukları
+    points: int = 0
+    sites: Set[str] = field(default_factory=set)
+    # (site, module) -> (last_ts, last_total, zero_run, const_run, offline)
+    health: Dict[Tuple[str, str], Tuple[int, int, int, int, bool]] = field(default_factory=dict)
+    seasonal: Dict[str, np.ndarray] = field(default_factory=dict) # site -> (N_SLOTS, 3)
+    ewma: Dict[str, np.ndarray] = field(default_factory=dict) # site -> (3,)
+
+
+CITY_FIELDS = [("ts", np.int64), ("flow", np.float32), ("sites", np.uint32)]
+
+
+class Aggregator:
+    """
+    Merkez düğüm: N gateway'in çerçevelerini birleştirir. ingest() birden çok thread'den
+    (MQTT / soket) çağrılabilir; tüm state tek kilit altındadır.
+
+    Fused noktalar site bazında ts artan kabul edilir (site sahipliği gateway değiştirse de
+    tekrar/geri kalan noktalar atılır). Şehir toplamı (CITY) bir saniye için, canlı tüm
+    gateway'lerin watermark'ı o saniyeyi geçince bir kez üretilir; stale_s boyunca çerçeve
+    göndermeyen gateway beklenmez. Sonradan gelen noktalar site verisine girer, şehir
+    toplamına girmez (late_points). expected: ilk çerçevesi henüz gelmemiş ama beklenecek
+    gateway'ler (başlangıçtan itibaren stale_s boyunca watermark'ı 0 sayılır).
+    """
+
+    def __init__(
+        self, stale_s: float = 30.0, flow_len: int = 600, city_len: int = 3600, expected: Sequence[str] = ()
+    ):
+        self.stale_s = stale_s
+        self.flow_len = flow_len
+        now = time.time()
+        self.gateways: Dict[str, GatewayState] = {g: GatewayState(g, last_seen=now) for g in expected}
+        self.flow: Dict[str, RingBuffer] = {} # site -> FUSED_FIELDS (son flow_len nokta)
+        self.site_last: Dict[str, int] = {} # site -> kabul edilen son ts
+        self.site_gateway: Dict[str, str] = {} # site -> son nokta gönderen gateway
+        self.rollups = RollupStore()
+        self.city = RingBuffer(city_len, CITY_FIELDS, ts_field="ts")
+        self.city_pending: Dict[int, List[float]] = {} # ts -> [flow toplamı, site sayısı]
+        self.city_watermark: Optional[int] = None # şehir toplamı üretilmiş son saniye
+        self.late_points = 0
+        self.stale_points = 0 # site için zaten daha yeni nokta varken gelenler
+        self.bad_frames = 0
+        self.lock = threading.Lock()
+
+    def ingest(self, payload: bytes, now: Optional[float] = None) -> Optional[Frame]:
+        """
+        Tek çerçeveyi işler; bozuk veya tekrar çerçevede None döner.
+        """
+        t0 = time.perf_counter()
+        try:
+            fr = decode_frame(payload)
+        except ValueError:
+            self.bad_frames += 1
+            METRICS.inc("fed_bad_frames_total")
+            return None
+        now = time.time() if now is None else now
+        with self.lock:
+            gw = self.gateways.get(fr.gateway_id)
+            if gw is None:
+                gw = self.gateways[fr.gateway_id] = GatewayState(fr.gateway_id, epoch=fr.epoch)
+            if fr.epoch > gw.epoch:
+                # gateway yeniden başladı: seq sıfırdan
+                gw.epoch, gw.seq = fr.epoch, -1
+            elif fr.epoch < gw.epoch or fr.seq <= gw.seq:
+                gw.dup_frames += 1
+                METRICS.inc("fed_dup_frames_total")
+                return None
+            gw.lost_frames += fr.seq - gw.seq - 1
+            gw.seq = fr.seq
+            gw.frames += 1
+            gw.last_seen = now
+            if fr.kind == KIND_FUSED:
+                self._apply_fused(gw, fr)
+            elif fr.kind == KIND_HEALTH:
+                self._apply_health(gw, fr)
+            else:
+                self._apply_model(gw, fr)
+            gw.watermark = max(gw.watermark, fr.watermark)
+            self._advance(now)
+        METRICS.inc("fed_frames_total", kind=KIND_NAMES[fr.kind])
+        METRICS.observe("fed_ingest", time.perf_counter() - t0)
+        return fr
+
+    def _apply_fused(self, gw: GatewayState, fr: Frame) -> None:
+        rows = fr.rows
+        if rows is None or not len(rows):
+            return
+        accepted: List[Fused] = []
+        sites = fr.sites
+        for s, ts, flow, ratio, n_used in zip(
+            rows["site"].tolist(), rows["ts"].tolist(), rows["flow"].tolist(), rows["ratio"].tolist(), rows["n_used"].tolist()
+        ):
+            site_id = sites[s]
+            if ts <= self.site_last.get(site_id, -1):
+                self.stale_points += 1
+                continue
+            self.site_last[site_id] = ts
+            self.site_gateway[site_id] = gw.gateway_id
+            rb = self.flow.get(site_id)
+            if rb is None:
+                rb = self.flow[site_id] = RingBuffer(self.flow_len, FUSED_FIELDS, ts_field="ts")
+            rb.append(ts, flow, ratio, n_used)
+            accepted.append((site_id, ts, flow, ratio, n_used))
+            if self.city_watermark is not None and ts <= self.city_watermark:
+                self.late_points += 1
+                continue
+            acc = self.city_pending.get(ts)
+            if acc is None:
+                self.city_pending[ts] = [flow, 1]
+            else:
+                acc[0] += flow
+                acc[1] += 1
+        gw.points += len(accepted)
+        gw.sites.update(sites)
+        self.rollups.update(accepted)
+        METRICS.inc("fed_points_total", len(accepted))
+
+    def _apply_health(self, gw: GatewayState, fr: Frame) -> None:
+        rows = fr.rows
+        cols = [rows[f].tolist() for f in ("site", "module", "last_ts", "last_total", "zero_run", "const_run", "offline")]
+        for s, m, last_ts, last_total, zero_run, const_run, offline in zip(*cols):
+            gw.health[(fr.sites[s], fr.modules[m])] = (last_ts, last_total, zero_run, const_run, bool(offline))
+
+    def _apply_model(self, gw: GatewayState, fr: Frame) -> None:
+        # gateway state'i kümülatiftir: son gelen öncekinin yerine geçer
+        for i, site_id in enumerate(fr.sites):
+            gw.seasonal[site_id] = fr.seasonal[i]
+            gw.ewma[site_id] = fr.ewma[i]
+
+    def global_watermark(self, now: Optional[float] = None) -> Optional[int]:
+        """
+        Canlı gateway'lerin en küçük watermark'ı (canlı gateway yoksa None).
+        """
+        now = time.time() if now is None else now
+        live = [g.watermark for g in self.gateways.values() if now - g.last_seen <= self.stale_s]
+        return min(live) if live else None
+
+    def _advance(self, now: float) -> None:
+        wm = self.global_watermark(now)
+        if wm is None or (self.city_watermark is not None and wm <= self.city_watermark):
+            return
+        for ts in sorted(t for t in self.city_pending if t <= wm):
+            total, n = self.city_pending.pop(ts)
+            self.city.append(ts, total, n)
+        self.city_watermark = wm
+
+    def tick(self, now: Optional[float] = None) -> None:
+        """
+        Stale gateway'ler çerçeve göndermese de şehir toplamının ilerlemesi için periyodik çağrılır.
+        """
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+
+    def model(self, site_id: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Sitenin tüm gateway'lerden birleştirilmiş (seasonal (N_SLOTS, 3), EWMA (3,)) state'i.
+        Gateway'lerin gözlem dönemleri ayrık kabul edilir (ör. site el değiştirdiğinde).
+        """
+        with self.lock:
+            parts = [(g.seasonal[site_id], g.ewma[site_id]) for g in self.gateways.values() if site_id in g.seasonal]
+        if not parts:
+            return None
+        seas, ew = parts[0]
+        for s, e in parts[1:]:
+            seas, ew = merge_welford(seas, s), merge_ewma(ew, e)
+        return np.array(seas), np.array(ew)
+
+    def load_model(self, seasonal_store, ewma_store) -> int:
+        """
+        Birleştirilmiş model state'ini SeasonalStore / EwmaStore'a yükler (ör. merkezden
+        snapshot yazıp yeni gateway'leri bootstrap etmek için). Returns: site sayısı.
+        """
+        with self.lock:
+            sites = sorted({s for g in self.gateways.values() for s in g.seasonal})
+        merged = [self.model(s) for s in sites]
+        seasonal_store.load(sites, np.array([m[0] for m in merged]).reshape(len(sites), N_SLOTS, 3))
+        ewma_store.load(sites, np.array([m[1] for m in merged]).reshape(len(sites), 3))
+        return len(sites)
+
+    def site_series(self, site_id: str, n: Optional[int] = None) -> Optional[Dict[str, np.ndarray]]:
+        with self.lock:
+            rb = self.flow.get(site_id)
+            return None if rb is None else {k: v.copy() for k, v in rb.last(n).items()}
+
+    def city_series(self, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+        with self.lock:
+            return {k: v.copy() for k, v in self.city.last(n).items()}
+
+    def summary(self, now: Optional[float] = None, thr: HealthThresholds = HealthThresholds()) -> dict:
+        """
+        JSON'a yazılabilir global görünüm: gateway'ler, site / modül sayıları, şehir akışı.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            gws = []
+            totals = {"modules": 0, "offline": 0, "stuck_zero": 0, "stuck_const": 0}
+            for g in sorted(self.gateways.values(), key=lambda g: g.gateway_id):
+                h = {
+                    "modules": len(g.health),
+                    "offline": sum(1 for r in g.health.values() if r[4]),
+                    "stuck_zero": sum(1 for r in g.health.values() if r[2] >= thr.stuck_zero_s),
+                    "stuck_const": sum(1 for r in g.health.values() if r[3] >= thr.stuck_const_s and r[1] > 0),
+                }
+                for k, v in h.items():
+                    totals[k] += v
+                gws.append({
+                    "gateway_id": g.gateway_id,
+                    "epoch": g.epoch,
+                    "seq": g.seq,
+                    "watermark": g.watermark,
+                    "age_s": round(now - g.last_seen, 1),
+                    "live": now - g.last_seen <= self.stale_s,
+                    "frames": g.frames,
+                    "dup_frames": g.dup_frames,
+                    "lost_frames": g.lost_frames,
+                    "points": g.points,
+                    "sites": len(g.sites),
+                    "model_sites": len(g.seasonal),
+                    **h,
+                })
+            last = self.city.last(1)
+            return {
+                "ts": int(now),
+                "city_watermark": self.city_watermark,
+                "gateways": gws,
+                "sites": len(self.flow),
+                "health": totals,
+                "city_last": {k: v[0].item() for k, v in last.items()} if len(self.city) else None,
+                "pending_seconds": len(self.city_pending),
+                "late_points": self.late_points,
+                "stale_points": self.stale_points,
+                "bad_frames": self.bad_frames,
+            }
+
+
+class MqttSink:
+    """
+    Gateway -> MQTT (FED_TOPIC/<gateway_id>). paho kendi network thread'inde çalışır.
+    """
+
+    def __init__(self, gateway_id: str, host: str, port: int, qos: int = 1):
+        import paho.mqtt.client as mqtt
+
+        self.topic = f"{FED_TOPIC}/{gateway_id}"
+        self.qos = qos
+        self.client = mqtt.Client()
+        self.client.max_inflight_messages_set(1000)
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def send(self, frame: bytes) -> None:
+        self.client.publish(self.topic, frame, qos=self.qos)
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class SocketSink:
+    """
+    Gateway -> uzunluk önekli TCP. Bağlantı koparsa sonraki send() yeniden bağlanır;
+    gönderilemeyen çerçeve atılır (merkez seq boşluğunu lost_frames olarak sayar).
+    """
+
+    def __init__(self, host: str, port: int, timeout_s: float = 5.0):
+        self.addr = (host, port)
+        self.timeout_s = timeout_s
+        self.sock: Optional[socket.socket] = None
+        self.dropped = 0
+
+    def send(self, frame: bytes) -> None:
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.addr, timeout=self.timeout_s)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.sendall(_LEN.pack(len(frame)) + frame)
+        except OSError:
+            self.dropped += 1
+            self.close()
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+def serve_mqtt(agg: Aggregator, host: str, port: int):
+    """
+    Aggregator'ı FED_TOPIC/+'a abone eder. Returns: paho client (loop_start edilmiş).
+    """
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client()
+    client.on_message = lambda _c, _u, msg: agg.ingest(msg.payload)
+    client.on_connect = lambda c, _u, _f, _rc: c.subscribe(FED_TOPIC + "/+", qos=1)
+    client.connect(host, port, 60)
+    client.loop_start()
+    return client
+
+
+class _FrameHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        f = self.request.makefile("rb")
+        while True:
+            head = f.read(_LEN.size)
+            if len(head) < _LEN.size:
+                return
+            (n,) = _LEN.unpack(head)
+            frame = f.read(n)
+            if len(frame) < n:
+                return
+            self.server.aggregator.ingest(frame)
+
+
+class _FrameServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    aggregator: Aggregator
+
+
+def serve_socket(agg: Aggregator, host: str = "127.0.0.1", port: int = 0) -> _FrameServer:
+    """
+    Uzunluk önekli TCP çerçeve sunucusu (port=0: boş port; server.server_address[1]).
+    """
+    server = _FrameServer((host, port), _FrameHandler)
+    server.aggregator = agg
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
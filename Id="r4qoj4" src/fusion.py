@@ -2,36 +2,257 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from collections import defaultdict, deque
-from typing import Dict, List, Tuple, Optional
+from typing import Deque, Dict, List, Sequence, Set, Tuple, Optional
+import heapq
 import time
 import numpy as np
 
-from common import StepPacket
+from common import SLOTS, StepPacket
+from ringbuf import RingBuffer
 
 
-@dataclass
+@dataclass(**SLOTS)
 class Bucket:
     packets: List[StepPacket] = field(default_factory=list)
+    modules: Set[str] = field(default_factory=set) # rapor veren modüller (adaptif kapanış)
 
 
 # site_id -> ts -> Bucket
 BUCKETS: Dict[str, Dict[int, Bucket]] = defaultdict(lambda: defaultdict(Bucket))
 
+# fused nokta kolonları (dashboard.FLOW_BUF; yalnızca gösterim, float32 yeterli)
+FUSED_FIELDS = [("ts", np.int64), ("flow", np.float32), ("ratio", np.float32), ("n_used", np.uint16)]
+# FUSED_HISTORY kayıtları fuse_ready çıktısıyla birebir aynı kalsın diye float64
+FUSED_HISTORY_FIELDS = [("ts", np.int64), ("flow", np.float64), ("ratio", np.float64), ("n_used", np.uint16)]
+
 # site_id -> history: (ts, flow, ratio, n_used)
-FUSED_HISTORY: Dict[str, deque] = defaultdict(lambda: deque(maxlen=900))
+FUSED_HISTORY: Dict[str, RingBuffer] = defaultdict(lambda: RingBuffer(900, FUSED_HISTORY_FIELDS, ts_field="ts"))
+
+# kapanış sırası indeksi: (ts, site_id) min-heap.
+# Deadline ts + close_lag_s olduğundan ts sırası deadline sırasıyla aynıdır.
+BUCKET_HEAP: List[Tuple[int, str]] = []
+
+# Event-time durumu (site bazında):
+# WATERMARK: kapatılan en büyük bucket ts'i; ts <= watermark olan paket geç gelmiştir
+# RETAINED: kapanmış bucket'ların paketleri, allowed_lateness_s boyunca düzeltme için tutulur
+# MODULE_LAST: modül -> son paket ts'i (adaptif kapanış için bilinen modüller)
+WATERMARK: Dict[str, int] = {}
+RETAINED: Dict[str, Dict[int, List[StepPacket]]] = defaultdict(dict)
+MODULE_LAST: Dict[str, Dict[str, int]] = defaultdict(dict)
+ADAPTIVE_READY: Set[str] = set() # son fuse_ready'den beri bir bucket'ı tamamlanan siteler
+DIRTY_RETAINED: Set[Tuple[str, int]] = set() # geç paket alan kapanmış bucket'lar
+
+# geç paketlerle yeniden fuse edilen noktalar (FUSED_HISTORY'ye eklenmez)
+CORRECTIONS: Deque[Tuple[str, int, float, float, int]] = deque(maxlen=10000)
+
+# ingest() dönüş değerleri
+ACCEPTED, LATE_MERGED, LATE_DROPPED, FUTURE_DROPPED = "accepted", "late_merged", "late_dropped", "future_dropped"
 
 
 @dataclass(frozen=True)
 class FusionThresholds:
     close_lag_s: int = 2
     outlier_mad_k: float = 6.0
+    allowed_lateness_s: int = 10 # watermark'tan bu kadar eski geç paketler düzeltme üretir, daha eskiler atılır
+    max_future_s: int = 5 # ts > now + max_future_s olan paketler atılır (saat kayması)
+    max_open_buckets: int = 64 # site başına açık bucket sınırı; aşılırsa en eskisi zorla kapanır
+    adaptive_close: bool = True # bilinen tüm modüller raporladıysa close_lag_s beklenmez
+    module_ttl_s: int = 10 # bu kadar süredir paket göndermeyen modül "bilinen" sayılmaz
 
 
 THR = FusionThresholds()
 
 
-def ingest(pkt: StepPacket) -> None:
-    BUCKETS[pkt.site_id][pkt.ts].packets.append(pkt)
+def reset_state() -> None:
+    """
+    Açık bucket'ları ve fused geçmişini sıfırlar (replay, benchmark ve testler için).
+    """
+    BUCKETS.clear()
+    BUCKET_HEAP.clear()
+    FUSED_HISTORY.clear()
+    WATERMARK.clear()
+    RETAINED.clear()
+    MODULE_LAST.clear()
+    ADAPTIVE_READY.clear()
+    DIRTY_RETAINED.clear()
+    CORRECTIONS.clear()
+
+
+def ingest(pkt: StepPacket, now_ts: Optional[int] = None, thr: FusionThresholds = THR) -> str:
+    """
+    Paketi site/ts bucket'ına ekler. Kapanmış bir bucket'a ait (geç) paketler
+    allowed_lateness_s içindeyse tutulan bucket'a eklenir ve düzeltme üretir, değilse atılır;
+    gelecekteki ts'ler atılır. Returns: ACCEPTED / LATE_MERGED / LATE_DROPPED / FUTURE_DROPPED.
+    """
+    if now_ts is None:
+        now_ts = int(time.time())
+    if pkt.ts > now_ts + thr.max_future_s:
+        return FUTURE_DROPPED
+
+    site_id = pkt.site_id
+    wm = WATERMARK.get(site_id)
+    if wm is not None and pkt.ts <= wm:
+        if pkt.ts < wm - thr.allowed_lateness_s:
+            return LATE_DROPPED
+        RETAINED[site_id].setdefault(pkt.ts, []).append(pkt)
+        DIRTY_RETAINED.add((site_id, pkt.ts))
+        return LATE_MERGED
+
+    mods = MODULE_LAST[site_id]
+    if mods.get(pkt.module_id, 0) < pkt.ts:
+        mods[pkt.module_id] = pkt.ts
+
+    by_ts = BUCKETS[site_id]
+    if pkt.ts not in by_ts:
+        heapq.heappush(BUCKET_HEAP, (pkt.ts, site_id))
+        # susan modüller bilinenlerden düşer; yoksa site hiç tamamlanmış sayılmaz ve pop_adaptive
+        # (budamanın diğer yeri) bir daha çalışmaz. Bucket başına bir kez, paket başına değil.
+        cutoff = pkt.ts - thr.module_ttl_s
+        for m in [m for m, last in mods.items() if last < cutoff]:
+            del mods[m]
+    bucket = by_ts[pkt.ts]
+    bucket.packets.append(pkt)
+    bucket.modules.add(pkt.module_id)
+    if thr.adaptive_close and len(bucket.modules) >= len(mods):
+        ADAPTIVE_READY.add(site_id)
+    if len(by_ts) > thr.max_open_buckets:
+        ADAPTIVE_READY.add(site_id) # pop_adaptive en eskileri zorla kapatır
+    return ACCEPTED
+
+
+def ingest_batch(pkts: Sequence[StepPacket], now_ts: Optional[int] = None, thr: FusionThresholds = THR) -> Dict[str, int]:
+    """
+    ingest() ile aynı sonuç, ama paketler (site, ts) gruplarına toplanır: watermark, bucket ve
+    modül kayıtları paket başına değil grup başına bir kez işlenir (bir saniyede bir sitenin tüm
+    modülleri tek grup). Watermark yalnızca fuse ile ilerlediğinden batch içinde sabittir.
+    Returns: ACCEPTED dışındaki durumların sayıları.
+    """
+    if now_ts is None:
+        now_ts = int(time.time())
+    groups: Dict[Tuple[str, int], List[StepPacket]] = {}
+    for pkt in pkts:
+        g = groups.get((pkt.site_id, pkt.ts))
+        if g is None:
+            groups[(pkt.site_id, pkt.ts)] = [pkt]
+        else:
+            g.append(pkt)
+
+    counts: Dict[str, int] = {}
+    future = now_ts + thr.max_future_s
+    for (site_id, ts), group in groups.items():
+        if ts > future:
+            counts[FUTURE_DROPPED] = counts.get(FUTURE_DROPPED, 0) + len(group)
+            continue
+        wm = WATERMARK.get(site_id)
+        if wm is not None and ts <= wm:
+            if ts < wm - thr.allowed_lateness_s:
+                counts[LATE_DROPPED] = counts.get(LATE_DROPPED, 0) + len(group)
+                continue
+            RETAINED[site_id].setdefault(ts, []).extend(group)
+            DIRTY_RETAINED.add((site_id, ts))
+            counts[LATE_MERGED] = counts.get(LATE_MERGED, 0) + len(group)
+            continue
+
+        mods = MODULE_LAST[site_id]
+        for pkt in group:
+            if mods.get(pkt.module_id, 0) < ts:
+                mods[pkt.module_id] = ts
+        by_ts = BUCKETS[site_id]
+        if ts not in by_ts:
+            heapq.heappush(BUCKET_HEAP, (ts, site_id))
+            cutoff = ts - thr.module_ttl_s # bkz. ingest
+            for m in [m for m, last in mods.items() if last < cutoff]:
+                del mods[m]
+        bucket = by_ts[ts]
+        bucket.packets.extend(group)
+        bucket.modules.update(pkt.module_id for pkt in group)
+        if (thr.adaptive_close and len(bucket.modules) >= len(mods)) or len(by_ts) > thr.max_open_buckets:
+            ADAPTIVE_READY.add(site_id)
+    return counts
+
+
+def pop_ready(now_ts: int, thr: FusionThresholds = THR) -> List[Tuple[str, int]]:
+    """
+    Deadline'ı geçmiş (site_id, ts) anahtarlarını heap'ten çıkarır.
+    Maliyet yalnızca kapanan bucket sayısıyla orantılıdır; zaten fuse edilmiş
+    (ör. doğrudan fuse_bucket ile) bucket'ların kayıtları atlanır.
+    """
+    cutoff = now_ts - thr.close_lag_s
+    keys: List[Tuple[str, int]] = []
+    seen = set()
+    while BUCKET_HEAP and BUCKET_HEAP[0][0] <= cutoff:
+        entry = heapq.heappop(BUCKET_HEAP)
+        ts, site_id = entry
+        if entry not in seen and ts in BUCKETS.get(site_id, {}):
+            seen.add(entry)
+            keys.append((site_id, ts))
+    return keys
+
+
+def pop_adaptive(thr: FusionThresholds = THR) -> List[Tuple[str, int]]:
+    """
+    Bilinen tüm modülleri (module_ttl_s içinde paket gönderenler) raporlamış bucket'lar.
+    Site içinde ts sırası korunur: yalnızca en eski açık bucket'tan başlayan tamamlanmış
+    önek kapanır. max_open_buckets aşılmışsa en eski bucket'lar tamamlanmamış olsa da kapanır.
+    """
+    keys: List[Tuple[str, int]] = []
+    for site_id in ADAPTIVE_READY:
+        by_ts = BUCKETS.get(site_id)
+        if not by_ts:
+            continue
+        mods = MODULE_LAST[site_id]
+        newest = max(by_ts)
+        for m in [m for m, last in mods.items() if last < newest - thr.module_ttl_s]:
+            del mods[m]
+        n_known = len(mods)
+        open_ts = sorted(by_ts)
+        n_force = len(open_ts) - thr.max_open_buckets
+        for i, ts in enumerate(open_ts):
+            if i < n_force or (thr.adaptive_close and len(by_ts[ts].modules) >= n_known):
+                keys.append((site_id, ts))
+            else:
+                break
+    ADAPTIVE_READY.clear()
+    return keys
+
+
+def _close(keys: List[Tuple[str, int]], thr: FusionThresholds) -> None:
+    """
+    Kapanan bucket'lar için watermark'ı ilerletir ve paketleri geç gelenler için tutar.
+    """
+    for site_id, ts in keys:
+        if ts > WATERMARK.get(site_id, ts - 1):
+            WATERMARK[site_id] = ts
+        RETAINED[site_id][ts] = BUCKETS[site_id][ts].packets
+    for site_id in {s for s, _ in keys}:
+        kept = RETAINED[site_id]
+        horizon = WATERMARK[site_id] - thr.allowed_lateness_s
+        for ts in [t for t in kept if t < horizon]:
+            del kept[ts]
+            DIRTY_RETAINED.discard((site_id, ts))
+
+
+def _fuse_corrections(thr: FusionThresholds) -> None:
+    """
+    Geç paket alan tutulmuş bucket'ları tüm paketleriyle yeniden fuse edip CORRECTIONS'a ekler
+    (fuse_buckets ile aynı vektörel geçiş, _fuse_groups).
+    """
+    keys = [k for k in sorted(DIRTY_RETAINED, key=lambda k: (k[1], k[0])) if RETAINED.get(k[0], {}).get(k[1])]
+    DIRTY_RETAINED.clear()
+    if not keys:
+        return
+    flow, ratio, n_used = _fuse_groups([RETAINED[s][t] for (s, t) in keys], thr)
+    for i, (site_id, ts) in enumerate(keys):
+        CORRECTIONS.append((site_id, ts, float(flow[i]), float(ratio[i]), int(n_used[i])))
+
+
+def pop_corrections() -> List[Tuple[str, int, float, float, int]]:
+    """
+    Birikmiş düzeltmeleri (site_id, ts, flow, ratio, n_used) döndürür ve temizler.
+    """
+    out = list(CORRECTIONS)
+    CORRECTIONS.clear()
+    return out
 
 
 def _robust_filter(values: List[float], k: float) -> List[float]:
@@ -63,7 +284,7 @@ def fuse_bucket(site_id: str, ts: int, thr: FusionThresholds = THR) -> Optional[
     ratio = d1 / max(d1 + d2, 1.0)
     n_used = int(min(len(totals_f), len(dir1s_f), len(dir2s_f)))
 
-    FUSED_HISTORY[site_id].append((ts, flow, ratio, n_used))
+    FUSED_HISTORY[site_id].append(ts, flow, ratio, n_used)
 
     # cleanup
     del BUCKETS[site_id][ts]
@@ -73,19 +294,123 @@ def fuse_bucket(site_id: str, ts: int, thr: FusionThresholds = THR) -> Optional[
     return flow, ratio, n_used
 
 
-def fuse_ready(now_ts: Optional[int] = None, thr: FusionThresholds = THR) -> List[Tuple[str, int, float, float, int]]:
+def _group_robust_median(group: np.ndarray, values: np.ndarray, n_groups: int, k: float) -> Tuple[np.ndarray, np.ndarray]:
     """
-    close_lag_s kadar geride kalan bucket'ları fuse eder.
+    _robust_filter + np.median'in grup bazlı (vektörel) karşılığı.
+    group: her değerin bucket indeksi, values: float64 değerler.
+    Returns: (median, n_kept) — her ikisi de n_groups uzunluğunda.
+    """
+    order = np.lexsort((values, group))
+    g = group[order]
+    v = values[order]
+
+    counts = np.bincount(g, minlength=n_groups)
+    starts = np.zeros(n_groups, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    def _sorted_median(vals: np.ndarray, st: np.ndarray, cnt: np.ndarray) -> np.ndarray:
+        lo = vals[st + (cnt - 1) // 2]
+        hi = vals[st + cnt // 2]
+        return (lo + hi) / 2
+
+    med = _sorted_median(v, starts, counts)
+    dev = np.abs(v - med[g])
+
+    # MAD: sapmaları grup içinde tekrar sırala
+    dev_sorted = dev[np.lexsort((dev, g))]
+    mad = np.maximum(_sorted_median(dev_sorted, starts, counts), 1e-6)
+
+    keep = dev / mad[g] < k
+    kept_counts = np.bincount(g[keep], minlength=n_groups)
+    # <3 değerli ya da hepsi elenen bucket'lar filtrelenmez
+    passthrough = (counts < 3) | (kept_counts == 0)
+    keep |= passthrough[g]
+    kept_counts = np.where(passthrough, counts, kept_counts)
+
+    # v zaten grup içinde sıralı; maskelenmiş alt küme de sıralı kalır
+    kept_starts = np.zeros(n_groups, dtype=np.int64)
+    np.cumsum(kept_counts[:-1], out=kept_starts[1:])
+    return _sorted_median(v[keep], kept_starts, kept_counts), kept_counts
+
+
+def _fuse_groups(groups: List[List[StepPacket]], thr: FusionThresholds) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Boş olmayan paket gruplarını (bucket'ları) tek seferde fuse eder.
+    Tüm paketler kolonsal (grup, dir1, dir2) dizilerine toplanır; median/MAD filtresi
+    grup başına Python listesi yerine birkaç NumPy geçişinde hesaplanır.
+    Returns: (flow, ratio, n_used) — her biri len(groups) uzunluğunda, fuse_bucket ile birebir aynı.
+    """
+    sizes = np.fromiter((len(g) for g in groups), dtype=np.int64, count=len(groups))
+    n_total = int(sizes.sum())
+    group = np.repeat(np.arange(len(groups), dtype=np.int64), sizes)
+    dirs = np.fromiter(
+        (x for g in groups for p in g for x in (p.steps_dir1, p.steps_dir2)),
+        dtype=np.float64,
+        count=2 * n_total,
+    ).reshape(n_total, 2)
+    dir1s = dirs[:, 0]
+    dir2s = dirs[:, 1]
+
+    n = len(groups)
+    k = thr.outlier_mad_k
+    flow, n_tot = _group_robust_median(group, dir1s + dir2s, n, k)
+    d1, n_d1 = _group_robust_median(group, dir1s, n, k)
+    d2, n_d2 = _group_robust_median(group, dir2s, n, k)
+    ratio = d1 / np.maximum(d1 + d2, 1.0)
+    return flow, ratio, np.minimum(np.minimum(n_tot, n_d1), n_d2)
+
+
+def fuse_buckets(keys: List[Tuple[str, int]], thr: FusionThresholds = THR) -> List[Tuple[str, int, float, float, int]]:
+    """
+    Verilen (site_id, ts) bucket'larını tek vektörel geçişte (_fuse_groups) fuse eder.
+    Sonuçlar ve FUSED_HISTORY kayıtları fuse_bucket ile birebir aynıdır.
+    """
+    keys = [(s, t) for (s, t) in keys if BUCKETS.get(s, {}).get(t) is not None and BUCKETS[s][t].packets]
+    if not keys:
+        return []
+
+    flow, ratio, n_used = _fuse_groups([BUCKETS[s][t].packets for (s, t) in keys], thr)
+
+    out: List[Tuple[str, int, float, float, int]] = []
+    for i, (site_id, ts) in enumerate(keys):
+        res = (site_id, ts, float(flow[i]), float(ratio[i]), int(n_used[i]))
+        FUSED_HISTORY[site_id].append(*res[1:])
+        out.append(res)
+
+        # cleanup
+        del BUCKETS[site_id][ts]
+        if not BUCKETS[site_id]:
+            del BUCKETS[site_id]
+    return out
+
+
+def fuse_ready(
+    now_ts: Optional[int] = None,
+    thr: FusionThresholds = THR,
+    batch: bool = True,
+) -> List[Tuple[str, int, float, float, int]]:
+    """
+    close_lag_s kadar geride kalan ve (adaptive_close) tamamlanmış bucket'ları fuse eder.
+    Sonuçlar ts sırasındadır (aynı ts içinde site_id sırası). Geç paketlerle değişen
+    kapanmış bucket'lar CORRECTIONS'a yazılır (pop_corrections).
+    batch=True: tüm siteler tek vektörel geçişte (fuse_buckets), False: bucket başına fuse_bucket.
     """
     if now_ts is None:
         now_ts = int(time.time())
 
+    _fuse_corrections(thr)
+    keys = pop_ready(now_ts, thr)
+    if ADAPTIVE_READY:
+        keys = sorted(set(keys).union(pop_adaptive(thr)), key=lambda k: (k[1], k[0]))
+    _close(keys, thr)
+
+    if batch:
+        return fuse_buckets(keys, thr)
+
     out: List[Tuple[str, int, float, float, int]] = []
-    for site_id, by_ts in list(BUCKETS.items()):
-        ready = [t for t in by_ts.keys() if t <= now_ts - thr.close_lag_s]
-        for ts in sorted(ready):
-            res = fuse_bucket(site_id, ts, thr)
-            if res is not None:
-                flow, ratio, n_used = res
-                out.append((site_id, ts, flow, ratio, n_used))
+    for site_id, ts in keys:
+        res = fuse_bucket(site_id, ts, thr)
+        if res is not None:
+            flow, ratio, n_used = res
+            out.append((site_id, ts, flow, ratio, n_used))
     return out
@@ -1,22 +1,115 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from collections import defaultdict, deque
-from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import bisect
+import heapq
 import numpy as np
 
-from common import StepPacket
+from common import SLOTS, StepPacket
+from ids import IDS, packet_key
 
+TOTALS_DEPTH = 120 # modül başına tutulan son paket toplamı
 
-@dataclass
+
+class TotalsStore:
+    """
+    Tüm modüllerin son TOTALS_DEPTH paket toplamı tek (keys x depth) int32 dizide; her satır
+    dairesel yazılır, satırın kaç kez yazıldığı ModuleHealthState.n_totals'tadır.
+    Modül başına RingBuffer nesnesi yerine satır başına depth * 4 byte.
+    """
+
+    def __init__(self, depth: int = TOTALS_DEPTH, capacity: int = 1024):
+        self.depth = depth
+        self.buf = np.zeros((capacity, depth), dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.buf.nbytes
+
+    def ensure(self, key: int) -> None:
+        if key >= len(self.buf):
+            grown = np.zeros((max(2 * len(self.buf), key + 1), self.depth), dtype=np.int32)
+            grown[: len(self.buf)] = self.buf
+            self.buf = grown
+
+    def last(self, key: int, n_written: int, n: int) -> np.ndarray:
+        """
+        Satırın son min(n, yazılan, depth) değeri, eskiden yeniye.
+        """
+        m = min(n, n_written, self.depth)
+        return self.buf[key, (n_written - m + np.arange(m)) % self.depth]
+
+
+TOTALS = TotalsStore()
+
+
+@dataclass(**SLOTS)
 class ModuleHealthState:
+    key: int # ids.IDS anahtarı (TOTALS satırı)
     last_ts: int = 0
-    totals: deque = field(default_factory=lambda: deque(maxlen=120))
+    n_totals: int = 0 # TOTALS satırına yazılan toplam örnek
     last_flag: Optional[str] = None
+    seq: int = 0 # kayıt sırası (alarm sıralaması MODULES sırasıyla aynı kalsın)
+    deadline_ts: Optional[int] = None # OFFLINE_HEAP'teki canlı kaydın ts'i (<= last_ts)
+
+    # artımlı sayaçlar (update_health her pakette O(1) / O(log w) günceller)
+    zero_run: int = 0 # sondan kaç örnek art arda 0
+    const_run: int = 0 # sondan kaç örnek art arda aynı değer
+    last_total: int = 0
+    window: List[int] = field(default_factory=list) # son win_size örnek, sıralı (streaming median)
+    win_size: int = 0
 
+    def __len__(self) -> int:
+        """
+        Tutulan örnek sayısı (en fazla TOTALS.depth).
+        """
+        return min(self.n_totals, TOTALS.depth)
 
-# key: (site_id, module_id)
-HEALTH: Dict[Tuple[str, str], ModuleHealthState] = defaultdict(ModuleHealthState)
+    def rebuild_window(self, size: int) -> None:
+        self.win_size = size
+        self.window = sorted(TOTALS.last(self.key, self.n_totals, size).tolist())
+
+    def push(self, total: int, win_size: int) -> None:
+        if win_size != self.win_size:
+            self.rebuild_window(win_size)
+        n = self.n_totals
+        buf, depth = TOTALS.buf, TOTALS.depth
+        if min(n, depth) >= win_size:
+            # pencereden çıkan en eski örnek
+            old = int(buf[self.key, (n - win_size) % depth])
+            del self.window[bisect.bisect_left(self.window, old)]
+        bisect.insort(self.window, total)
+
+        self.zero_run = self.zero_run + 1 if total == 0 else 0
+        self.const_run = self.const_run + 1 if (n and total == self.last_total) else 1
+        self.last_total = total
+        buf[self.key, n % depth] = total
+        self.n_totals = n + 1
+
+    def window_median(self) -> float:
+        w = self.window
+        n = len(w)
+        return (w[(n - 1) // 2] + w[n // 2]) / 2
+
+
+# ids.IDS anahtarı -> state (None: bu process'te henüz paket gelmedi)
+STATES: List[Optional[ModuleHealthState]] = []
+# kayıt sırasıyla tüm state'ler (MODULES[st.seq] is st)
+MODULES: List[ModuleHealthState] = []
+
+# site_id -> module_id -> state (aynı nesneler, site bazında indeks)
+SITE_MODULES: Dict[str, Dict[str, ModuleHealthState]] = defaultdict(dict)
+
+# offline deadline indeksi: (ts, key) min-heap, modül başına tek canlı kayıt
+OFFLINE_HEAP: List[Tuple[int, int]] = []
+OFFLINE: Set[int] = set() # şu an offline modüllerin anahtarları
+
+# son outlier kontrolünden beri paket gelen siteler ve site bazında son outlier sonucu
+DIRTY_SITES: Set[str] = set()
+_OUTLIER_CACHE: Dict[str, List[dict]] = {}
+_OUTLIER_THR: List[Optional["HealthThresholds"]] = [None]
 
 
 @dataclass(frozen=True)
@@ -27,41 +120,128 @@ class HealthThresholds:
     outlier_window: int = 30
     outlier_mad_k: float = 6.0
 
+    def __post_init__(self):
+        # pencere TOTALS'tan beslenir: daha uzunu ne dolar ne de sınırlı kalır
+        if not 1 <= self.outlier_window <= TOTALS_DEPTH:
+            raise ValueError(f"outlier_window must be in [1, {TOTALS_DEPTH}], got {self.outlier_window}")
+
+
+def reset_state() -> None:
+    """
+    Tüm health state'ini sıfırlar (replay, benchmark ve testler için).
+    """
+    STATES.clear()
+    MODULES.clear()
+    SITE_MODULES.clear()
+    OFFLINE_HEAP.clear()
+    OFFLINE.clear()
+    DIRTY_SITES.clear()
+    _OUTLIER_CACHE.clear()
+    _OUTLIER_THR[0] = None
 
-def update_health(pkt: StepPacket) -> None:
-    st = HEALTH[(pkt.site_id, pkt.module_id)]
+
+def get_state(site_id: str, module_id: str, key: int = -1) -> ModuleHealthState:
+    """
+    Modül state'ini döndürür; ilk görülen modülü STATES/MODULES/SITE_MODULES'a kaydeder.
+    key verilmezse ids.IDS'ten çözülür.
+    """
+    if key < 0:
+        key = IDS.key(site_id, module_id)
+    if key >= len(STATES):
+        STATES.extend([None] * (key + 1 - len(STATES)))
+    st = STATES[key]
+    if st is None:
+        st = STATES[key] = ModuleHealthState(key, seq=len(MODULES))
+        MODULES.append(st)
+        SITE_MODULES[site_id][module_id] = st
+        TOTALS.ensure(key)
+    return st
+
+
+def update_health(pkt: StepPacket, thr: HealthThresholds = HealthThresholds()) -> ModuleHealthState:
+    key = packet_key(pkt)
+    st = STATES[key] if key < len(STATES) else None
+    if st is None:
+        st = get_state(pkt.site_id, pkt.module_id, key)
     st.last_ts = pkt.ts
-    st.totals.append(int(pkt.steps_dir1 + pkt.steps_dir2))
+    OFFLINE.discard(key)
+    if st.deadline_ts is None or pkt.ts < st.deadline_ts:
+        st.deadline_ts = pkt.ts
+        heapq.heappush(OFFLINE_HEAP, (pkt.ts, key))
+    DIRTY_SITES.add(pkt.site_id)
+    st.push(pkt.steps_dir1 + pkt.steps_dir2, thr.outlier_window)
+    return st
 
 
 def health_alerts_for_packet(pkt: StepPacket, thr: HealthThresholds = HealthThresholds()) -> List[dict]:
-    update_health(pkt)
-    return check_stuck(pkt.site_id, pkt.module_id, thr)
+    st = update_health(pkt, thr)
+    return _stuck_alerts(st, pkt.site_id, pkt.module_id, thr)
+
+
+def health_alerts_for_packets(pkts: Sequence[StepPacket], thr: HealthThresholds = HealthThresholds()) -> List[dict]:
+    """
+    Paket batch'i için health_alerts_for_packet (paket sırasıyla); alarmlara paketin ts'i eklenir.
+    """
+    alerts: List[dict] = []
+    for pkt in pkts:
+        st = update_health(pkt, thr)
+        if st.zero_run >= thr.stuck_zero_s or st.const_run >= thr.stuck_const_s:
+            for a in _stuck_alerts(st, pkt.site_id, pkt.module_id, thr):
+                a["ts"] = pkt.ts
+                alerts.append(a)
+    return alerts
 
 
 def check_offline(now_ts: int, thr: HealthThresholds) -> List[dict]:
+    """
+    Yalnızca deadline'ı geçmiş heap kayıtlarına bakar; o arada paket gelmiş modüller
+    güncel last_ts ile yeniden sıraya girer. Offline modüller her çağrıda raporlanır.
+    """
+    cutoff = now_ts - thr.offline_s
+    while OFFLINE_HEAP and OFFLINE_HEAP[0][0] <= cutoff:
+        ts, key = heapq.heappop(OFFLINE_HEAP)
+        st = STATES[key]
+        if ts != st.deadline_ts:
+            continue # eski kayıt
+        if st.last_ts <= cutoff:
+            st.deadline_ts = None
+            OFFLINE.add(key)
+        else:
+            st.deadline_ts = st.last_ts
+            heapq.heappush(OFFLINE_HEAP, (st.last_ts, key))
+
     alerts: List[dict] = []
-    for (site, mod), st in HEALTH.items():
-        if st.last_ts and (now_ts - st.last_ts) >= thr.offline_s:
-            alerts.append({"type": "SENSOR_OFFLINE", "site_id": site, "module_id": mod, "last_ts": st.last_ts})
+    for key in sorted(OFFLINE, key=lambda k: STATES[k].seq):
+        st = STATES[key]
+        if st.last_ts > cutoff:
+            # daha kısa offline_s ile çağrıldı: tekrar sıraya al
+            OFFLINE.discard(key)
+            st.deadline_ts = st.last_ts
+            heapq.heappush(OFFLINE_HEAP, (st.last_ts, key))
+            continue
+        site_id, module_id = IDS.names(key)
+        alerts.append({"type": "SENSOR_OFFLINE", "site_id": site_id, "module_id": module_id, "last_ts": st.last_ts})
     return alerts
 
 
 def check_stuck(site_id: str, module_id: str, thr: HealthThresholds) -> List[dict]:
-    st = HEALTH[(site_id, module_id)]
+    return _stuck_alerts(get_state(site_id, module_id), site_id, module_id, thr)
+
+
+def _stuck_alerts(st: ModuleHealthState, site_id: str, module_id: str, thr: HealthThresholds) -> List[dict]:
     alerts: List[dict] = []
 
-    if len(st.totals) < max(thr.stuck_zero_s, thr.stuck_const_s):
+    if len(st) < max(thr.stuck_zero_s, thr.stuck_const_s):
         return alerts
 
-    recent_zero = list(st.totals)[-thr.stuck_zero_s:]
-    if all(x == 0 for x in recent_zero):
+    # son stuck_zero_s örneğin hepsi 0 <=> 0 serisi en az o uzunlukta
+    if st.zero_run >= thr.stuck_zero_s:
         alerts.append({"type": "STUCK_ZERO", "site_id": site_id, "module_id": module_id})
         return alerts
 
-    recent_const = np.array(list(st.totals)[-thr.stuck_const_s:], dtype=float)
-    if float(np.std(recent_const)) < 1e-6:
-        alerts.append({"type": "STUCK_CONST", "site_id": site_id, "module_id": module_id, "value": float(recent_const[-1])})
+    # tamsayı sayımlarda std < 1e-6 <=> pencere sabit <=> sabit seri en az o uzunlukta
+    if st.const_run >= thr.stuck_const_s:
+        alerts.append({"type": "STUCK_CONST", "site_id": site_id, "module_id": module_id, "value": float(st.last_total)})
 
     return alerts
 
@@ -70,17 +250,18 @@ def check_outliers(site_id: str, thr: HealthThresholds) -> List[dict]:
     """
     Site içindeki modüllerin medyan akışına göre uç modülleri yakalar.
     """
-    modules = [(s, m) for (s, m) in HEALTH.keys() if s == site_id]
+    modules = SITE_MODULES.get(site_id, {})
     if len(modules) < 3:
         return []
 
     vals = []
     mod_vals = []
-    for (s, m) in modules:
-        st = HEALTH[(s, m)]
-        if len(st.totals) < thr.outlier_window:
+    for m, st in modules.items():
+        if len(st) < thr.outlier_window:
             continue
-        v = float(np.median(list(st.totals)[-thr.outlier_window:]))
+        if st.win_size != thr.outlier_window:
+            st.rebuild_window(thr.outlier_window)
+        v = float(st.window_median())
         vals.append(v)
         mod_vals.append((m, v))
 
@@ -99,3 +280,24 @@ def check_outliers(site_id: str, thr: HealthThresholds) -> List[dict]:
                 {"type": "OUTLIER_MODULE", "site_id": site_id, "module_id": m, "median": med, "value": v, "score": float(score)}
             )
     return alerts
+
+
+def check_outliers_changed(thr: HealthThresholds) -> List[dict]:
+    """
+    check_outliers'ı yalnızca son çağrıdan beri paket almış siteler için yeniden hesaplar;
+    değişmeyen sitelerin önceki sonuçları (aynı girdiden aynı alarm) tekrar döner.
+    """
+    if _OUTLIER_THR[0] != thr:
+        _OUTLIER_THR[0] = thr
+        _OUTLIER_CACHE.clear()
+        DIRTY_SITES.update(SITE_MODULES.keys())
+
+    for site_id in DIRTY_SITES:
+        alerts = check_outliers(site_id, thr)
+        if alerts:
+            _OUTLIER_CACHE[site_id] = alerts
+        else:
+            _OUTLIER_CACHE.pop(site_id, None)
+    DIRTY_SITES.clear()
+
+    return [dict(a) for alerts in _OUTLIER_CACHE.values() for a in alerts]
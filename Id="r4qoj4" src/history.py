@@ -0,0 +1,351 @@
+from __future__ import annotations
+"""
+Kalıcı, append-only geçmiş deposu:
+- fused noktalar, geç paket düzeltmeleri, modül bazında ham toplamlar ve alarmlar için ayrı akışlar (stream)
+- her akış sabit genişlikli kayıtlardan oluşan segment dosyalarıdır (NumPy structured dtype)
+- kapanan (sealed) segmentler ts'e göre sıralanır ve okumada memory-map edilir
+- zaman aralığı sorguları yalnızca çakışan segmentlere dokunur
+
+Dizin yapısı:
+  <root>/<stream>/active.seg                     (yazılan segment, geliş sırasıyla)
+  <root>/<stream>/<first_ts>_<last_ts>_<n>_<id>.seg   (sealed, ts sıralı)
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import math
+import os
+import threading
+import uuid
+import zlib
+import numpy as np
+
+from common import SITE_ID_LEN, MODULE_ID_LEN, StepPacket
+
+FUSED_DTYPE = np.dtype(
+    [("ts", "<i8"), ("site_id", f"S{SITE_ID_LEN}"), ("flow", "<f4"), ("ratio", "<f4"), ("n_used", "<u2")]
+)
+TOTALS_DTYPE = np.dtype(
+    [("ts", "<i8"), ("site_id", f"S{SITE_ID_LEN}"), ("module_id", f"S{MODULE_ID_LEN}"), ("total", "<i4")]
+)
+ALERT_TYPE_LEN = 20
+ALERT_DTYPE = np.dtype(
+    [
+        ("ts", "<i8"),
+        ("type", f"S{ALERT_TYPE_LEN}"),
+        ("site_id", f"S{SITE_ID_LEN}"),
+        ("module_id", f"S{MODULE_ID_LEN}"),
+        ("value", "<f8"), # alarmın ana sayısal alanı (z/score/ratio/value/flow), yoksa NaN
+    ]
+)
+
+# alarm dict'inden "value" olarak saklanacak alanların öncelik sırası
+ALERT_VALUE_KEYS = ("z", "score", "ratio", "value", "flow", "last_ts")
+
+SEALED_SUFFIX = ".seg"
+ACTIVE_NAME = "active" + SEALED_SUFFIX
+
+
+@dataclass(frozen=True)
+class Segment:
+    path: str
+    first_ts: int
+    last_ts: int
+    n: int
+
+
+def _parse_segment(directory: str, name: str) -> Optional[Segment]:
+    if not name.endswith(SEALED_SUFFIX) or name == ACTIVE_NAME:
+        return None
+    try:
+        first, last, n, _ = name[: -len(SEALED_SUFFIX)].split("_")
+        return Segment(os.path.join(directory, name), int(first), int(last), int(n))
+    except ValueError:
+        return None
+
+
+class SegmentStream:
+    """
+    Tek bir kayıt tipinin append-only segment dizisi.
+    append() bellekte tamponlar, flush() aktif segmente yazar; aktif segment
+    segment_records kayda ulaşınca sıralanıp sealed segment olur.
+    """
+
+    def __init__(self, root: str, name: str, dtype: np.dtype, segment_records: int = 1 << 16):
+        self.dir = os.path.join(root, name)
+        self.dtype = np.dtype(dtype)
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        self._pending: List[np.ndarray] = []
+        # okunan sealed segmentler: path -> okuyucu sayısı; okunurken birleştirilen/silinmesi
+        # gerekenler son okuyucu bırakınca silinir (Windows'ta açık memmap silinemez)
+        self._readers: Dict[str, int] = {}
+        self._doomed: Set[str] = set()
+        os.makedirs(self.dir, exist_ok=True)
+
+        # crash sonrası yarım kalan son kaydı at
+        active = os.path.join(self.dir, ACTIVE_NAME)
+        if os.path.exists(active):
+            size = os.path.getsize(active)
+            if size % self.dtype.itemsize:
+                with open(active, "r+b") as f:
+                    f.truncate(size - size % self.dtype.itemsize)
+        self._segments = self._scan()
+
+    def _scan(self) -> List[Segment]:
+        segs = [_parse_segment(self.dir, n) for n in os.listdir(self.dir)]
+        return sorted((s for s in segs if s is not None), key=lambda s: (s.first_ts, s.last_ts))
+
+    @property
+    def active_path(self) -> str:
+        return os.path.join(self.dir, ACTIVE_NAME)
+
+    def segments(self) -> List[Segment]:
+        with self._lock:
+            return list(self._segments)
+
+    def append(self, rows: np.ndarray) -> None:
+        if len(rows):
+            with self._lock:
+                self._pending.append(np.asarray(rows, dtype=self.dtype))
+
+    def flush(self) -> None:
+        """
+        Bekleyen kayıtları aktif segmente yazar; dolduysa seal eder.
+        """
+        with self._lock:
+            if self._pending:
+                rows = np.concatenate(self._pending)
+                self._pending = []
+                with open(self.active_path, "ab") as f:
+                    f.write(rows.tobytes())
+            if os.path.exists(self.active_path) and os.path.getsize(self.active_path) >= self.segment_records * self.dtype.itemsize:
+                self._seal_active()
+
+    def _write_sealed(self, rows: np.ndarray) -> Segment:
+        rows = rows[np.argsort(rows["ts"], kind="stable")]
+        name = f"{int(rows['ts'][0]):012d}_{int(rows['ts'][-1]):012d}_{len(rows)}_{uuid.uuid4().hex[:8]}{SEALED_SUFFIX}"
+        path = os.path.join(self.dir, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return Segment(path, int(rows["ts"][0]), int(rows["ts"][-1]), len(rows))
+
+    def _seal_active(self) -> None:
+        rows = np.fromfile(self.active_path, dtype=self.dtype)
+        if len(rows):
+            self._segments.append(self._write_sealed(rows))
+            self._segments.sort(key=lambda s: (s.first_ts, s.last_ts))
+        os.remove(self.active_path)
+
+    def _open(self, seg: Segment) -> np.ndarray:
+        return np.memmap(seg.path, dtype=self.dtype, mode="r", shape=(seg.n,))
+
+    def _remove(self, path: str) -> None:
+        # kilit altında çağrılır
+        if self._readers.get(path):
+            self._doomed.add(path)
+        else:
+            os.remove(path)
+
+    def _release(self, segs: List[Segment]) -> None:
+        with self._lock:
+            for seg in segs:
+                n = self._readers[seg.path] - 1
+                if n:
+                    self._readers[seg.path] = n
+                    continue
+                del self._readers[seg.path]
+                if seg.path in self._doomed:
+                    self._doomed.discard(seg.path)
+                    os.remove(seg.path)
+
+    def _read_segment(self, seg: Segment, t0: int, t1: int, key: Optional[bytes], chunk_rows: int) -> List[np.ndarray]:
+        mm = self._open(seg)
+        ts = mm["ts"]
+        lo = int(np.searchsorted(ts, t0, side="left"))
+        hi = int(np.searchsorted(ts, t1, side="right"))
+        parts = []
+        for a in range(lo, hi, chunk_rows):
+            chunk = mm[a : min(a + chunk_rows, hi)]
+            parts.append(np.array(chunk if key is None else chunk[chunk["site_id"] == key]))
+        return parts # memmap burada kapanır: kopyalar dışında referans kalmaz
+
+    def query(self, t0: int, t1: int, site_id: Optional[str] = None, chunk_rows: int = 1 << 18) -> np.ndarray:
+        """
+        t0 <= ts <= t1 kayıtları (ts sıralı kopya). site_id verilirse o siteyle sınırlı.
+        Sealed segmentlerde searchsorted ile yalnızca ilgili aralık, chunk_rows'luk parçalar halinde
+        okunur; site filtresi kopyalamadan önce uygulanır (bellek yalnızca eşleşen kayıtlar kadar).
+        Okunan segmentler sorgu bitene kadar compact/retain tarafından silinmez.
+        """
+        with self._lock:
+            segs = [s for s in self._segments if s.last_ts >= t0 and s.first_ts <= t1]
+            for seg in segs:
+                self._readers[seg.path] = self._readers.get(seg.path, 0) + 1
+            pending = list(self._pending)
+            active = np.fromfile(self.active_path, dtype=self.dtype) if os.path.exists(self.active_path) else None
+        key = id_key(site_id, SITE_ID_LEN) if site_id is not None else None
+
+        parts: List[np.ndarray] = []
+        try:
+            for seg in segs:
+                parts.extend(self._read_segment(seg, t0, t1, key, chunk_rows))
+        finally:
+            self._release(segs)
+        for rows in ([active] if active is not None else []) + pending:
+            mask = (rows["ts"] >= t0) & (rows["ts"] <= t1)
+            if key is not None:
+                mask &= rows["site_id"] == key
+            parts.append(rows[mask])
+
+        out = np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype)
+        return out[np.argsort(out["ts"], kind="stable")]
+
+    def compact(self, target_records: int) -> int:
+        """
+        Ardışık küçük sealed segmentleri target_records boyutuna kadar birleştirir.
+        Dosya okuma/yazma kilit dışında yapılır; append/flush bloklanmaz.
+        Returns: birleştirilen segment sayısı.
+        """
+        groups: List[List[Segment]] = []
+        group: List[Segment] = []
+        for seg in self.segments():
+            if seg.n >= target_records or (group and sum(s.n for s in group) + seg.n > target_records):
+                groups.append(group)
+                group = []
+            if seg.n < target_records:
+                group.append(seg)
+        groups.append(group)
+
+        merged = 0
+        for group in (g for g in groups if len(g) > 1):
+            rows = np.concatenate([np.fromfile(s.path, dtype=self.dtype) for s in group])
+            new = self._write_sealed(rows)
+            with self._lock:
+                old = {s.path for s in group}
+                self._segments = [s for s in self._segments if s.path not in old] + [new]
+                self._segments.sort(key=lambda s: (s.first_ts, s.last_ts))
+                for path in old:
+                    self._remove(path)
+            merged += len(group)
+        return merged
+
+    def retain(self, min_ts: int) -> int:
+        """
+        Tamamı min_ts'ten eski sealed segmentleri siler. Returns: silinen segment sayısı.
+        """
+        with self._lock:
+            old = [s for s in self._segments if s.last_ts < min_ts]
+            for s in old:
+                self._remove(s.path)
+            self._segments = [s for s in self._segments if s.last_ts >= min_ts]
+            return len(old)
+
+
+def id_key(name: str, width: int) -> bytes:
+    """
+    site/modül id'sinin sabit genişlikli alan anahtarı. Sığmayan id sessizce kesilmez (kesilmiş
+    hali sorguda tam id'yle eşleşmez, farklı id'ler çakışır): baş kısmı + "~" + crc32 ile kısaltılır.
+    Yazma ve sorgu aynı anahtarı kullanır.
+    """
+    raw = name.encode("utf-8")
+    if len(raw) <= width:
+        return raw
+    return raw[: width - 9] + b"~" + b"%08x" % zlib.crc32(raw)
+
+
+def alert_value(a: dict) -> float:
+    """
+    Alarmın ana sayısal alanı (ALERT_VALUE_KEYS sırasıyla ilk sayı), yoksa NaN.
+    """
+    for k in ALERT_VALUE_KEYS:
+        v = a.get(k)
+        if isinstance(v, (int, float)):
+            return float(v)
+    return math.nan
+
+
+class HistoryStore:
+    """
+    fused / totals / alerts akışları + bakım (compaction, retention).
+    """
+
+    def __init__(
+        self,
+        root: str,
+        retention_s: int = 30 * 86400,
+        segment_records: int = 1 << 16,
+        compact_records: int = 1 << 20,
+    ):
+        self.root = root
+        self.retention_s = retention_s
+        self.compact_records = compact_records
+        self.fused = SegmentStream(root, "fused", FUSED_DTYPE, segment_records)
+        self.corrections = SegmentStream(root, "corrections", FUSED_DTYPE, segment_records)
+        self.totals = SegmentStream(root, "totals", TOTALS_DTYPE, segment_records)
+        self.alerts = SegmentStream(root, "alerts", ALERT_DTYPE, segment_records)
+
+    @staticmethod
+    def _fused_rows(fused: Sequence[Tuple[str, int, float, float, int]]) -> np.ndarray:
+        rows = np.zeros(len(fused), dtype=FUSED_DTYPE)
+        for i, (site_id, ts, flow, ratio, n_used) in enumerate(fused):
+            rows[i] = (ts, id_key(site_id, SITE_ID_LEN), flow, ratio, n_used)
+        return rows
+
+    def add_fused(self, fused: Sequence[Tuple[str, int, float, float, int]]) -> None:
+        self.fused.append(self._fused_rows(fused))
+
+    def add_corrections(self, corrections: Sequence[Tuple[str, int, float, float, int]]) -> None:
+        """
+        Geç paketlerle yeniden fuse edilen noktalar (fusion.pop_corrections); fused akışı değişmez.
+        """
+        self.corrections.append(self._fused_rows(corrections))
+
+    def add_packets(self, pkts: Sequence[StepPacket]) -> None:
+        rows = np.zeros(len(pkts), dtype=TOTALS_DTYPE)
+        for i, p in enumerate(pkts):
+            rows[i] = (p.ts, id_key(p.site_id, SITE_ID_LEN), id_key(p.module_id, MODULE_ID_LEN), p.steps_dir1 + p.steps_dir2)
+        self.totals.append(rows)
+
+    def add_alerts(self, alerts: Iterable[dict]) -> None:
+        alerts = list(alerts)
+        rows = np.zeros(len(alerts), dtype=ALERT_DTYPE)
+        for i, a in enumerate(alerts):
+            rows[i] = (
+                int(a.get("ts", 0)),
+                str(a.get("type", "")).encode("utf-8")[:ALERT_TYPE_LEN],
+                id_key(str(a.get("site_id", "")), SITE_ID_LEN),
+                id_key(str(a.get("module_id", "")), MODULE_ID_LEN),
+                alert_value(a),
+            )
+        self.alerts.append(rows)
+
+    def streams(self) -> Tuple[SegmentStream, ...]:
+        return (self.fused, self.corrections, self.totals, self.alerts)
+
+    def flush(self) -> None:
+        for s in self.streams():
+            s.flush()
+
+    def maintenance(self, now_ts: int) -> None:
+        """
+        Retention dışındaki segmentleri siler, küçük segmentleri birleştirir.
+        """
+        for s in self.streams():
+            s.retain(now_ts - self.retention_s)
+            s.compact(self.compact_records)
+
+    def query_fused(self, site_id: str, t0: int, t1: int) -> np.ndarray:
+        return self.fused.query(t0, t1, site_id)
+
+    def query_corrections(self, site_id: str, t0: int, t1: int) -> np.ndarray:
+        return self.corrections.query(t0, t1, site_id)
+
+    def query_totals(self, site_id: str, t0: int, t1: int) -> np.ndarray:
+        return self.totals.query(t0, t1, site_id)
+
+    def query_alerts(self, t0: int, t1: int, site_id: Optional[str] = None) -> np.ndarray:
+        return self.alerts.query(t0, t1, site_id)
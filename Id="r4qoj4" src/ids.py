@@ -0,0 +1,76 @@
+from __future__ import annotations
+"""
+Merkezi kimlik kaydı: site / modül adları ve (site, modül) çiftleri süreç içinde yoğun tamsayı
+indekslere bir kez, decode anında eşlenir. Alt sistemler state'lerini bu indekslerle adreslenen
+listelerde/dizilerde tutar; adlar yalnızca alarm/çıktı üretirken geri çözülür.
+
+İndeksler süreç yereldir (sharded worker'lar kendi kaydını tutar); diske veya başka process'e
+ad yerine indeks yazılmamalıdır. Kayıt yalnızca büyür: reset_state'ler indeksleri geçersiz kılmaz.
+"""
+
+from typing import Dict, List, Tuple
+import sys
+
+
+class IdRegistry:
+    def __init__(self):
+        self.site_index: Dict[str, int] = {}
+        self.sites: List[str] = []
+        self.module_index: Dict[str, int] = {}
+        self.modules: List[str] = []
+        # (site_id, module_id) -> key; key -> site / modül indeksi
+        self.key_index: Dict[Tuple[str, str], int] = {}
+        self.key_site: List[int] = []
+        self.key_module: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.key_site)
+
+    def site(self, name: str) -> int:
+        i = self.site_index.get(name)
+        if i is None:
+            name = sys.intern(name)
+            i = self.site_index[name] = len(self.sites)
+            self.sites.append(name)
+        return i
+
+    def module(self, name: str) -> int:
+        i = self.module_index.get(name)
+        if i is None:
+            name = sys.intern(name)
+            i = self.module_index[name] = len(self.modules)
+            self.modules.append(name)
+        return i
+
+    def resolve(self, site_id: str, module_id: str) -> Tuple[str, str, int]:
+        """
+        Adları kayıttaki tekil (interned) str nesnelerine çevirir ve çift anahtarını döndürür;
+        ilk görülen çift kaydedilir.
+        """
+        key = self.key_index.get((site_id, module_id))
+        if key is None:
+            s = self.site(site_id)
+            m = self.module(module_id)
+            site_id, module_id = self.sites[s], self.modules[m]
+            key = self.key_index[(site_id, module_id)] = len(self.key_site)
+            self.key_site.append(s)
+            self.key_module.append(m)
+            return site_id, module_id, key
+        return self.sites[self.key_site[key]], self.modules[self.key_module[key]], key
+
+    def key(self, site_id: str, module_id: str) -> int:
+        return self.resolve(site_id, module_id)[2]
+
+    def names(self, key: int) -> Tuple[str, str]:
+        return self.sites[self.key_site[key]], self.modules[self.key_module[key]]
+
+
+IDS = IdRegistry()
+
+
+def packet_key(pkt) -> int:
+    """
+    Paketin çift anahtarı; decode dışında oluşturulan paketlerde (key=-1) kayıttan çözülür.
+    """
+    key = pkt.key
+    return key if key >= 0 else IDS.key(pkt.site_id, pkt.module_id)
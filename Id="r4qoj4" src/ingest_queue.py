@@ -0,0 +1,122 @@
+from __future__ import annotations
+"""
+MQTT alımı ile işleme arasında sınırlı kuyruk.
+paho callback'i yalnızca put() çağırır; işleme thread'i get_batch() ile toplu çeker.
+
+Taşma politikaları:
+- drop_oldest: kuyruk doluysa en eski paket atılır
+- coalesce: aynı (site_id, module_id, ts) için bekleyen paket yenisiyle değiştirilir
+  (tekrar gönderimler yer kaplamaz); yeni anahtar ve dolu kuyrukta drop_oldest gibi davranır
+- block: yer açılana kadar (block_timeout) bekler -> broker'a TCP backpressure;
+  süre dolarsa yeni paket atılır
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+
+from common import StepPacket
+
+POLICIES = ("drop_oldest", "coalesce", "block")
+
+
+@dataclass
+class QueueStats:
+    enqueued: int = 0
+    dequeued: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    max_depth: int = 0
+    last_batch_size: int = 0
+    last_batch_lag_s: float = 0.0 # batch'teki en eski paketin kuyrukta bekleme süresi
+
+
+class IngestQueue:
+    def __init__(self, maxsize: int = 10000, policy: str = "drop_oldest", block_timeout: Optional[float] = 1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy} (expected one of {POLICIES})")
+        if maxsize <= 0:
+            raise ValueError("maxsize must be > 0")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats = QueueStats()
+        # key -> (pkt, recv_ts); coalesce dışında key artan sıra numarasıdır
+        self._items: "OrderedDict[Any, Tuple[StepPacket, float]]" = OrderedDict()
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, pkt: StepPacket, recv_ts: Optional[float] = None) -> bool:
+        """
+        Paketi kuyruğa ekler. Paket atıldıysa False döner.
+        """
+        if recv_ts is None:
+            recv_ts = time.monotonic()
+        with self._cond:
+            if self.policy == "coalesce":
+                key: Any = (pkt.site_id, pkt.module_id, pkt.ts)
+                if key in self._items:
+                    self._items[key] = (pkt, self._items[key][1])
+                    self.stats.coalesced += 1
+                    return True
+            else:
+                key = self._seq
+                self._seq += 1
+
+            if len(self._items) >= self.maxsize:
+                if self.policy == "block":
+                    if not self._cond.wait_for(lambda: len(self._items) < self.maxsize, self.block_timeout):
+                        self.stats.dropped += 1
+                        return False
+                else:
+                    self._items.popitem(last=False)
+                    self.stats.dropped += 1
+
+            self._items[key] = (pkt, recv_ts)
+            self.stats.enqueued += 1
+            self.stats.max_depth = max(self.stats.max_depth, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get_batch(self, max_items: int = 512, timeout: Optional[float] = None) -> List[StepPacket]:
+        """
+        En fazla max_items paketi geliş sırasıyla çeker; kuyruk boşsa timeout kadar bekler.
+        """
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: len(self._items) > 0, timeout):
+                return []
+            n = min(max_items, len(self._items))
+            batch = [self._items.popitem(last=False)[1] for _ in range(n)]
+            self.stats.dequeued += n
+            self.stats.last_batch_size = n
+            self.stats.last_batch_lag_s = time.monotonic() - batch[0][1]
+            self._cond.notify_all()
+        return [pkt for pkt, _ in batch]
+
+    def lag_s(self) -> float:
+        """
+        Kuyruktaki en eski paketin yaşı (saniye).
+        """
+        with self._cond:
+            if not self._items:
+                return 0.0
+            return time.monotonic() - next(iter(self._items.values()))[1]
+
+    def metrics(self) -> Dict[str, float]:
+        st = self.stats
+        return {
+            "depth": len(self._items),
+            "max_depth": st.max_depth,
+            "lag_s": self.lag_s(),
+            "enqueued": st.enqueued,
+            "dequeued": st.dequeued,
+            "dropped": st.dropped,
+            "coalesced": st.coalesced,
+            "last_batch_size": st.last_batch_size,
+            "last_batch_lag_s": st.last_batch_lag_s,
+        }
@@ -0,0 +1,222 @@
+from __future__ import annotations
+"""
+Test/yük üretimi için süreç içi minimal MQTT 3.1.1 broker'ı (Mosquitto yerine).
+Desteklenen: CONNECT, PUBLISH (QoS 0/1/2; QoS 2 PUBREC/PUBREL/PUBCOMP akışıyla, aboneye QoS 0
+iletilir), SUBSCRIBE/UNSUBSCRIBE (+ ve # joker), PINGREQ, DISCONNECT. Kalıcı oturum, retain ve
+will yoktur.
+
+Kullanım:
+  broker = LocalBroker(port=0).start()   # port=0: boş port seçilir
+  ... paho client'ları 127.0.0.1:broker.port'a bağlanır ...
+  broker.stop()
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+import socket
+import socketserver
+import struct
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(filt: str, topic: str) -> bool:
+    """
+    MQTT topic filter eşlemesi (+ tek seviye, # kalan tüm seviyeler).
+    """
+    f_parts = filt.split("/")
+    t_parts = topic.split("/")
+    for i, f in enumerate(f_parts):
+        if f == "#":
+            return True
+        if i >= len(t_parts) or (f != "+" and f != t_parts[i]):
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+def _encode_len(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n % 128
+        n //= 128
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+def _packet(ptype: int, flags: int, body: bytes) -> bytes:
+    return bytes(((ptype << 4) | flags,)) + _encode_len(len(body)) + body
+
+
+class _Session:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.filters: Set[str] = set()
+        self.qos2_pending: Set[bytes] = set() # PUBREC gönderilmiş, PUBREL beklenen packet id'ler
+
+    def send(self, data: bytes) -> None:
+        with self.lock:
+            self.sock.sendall(data)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "_Server"
+
+    def _read_exact(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed")
+            buf += chunk
+        return bytes(buf)
+
+    def _read_packet(self) -> Tuple[int, int, bytes]:
+        first = self._read_exact(1)[0]
+        length, mult = 0, 1
+        while True:
+            b = self._read_exact(1)[0]
+            length += (b & 0x7F) * mult
+            mult *= 128
+            if not b & 0x80:
+                break
+        return first >> 4, first & 0x0F, self._read_exact(length) if length else b""
+
+    def handle(self) -> None:
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sess = _Session(self.request)
+        broker = self.server.broker
+        try:
+            ptype, _, _ = self._read_packet()
+            if ptype != CONNECT:
+                return
+            sess.send(_packet(CONNACK, 0, b"\x00\x00"))
+            broker._add(sess)
+            while True:
+                ptype, flags, body = self._read_packet()
+                if ptype == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    tlen = struct.unpack_from("!H", body)[0]
+                    topic = body[2 : 2 + tlen].decode("utf-8")
+                    pos = 2 + tlen
+                    if qos:
+                        pid = body[pos : pos + 2]
+                        pos += 2
+                    if qos == 2:
+                        # tam bir kez: PUBREL gelene kadar aynı id'nin tekrarı (DUP) iletilmez
+                        if pid not in sess.qos2_pending:
+                            sess.qos2_pending.add(pid)
+                            broker._route(topic, body[2 : 2 + tlen], body[pos:])
+                        sess.send(_packet(PUBREC, 0, pid))
+                        continue
+                    broker._route(topic, body[2 : 2 + tlen], body[pos:])
+                    if qos:
+                        sess.send(_packet(PUBACK, 0, pid))
+                elif ptype == PUBREL:
+                    sess.qos2_pending.discard(body[:2])
+                    sess.send(_packet(PUBCOMP, 0, body[:2]))
+                elif ptype == SUBSCRIBE:
+                    pid, pos, codes = body[:2], 2, bytearray()
+                    while pos < len(body):
+                        tlen = struct.unpack_from("!H", body, pos)[0]
+                        broker._subscribe(sess, body[pos + 2 : pos + 2 + tlen].decode("utf-8"))
+                        pos += 2 + tlen + 1
+                        codes.append(0) # QoS 0 verildi
+                    sess.send(_packet(SUBACK, 0, pid + bytes(codes)))
+                elif ptype == UNSUBSCRIBE:
+                    pid, pos = body[:2], 2
+                    while pos < len(body):
+                        tlen = struct.unpack_from("!H", body, pos)[0]
+                        broker._unsubscribe(sess, body[pos + 2 : pos + 2 + tlen].decode("utf-8"))
+                        pos += 2 + tlen
+                    sess.send(_packet(UNSUBACK, 0, pid))
+                elif ptype == PINGREQ:
+                    sess.send(_packet(PINGRESP, 0, b""))
+                elif ptype == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker._remove(sess)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    broker: "LocalBroker"
+
+
+class LocalBroker:
+    """
+    Thread başına bağlantı; yönlendirme topic -> abone listesi önbelleğiyle yapılır.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self._sessions: List[_Session] = []
+        self._routes: Dict[str, List[_Session]] = {}
+        self._server: Optional[_Server] = None
+
+    def start(self) -> "LocalBroker":
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            with self._lock:
+                for s in self._sessions:
+                    try:
+                        s.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            self._server = None
+
+    def _add(self, sess: _Session) -> None:
+        with self._lock:
+            self._sessions.append(sess)
+
+    def _remove(self, sess: _Session) -> None:
+        with self._lock:
+            if sess in self._sessions:
+                self._sessions.remove(sess)
+                self._routes.clear()
+
+    def _subscribe(self, sess: _Session, filt: str) -> None:
+        with self._lock:
+            sess.filters.add(filt)
+            self._routes.clear()
+
+    def _unsubscribe(self, sess: _Session, filt: str) -> None:
+        with self._lock:
+            sess.filters.discard(filt)
+            self._routes.clear()
+
+    def _route(self, topic: str, raw_topic: bytes, payload: bytes) -> None:
+        with self._lock:
+            self.received += 1
+            subs = self._routes.get(topic)
+            if subs is None:
+                subs = self._routes[topic] = [
+                    s for s in self._sessions if any(topic_matches(f, topic) for f in s.filters)
+                ]
+        if subs:
+            data = _packet(PUBLISH, 0, struct.pack("!H", len(raw_topic)) + raw_topic + payload)
+            for s in subs:
+                try:
+                    s.send(data)
+                except OSError:
+                    continue
+            with self._lock:
+                self.delivered += len(subs)
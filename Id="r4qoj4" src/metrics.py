@@ -0,0 +1,234 @@
+from __future__ import annotations
+"""
+Hot-path ölçümleri:
+- Aşama bazında gecikme histogramları (sabit log-ölçekli bucket'lar, observe O(log B))
+- Etiketli sayaçlar (paket, drop, geç paket, tipe göre alarm ...)
+- Gauge'lar: okuma (scrape) anında çağrılan fonksiyonlar (bucket/kuyruk boyu, yapı bellekleri)
+- Prometheus text formatı (render) ve çalışma anında açılıp kapanan örnekleyici profiler
+
+Kullanım:
+  t = time.perf_counter(); ...; METRICS.observe("decode", time.perf_counter() - t)
+  METRICS.inc("packets_total")
+"""
+
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+import bisect
+import os
+import sys
+import threading
+
+# 1 µs .. ~10 s, her dekad 4 bucket
+LATENCY_BUCKETS: Tuple[float, ...] = tuple(float(f"{m}e{e}") for e in range(-6, 1) for m in (1, 2, 3, 5)) + (10.0,)
+
+PREFIX = "piyon_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _fmt_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1) # son eleman: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Bucket içinde doğrusal interpolasyonla yaklaşık yüzdelik.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            if acc + c >= rank and c:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lo + (hi - lo) * (rank - acc) / c
+            acc += c
+        return self.bounds[-1]
+
+
+class Metrics:
+    """
+    Süreç genelinde tek kayıt (METRICS). Tüm güncellemeler tek kilit altında;
+    kilit kısa ve çoğunlukla çekişmesizdir.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[str, Tuple[Callable[[], object], str]] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            h = self.histograms.get(stage)
+            if h is None:
+                h = self.histograms[stage] = Histogram()
+            h.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, fn: Callable[[], object], help: str = "") -> None:
+        """
+        fn() sayı veya {etiket_değeri: sayı} dict döndürür (dict'te etiket adı "name").
+        """
+        self.gauges[name] = (fn, help)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def stage_summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                k: {"count": h.count, "p50": h.quantile(0.5), "p99": h.quantile(0.99), "mean": h.sum / max(h.count, 1)}
+                for k, h in sorted(self.histograms.items())
+            }
+
+    def counter_values(self) -> Dict[Tuple[str, Labels], float]:
+        with self._lock:
+            return dict(self.counters)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition formatı (0.0.4).
+        """
+        lines: List[str] = []
+        with self._lock:
+            hists = {k: (list(h.counts), h.sum, h.count) for k, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        name = PREFIX + "stage_seconds"
+        lines.append(f"# HELP {name} Pipeline stage latency")
+        lines.append(f"# TYPE {name} histogram")
+        for stage in sorted(hists):
+            counts, total, n = hists[stage]
+            labels = (("stage", stage),)
+            acc = 0
+            for bound, c in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+                acc += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{name}_bucket{_fmt_labels(labels, le)} {acc}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {n}")
+
+        seen = set()
+        for (cname, labels), v in sorted(counters.items()):
+            full = PREFIX + cname
+            if full not in seen:
+                seen.add(full)
+                lines.append(f"# TYPE {full} counter")
+            lines.append(f"{full}{_fmt_labels(labels)} {v}")
+
+        for gname, (fn, help_) in sorted(self.gauges.items()):
+            full = PREFIX + gname
+            try:
+                v = fn()
+            except Exception:
+                continue
+            if help_:
+                lines.append(f"# HELP {full} {help_}")
+            lines.append(f"# TYPE {full} gauge")
+            if isinstance(v, dict):
+                for k, x in sorted(v.items()):
+                    lines.append(f'{full}{{name="{k}"}} {x}')
+            else:
+                lines.append(f"{full} {v}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class SamplingProfiler:
+    """
+    Çalışma anında açılıp kapanan örnekleyici profiler: interval_s aralıkla tüm thread'lerin
+    (kendisi hariç) yığınlarını sys._current_frames() ile alır ve "collapsed stack" sayar.
+    Kapalıyken maliyeti sıfırdır.
+    """
+
+    def __init__(self, interval_s: float = 0.005, max_depth: int = 48):
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def clear(self) -> None:
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval_s):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                parts = []
+                f = frame
+                while f is not None and len(parts) < self.max_depth:
+                    code = f.f_code
+                    parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    f = f.f_back
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                parts.append(names.get(tid, str(tid)))
+                self.stacks[";".join(reversed(parts))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        flamegraph.pl / speedscope uyumlu "a;b;c N" satırları.
+        """
+        return "\n".join(f"{k} {v}" for k, v in self.stacks.most_common()) + "\n"
+
+    def top(self, n: int = 15) -> List[Tuple[str, float]]:
+        """
+        En çok örneklenen yaprak fonksiyonlar ve örnek oranları.
+        """
+        leaf: Counter = Counter()
+        for k, v in self.stacks.items():
+            leaf[k.rsplit(";", 1)[-1]] += v
+        total = max(sum(leaf.values()), 1)
+        return [(k, v / total) for k, v in leaf.most_common(n)]
+
+
+PROFILER = SamplingProfiler()
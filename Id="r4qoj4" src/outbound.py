@@ -0,0 +1,565 @@
+from __future__ import annotations
+"""
+Dış tüketiciler (bina yönetimi, şehir operasyonları) için MQTT çıkışı: fused akış ve alarm olayları.
+
+Üreten thread'ler (periodic_fusion, push_alerts) yalnızca add_fused / add_alerts ile bellekteki
+kuyruğa ekler; ayrı bir flush thread'i her flush_s'de (alarmlar için alert_flush_s) bekleyenleri
+site başına batch'lere toplar, kompakt ikili kodlar ve tek kalıcı paho client'ıyla bloklamadan
+yayınlar. Broker'a ulaşılamazken (veya onaylanmamış mesaj sayısı max_unacked'ı aşınca) batch'ler
+disk üzerindeki outbox'a yazılır; bağlantı gelince en eskiden başlayarak yeniden yayınlanır.
+Teslim en az bir kezdir: tüketici (epoch, seq) ile tekrarları ayıklayabilir.
+
+Topic'ler:
+  <prefix>/flow/<site_id>     fused noktalar (ts, flow, ratio, n_used)
+  <prefix>/alerts/<site_id>   alarm yaşam döngüsü olayları (sitesiz alarmlar: <prefix>/alerts/_gateway)
+
+Batch: magic | version | kind | flags | seq | epoch | base_ts | n | site uzunluğu | site | gövde
+  flow gövdesi:  n x (dt u4 = ts - base_ts, flow f4, ratio f4, n_used u2)
+  alerts gövdesi: kompakt JSON dizi
+Büyük gövdeler zlib ile sıkıştırılır (flags). decode_batch tüketici tarafı içindir.
+
+ÇALIŞTIRMA (yayınlanan batch'leri izleme):
+  python src/outbound.py --host 127.0.0.1 --port 1883
+"""
+
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+from metrics import METRICS
+
+Fused = Tuple[str, int, float, float, int]
+
+OUT_TOPIC = "piyon/v1/out"
+GATEWAY_SITE = "_gateway" # site_id'siz alarmların topic seviyesi
+BATCH_MAGIC = b"PIYO"
+BATCH_VERSION = 1
+KIND_FLOW, KIND_ALERTS = 1, 2
+KIND_NAMES = {KIND_FLOW: "flow", KIND_ALERTS: "alerts"}
+FLAG_ZLIB = 0x01
+ZLIB_MIN_BYTES = 512
+
+_HEADER = struct.Struct("<4sBBBIqqIH")
+FLOW_WIRE = np.dtype([("dt", "<u4"), ("flow", "<f4"), ("ratio", "<f4"), ("n_used", "<u2")])
+
+# outbox kaydı: topic uzunluğu | payload uzunluğu | topic | payload
+_RECORD = struct.Struct("<HI")
+OUTBOX_SUFFIX = ".obx"
+
+
+def encode_batch(kind: int, seq: int, epoch: int, site_id: str, base_ts: int, n: int, body: bytes) -> bytes:
+    flags = 0
+    if len(body) >= ZLIB_MIN_BYTES:
+        packed = zlib.compress(body, 1)
+        if len(packed) < len(body):
+            body, flags = packed, FLAG_ZLIB
+    site = site_id.encode("utf-8")
+    return _HEADER.pack(BATCH_MAGIC, BATCH_VERSION, kind, flags, seq, epoch, base_ts, n, len(site)) + site + body
+
+
+def encode_flow(seq: int, epoch: int, site_id: str, points: List[Fused]) -> bytes:
+    """
+    Bir sitenin fused noktaları (ts sırasıyla) -> flow batch'i.
+    """
+    base_ts = points[0][1]
+    rows = np.zeros(len(points), dtype=FLOW_WIRE)
+    rows["dt"] = np.fromiter((p[1] - base_ts for p in points), dtype=np.int64, count=len(points))
+    rows["flow"] = np.fromiter((p[2] for p in points), dtype=np.float32, count=len(points))
+    rows["ratio"] = np.fromiter((p[3] for p in points), dtype=np.float32, count=len(points))
+    rows["n_used"] = np.fromiter((p[4] for p in points), dtype=np.uint16, count=len(points))
+    return encode_batch(KIND_FLOW, seq, epoch, site_id, base_ts, len(points), rows.tobytes())
+
+
+def encode_alerts(seq: int, epoch: int, site_id: str, events: List[dict]) -> bytes:
+    body = json.dumps(events, separators=(",", ":"), default=float).encode("utf-8")
+    base_ts = min(int(ev.get("ts", 0)) for ev in events)
+    return encode_batch(KIND_ALERTS, seq, epoch, site_id, base_ts, len(events), body)
+
+
+@dataclass
+class OutBatch:
+    kind: int
+    seq: int
+    epoch: int
+    site_id: str
+    base_ts: int
+    points: Optional[np.ndarray] = None # (ts i8, flow, ratio, n_used)
+    alerts: List[dict] = field(default_factory=list)
+
+
+def decode_batch(payload: bytes) -> OutBatch:
+    """
+    Batch -> OutBatch. Format hatalarında ValueError fırlatır.
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError(f"Batch too short: {len(payload)} bytes")
+    magic, version, kind, flags, seq, epoch, base_ts, n, site_len = _HEADER.unpack_from(payload)
+    if magic != BATCH_MAGIC:
+        raise ValueError("Not an outbound batch")
+    if version != BATCH_VERSION:
+        raise ValueError(f"Unsupported batch version: {version}")
+    pos = _HEADER.size
+    try:
+        site_id = payload[pos : pos + site_len].decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Bad site id: {e}") from e
+    body = payload[pos + site_len :]
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt batch body: {e}") from e
+    out = OutBatch(kind, seq, epoch, site_id, base_ts)
+    if kind == KIND_FLOW:
+        if len(body) != n * FLOW_WIRE.itemsize:
+            raise ValueError(f"Flow batch size mismatch: {len(body)} bytes for {n} points")
+        rows = np.frombuffer(body, dtype=FLOW_WIRE)
+        pts = np.zeros(n, dtype=[("ts", "<i8"), ("flow", "<f4"), ("ratio", "<f4"), ("n_used", "<u2")])
+        pts["ts"] = base_ts + rows["dt"].astype(np.int64)
+        for f in ("flow", "ratio", "n_used"):
+            pts[f] = rows[f]
+        out.points = pts
+    elif kind == KIND_ALERTS:
+        try:
+            out.alerts = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Bad alerts body: {e}") from e
+    else:
+        raise ValueError(f"Unknown batch kind: {kind}")
+    return out
+
+
+class Outbox:
+    """
+    Yayınlanamayan (topic, payload) kayıtları için disk kuyruğu: <dir>/<no>.obx segmentleri.
+    Yazma aktif segmente eklenir, segment_bytes'ı aşınca yenisi açılır; okuma en eski
+    segmentten başlar ve tamamen yayınlanan segment silinir. Toplam boyut max_bytes'ı aşarsa
+    en eski segmentler atılır. Process çökmesinde yarım okunmuş segment baştan yeniden yayınlanır,
+    yarım yazılmış son kayıt atılır.
+    Tek thread'den (OutboundPublisher flush thread'i) kullanılır.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 << 20, max_bytes: int = 512 << 20):
+        self.dir = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.dropped_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.segments: Deque[int] = deque(sorted(self._scan()))
+        self.sizes: Dict[int, int] = {no: os.path.getsize(self._path(no)) for no in self.segments}
+        self._writer = None # aktif segmentin dosyası (segments[-1])
+        self._read_pos = 0 # segments[0] içindeki okuma konumu
+
+    def _scan(self) -> Iterable[int]:
+        for name in os.listdir(self.dir):
+            if name.endswith(OUTBOX_SUFFIX):
+                try:
+                    yield int(name[: -len(OUTBOX_SUFFIX)])
+                except ValueError:
+                    continue
+
+    def _path(self, no: int) -> str:
+        return os.path.join(self.dir, f"{no:012d}{OUTBOX_SUFFIX}")
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def put(self, records: Iterable[Tuple[str, bytes]]) -> None:
+        for topic, payload in records:
+            t = topic.encode("utf-8")
+            rec = _RECORD.pack(len(t), len(payload)) + t + payload
+            if self._writer is None or self.sizes[self.segments[-1]] >= self.segment_bytes:
+                self._roll()
+            self._writer.write(rec)
+            self.sizes[self.segments[-1]] += len(rec)
+        if self._writer is not None:
+            self._writer.flush()
+        while self.nbytes > self.max_bytes and len(self.segments) > 1:
+            self._drop_oldest()
+
+    def _roll(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        no = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(no)
+        self.sizes[no] = 0
+        self._writer = open(self._path(no), "ab")
+
+    def _pop_front(self) -> None:
+        no = self.segments.popleft()
+        self.sizes.pop(no)
+        self._read_pos = 0
+        if self._writer is not None and not self.segments:
+            self._writer.close()
+            self._writer = None
+        os.remove(self._path(no))
+
+    def _drop_oldest(self) -> None:
+        self.dropped_bytes += self.sizes[self.segments[0]] - self._read_pos
+        self._pop_front()
+
+    def _read(self, no: int, pos: int, max_records: int) -> List[Tuple[str, bytes]]:
+        out: List[Tuple[str, bytes]] = []
+        with open(self._path(no), "rb") as f:
+            f.seek(pos)
+            while len(out) < max_records:
+                head = f.read(_RECORD.size)
+                if len(head) < _RECORD.size:
+                    break
+                t_len, p_len = _RECORD.unpack(head)
+                data = f.read(t_len + p_len)
+                if len(data) < t_len + p_len:
+                    break # yarım yazılmış kayıt (çökme)
+                out.append((data[:t_len].decode("utf-8"), data[t_len:]))
+        return out
+
+    def peek(self, max_records: int) -> List[Tuple[str, bytes]]:
+        """
+        En eski segmentten sıradaki en fazla max_records kayıt (commit edilene kadar silinmez).
+        Yazılmakta olmayan bir segmentte okuma konumundan sonra tam kayıt kalmadıysa (boş dosya
+        veya çökmeden kalan yarım kayıt) segment biter: silinir, kalan baytlar dropped_bytes'a eklenir.
+        """
+        while self.segments:
+            no = self.segments[0]
+            writing = self._writer is not None and len(self.segments) == 1
+            if writing:
+                self._writer.flush()
+            out = self._read(no, self._read_pos, max_records)
+            if out or writing:
+                return out
+            self._drop_oldest()
+        return []
+
+    def commit(self, records: List[Tuple[str, bytes]]) -> None:
+        """
+        peek ile alınan kayıtlar yayınlandı: okuma konumu ilerler, biten segment silinir.
+        """
+        if not records:
+            return
+        self._read_pos += sum(_RECORD.size + len(t.encode("utf-8")) + len(p) for t, p in records)
+        if self._read_pos >= self.sizes[self.segments[0]]:
+            self._pop_front()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+@dataclass
+class OutboundStats:
+    flow_batches: int = 0
+    alert_batches: int = 0
+    points: int = 0
+    alerts: int = 0
+    published: int = 0
+    bytes: int = 0
+    outboxed: int = 0 # outbox'a yazılan batch
+    replayed: int = 0 # outbox'tan yayınlanan batch
+    dropped: int = 0 # bellek kuyruğu taşması
+    acked: int = 0
+
+
+class OutboundPublisher:
+    """
+    add_fused / add_alerts thread-safe ve O(1)'dir (deque append); tüm ağ ve disk işi
+    start() ile açılan flush thread'inde ve paho'nun network thread'inde yapılır.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        qos: int = 1,
+        flush_s: float = 5.0,
+        alert_flush_s: float = 1.0,
+        outbox_dir: Optional[str] = "data/outbox",
+        topic_prefix: str = OUT_TOPIC,
+        max_batch_points: int = 600,
+        max_pending: int = 200_000,
+        max_unacked: int = 1000,
+        client_id: str = "",
+    ):
+        if qos not in (0, 1, 2):
+            raise ValueError(f"Invalid QoS: {qos}")
+        self.addr = (host, port)
+        self.qos = qos
+        self.flush_s = flush_s
+        self.alert_flush_s = min(alert_flush_s, flush_s)
+        self.topic_prefix = topic_prefix
+        self.max_batch_points = max_batch_points
+        self.max_unacked = max_unacked
+        self.client_id = client_id
+        self.epoch = int(time.time())
+        self.seq = 0
+        self.stats = OutboundStats()
+        self.outbox = Outbox(outbox_dir) if outbox_dir else None
+        self._fused: Deque[Fused] = deque(maxlen=max_pending)
+        self._alerts: Deque[dict] = deque(maxlen=max_pending)
+        self._unacked: set = set() # QoS > 0: onay bekleyen mid'ler
+        self._early: set = set() # publish() dönmeden onaylananlar
+        self._unacked_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.client = None
+
+    # --- üretici tarafı (herhangi bir thread) ---
+
+    def add_fused(self, fused: Iterable[Fused]) -> None:
+        q = self._fused
+        for row in fused:
+            if len(q) == q.maxlen:
+                self.stats.dropped += 1
+            q.append(row)
+
+    def add_alerts(self, events: Iterable[dict]) -> None:
+        q = self._alerts
+        for ev in events:
+            if len(q) == q.maxlen:
+                self.stats.dropped += 1
+            q.append(ev)
+
+    # --- bağlantı ---
+
+    def start(self) -> "OutboundPublisher":
+        import paho.mqtt.client as mqtt
+
+        client = mqtt.Client(client_id=self.client_id)
+        client.max_inflight_messages_set(self.max_unacked)
+        client.reconnect_delay_set(1, 30)
+        client.on_connect = self._on_connect
+        client.on_disconnect = lambda c, u, rc: self._connected.clear()
+        client.on_publish = self._on_publish
+        self.client = client
+        try:
+            client.connect(*self.addr, 60)
+        except OSError:
+            client.connect_async(*self.addr, 60) # broker kapalı: loop yeniden dener, bu arada outbox
+        client.loop_start()
+        self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+        self._thread.start()
+        return self
+
+    def _on_connect(self, client, userdata, flags, rc) -> None:
+        if rc == 0:
+            self._connected.set()
+            self._wake.set() # outbox hemen boşaltılsın
+
+    def _on_publish(self, client, userdata, mid) -> None:
+        if self.qos == 0:
+            return
+        with self._unacked_lock:
+            if mid in self._unacked:
+                self._unacked.discard(mid)
+            else:
+                self._early.add(mid)
+        self.stats.acked += 1
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    @property
+    def unacked(self) -> int:
+        return len(self._unacked)
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        """
+        Bekleyenleri son kez gönderir (bağlantı yoksa outbox'a yazar) ve client'ı kapatır.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+        deadline = time.monotonic() + timeout_s
+        while self.unacked and self.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+        if self.outbox is not None:
+            self.outbox.close()
+
+    # --- flush thread'i ---
+
+    def _run(self) -> None:
+        next_flow = time.monotonic() + self.flush_s
+        while True:
+            stopping = self._stop.is_set()
+            try:
+                self.flush(flow=stopping or time.monotonic() >= next_flow)
+            except Exception as e:
+                METRICS.inc("outbound_errors_total", error=type(e).__name__)
+            if stopping:
+                return
+            if time.monotonic() >= next_flow:
+                next_flow += self.flush_s * max(1, int((time.monotonic() - next_flow) // self.flush_s) + 1)
+            self._wake.wait(self.alert_flush_s)
+            self._wake.clear()
+
+    def flush(self, flow: bool = True) -> int:
+        """
+        Outbox'ı (bağlantı varsa) boşaltır, sonra bekleyen alarmları (flow=True ise fused noktaları da)
+        site başına batch'leyip yayınlar. Returns: üretilen batch sayısı.
+        """
+        t0 = time.perf_counter()
+        self._drain_outbox()
+        records = self._alert_batches()
+        if flow:
+            records.extend(self._flow_batches())
+        if records:
+            self._send(records)
+        METRICS.observe("outbound_flush", time.perf_counter() - t0)
+        return len(records)
+
+    def _next_seq(self) -> int:
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return self.seq
+
+    def _topic(self, kind: int, site_id: str) -> str:
+        return f"{self.topic_prefix}/{KIND_NAMES[kind]}/{site_id or GATEWAY_SITE}"
+
+    def _flow_batches(self) -> List[Tuple[str, bytes]]:
+        q = self._fused
+        by_site: Dict[str, List[Fused]] = defaultdict(list)
+        for _ in range(len(q)):
+            row = q.popleft()
+            by_site[row[0]].append(row)
+        out: List[Tuple[str, bytes]] = []
+        for site_id in sorted(by_site):
+            pts = sorted(by_site[site_id], key=lambda r: r[1])
+            for i in range(0, len(pts), self.max_batch_points):
+                chunk = pts[i : i + self.max_batch_points]
+                out.append((self._topic(KIND_FLOW, site_id), encode_flow(self._next_seq(), self.epoch, site_id, chunk)))
+                self.stats.points += len(chunk)
+            self.stats.flow_batches += (len(pts) + self.max_batch_points - 1) // self.max_batch_points
+        return out
+
+    def _alert_batches(self) -> List[Tuple[str, bytes]]:
+        q = self._alerts
+        by_site: Dict[str, List[dict]] = defaultdict(list)
+        for _ in range(len(q)):
+            ev = q.popleft()
+            by_site[ev.get("site_id") or ""].append(ev)
+        out: List[Tuple[str, bytes]] = []
+        for site_id in sorted(by_site):
+            evs = by_site[site_id]
+            out.append((self._topic(KIND_ALERTS, site_id), encode_alerts(self._next_seq(), self.epoch, site_id, evs)))
+            self.stats.alerts += len(evs)
+            self.stats.alert_batches += 1
+        return out
+
+    def _can_publish(self) -> bool:
+        return self.connected and self.unacked < self.max_unacked
+
+    def _publish(self, topic: str, payload: bytes) -> bool:
+        """
+        paho kuyruğuna ekler (soket yazımı network thread'indedir). QoS > 0 mesajlar bağlantı
+        koparsa paho tarafından yeniden gönderilir; QoS 0 ve reddedilenler False döner.
+        """
+        import paho.mqtt.client as mqtt
+
+        info = self.client.publish(topic, payload, qos=self.qos)
+        ok = info.rc == mqtt.MQTT_ERR_SUCCESS or (self.qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN)
+        if ok and self.qos > 0:
+            # on_publish paho'nun kilidi altında çağrılır: publish bu kilit dışında tutulur,
+            # publish dönmeden gelen onaylar _early'de karşılanır
+            with self._unacked_lock:
+                if info.mid in self._early:
+                    self._early.discard(info.mid)
+                else:
+                    self._unacked.add(info.mid)
+        if ok:
+            self.stats.published += 1
+            self.stats.bytes += len(payload)
+            METRICS.inc("outbound_bytes_total", len(payload))
+        return ok
+
+    def _send(self, records: List[Tuple[str, bytes]]) -> None:
+        # outbox'ta bekleyen varken yeni batch'ler de arkasına yazılır (site içi sıra korunur)
+        i = 0
+        if self.outbox is None or not len(self.outbox):
+            while i < len(records) and self._can_publish() and self._publish(*records[i]):
+                i += 1
+        rest = records[i:]
+        if not rest:
+            return
+        if self.outbox is None:
+            self.stats.dropped += len(rest)
+            METRICS.inc("outbound_dropped_total", len(rest))
+            return
+        self.outbox.put(rest)
+        self.stats.outboxed += len(rest)
+        METRICS.inc("outbound_outboxed_total", len(rest))
+
+    def _drain_outbox(self, chunk: int = 256) -> None:
+        box = self.outbox
+        while box is not None and len(box) and self._can_publish():
+            records = box.peek(min(chunk, self.max_unacked - self.unacked))
+            if not records:
+                break
+            sent = 0
+            for topic, payload in records:
+                if not self._can_publish() or not self._publish(topic, payload):
+                    break
+                sent += 1
+            box.commit(records[:sent])
+            self.stats.replayed += sent
+            if sent < len(records):
+                break
+
+    def metrics(self) -> dict:
+        box = self.outbox
+        return {
+            "connected": int(self.connected),
+            "pending_points": len(self._fused),
+            "pending_alerts": len(self._alerts),
+            "unacked": self.unacked,
+            "outbox_segments": len(box) if box is not None else 0,
+            "outbox_bytes": box.nbytes if box is not None else 0,
+            "outbox_dropped_bytes": box.dropped_bytes if box is not None else 0,
+            **{k: v for k, v in self.stats.__dict__.items()},
+        }
+
+
+def main():
+    import paho.mqtt.client as mqtt
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--prefix", default=OUT_TOPIC)
+    args = ap.parse_args()
+
+    def on_message(client, userdata, msg):
+        try:
+            b = decode_batch(msg.payload)
+        except ValueError as e:
+            print(f"[outbound] {msg.topic}: bad batch: {e}")
+            return
+        n = len(b.points) if b.kind == KIND_FLOW else len(b.alerts)
+        print(f"[outbound] {msg.topic} seq={b.seq} n={n} base_ts={b.base_ts} bytes={len(msg.payload)}")
+
+    client = mqtt.Client()
+    client.on_message = on_message
+    client.connect(args.host, args.port, 60)
+    client.subscribe(f"{args.prefix}/#", qos=1)
+    client.loop_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+from __future__ import annotations
+"""
+Kayıtlı paket loglarının offline replay / backfill'i:
+- JSONL (satır başına encode_packet çıktısı) veya binary log (art arda encode_packet_bin kayıtları, .bin)
+- Dosyalar parça parça okunur; binary loglar memory-map edilir
+- Pipeline (health + fusion + anomaly) simüle zamanla sürülür: saat = görülen en büyük paket ts'i,
+  fuse/health tick'leri bu saate göre çalışır (wall-clock beklenmez)
+- İsteğe bağlı site bazında çok process'li çalışma (sharded.shard_of ile aynı eşleme)
+
+Sonunda model state'i snapshot'lanabilir (yeni siteler için seasonal bootstrap); fused
+noktalar / alarmlar chunk chunk HistoryStore'a (veya on_chunk callback'ine) akıtılır,
+bellekte toplanmaz (collect=False).
+
+ÇALIŞTIRMA:
+  python src/replay.py logs/*.jsonl --workers 4 --snapshot data/model_snapshot.bin
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, Sequence
+import argparse
+import math
+import multiprocessing as mp
+import queue as queue_mod
+import time
+import numpy as np
+
+from common import (
+    PACKET_DTYPE,
+    StepPacket,
+    decode_batch_bin,
+    decode_packet,
+    encode_packet_bin,
+)
+from fusion import THR as FUSION_THR
+from pipeline import Fused, health_sweep, process_packets, process_tick, reset_state
+from sharded import shard_of
+
+BIN_LOG_SUFFIX = ".bin"
+
+OnChunk = Callable[[List[Fused], List[dict]], None]
+
+
+@dataclass
+class ReplayResult:
+    packets: int = 0
+    bad: int = 0 # decode edilemeyen JSONL satırları
+    sim_start: int = 0
+    sim_end: int = 0
+    elapsed_s: float = 0.0
+    n_fused: int = 0
+    n_alerts: int = 0
+    fused: List[Fused] = field(default_factory=list) # yalnızca collect=True iken
+    alerts: List[dict] = field(default_factory=list)
+
+    def merge(self, other: "ReplayResult") -> None:
+        self.sim_start = min(self.sim_start, other.sim_start) if self.packets else other.sim_start
+        self.sim_end = max(self.sim_end, other.sim_end)
+        self.packets += other.packets
+        self.bad += other.bad
+        self.n_fused += other.n_fused
+        self.n_alerts += other.n_alerts
+        self.fused.extend(other.fused)
+        self.alerts.extend(other.alerts)
+
+
+def _iter_jsonl(
+    path: str, chunk_size: int, keep_site: Optional[Callable[[str], bool]], bad: List[int]
+) -> Iterator[List[StepPacket]]:
+    chunk: List[StepPacket] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                pkt = decode_packet(line)
+            except ValueError:
+                bad[0] += 1
+                continue
+            if keep_site is None or keep_site(pkt.site_id):
+                chunk.append(pkt)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_bin(
+    path: str, chunk_size: int, keep_site: Optional[Callable[[str], bool]]
+) -> Iterator[List[StepPacket]]:
+    mm = np.memmap(path, dtype=PACKET_DTYPE, mode="r")
+    for lo in range(0, len(mm), chunk_size):
+        d = decode_batch_bin(mm[lo : lo + chunk_size].tobytes())
+        sites = d["sites"]
+        rows = np.arange(len(d["ts"]))
+        if keep_site is not None:
+            keep = np.array([keep_site(s) for s in sites], dtype=bool)
+            rows = rows[keep[d["site_idx"]]]
+        modules = d["modules"]
+        cols = [d[k][rows].tolist() for k in ("site_idx", "module_idx", "ts", "window_s", "steps_dir1", "steps_dir2", "vcap")]
+        yield [
+            StepPacket(sites[si], modules[mi], ts, w, s1, s2, None if math.isnan(v) else v)
+            for si, mi, ts, w, s1, s2, v in zip(*cols)
+        ]
+
+
+def iter_log(
+    path: str,
+    chunk_size: int = 8192,
+    keep_site: Optional[Callable[[str], bool]] = None,
+    bad: Optional[List[int]] = None,
+) -> Iterator[List[StepPacket]]:
+    """
+    Log dosyasını chunk_size paketlik listeler halinde okur (uzantıya göre JSONL / binary).
+    keep_site verilirse yalnızca o sitelerin paketleri döner; bad[0] bozuk JSONL satırlarını sayar.
+    """
+    if path.endswith(BIN_LOG_SUFFIX):
+        return _iter_bin(path, chunk_size, keep_site)
+    return _iter_jsonl(path, chunk_size, keep_site, bad if bad is not None else [0])
+
+
+def write_bin_log(path: str, pkts: Sequence[StepPacket]) -> None:
+    """
+    Paketleri binary loga ekler.
+    """
+    with open(path, "ab") as f:
+        f.write(b"".join(encode_packet_bin(p) for p in pkts))
+
+
+def convert_to_bin(src: str, dst: str, chunk_size: int = 8192) -> int:
+    """
+    JSONL log -> binary log. Returns: yazılan paket sayısı.
+    """
+    n = 0
+    for chunk in iter_log(src, chunk_size):
+        write_bin_log(dst, chunk)
+        n += len(chunk)
+    return n
+
+
+class Replayer:
+    """
+    Simüle saatle pipeline sürücüsü. Paketler (yaklaşık) ts sırasıyla feed() edilir;
+    saat ilerledikçe process_tick ve health_sweep, canlı dashboard'daki gibi çağrılır.
+    Pipeline state'i bu process'in global state'idir (pipeline.py). collect=True: sonuçlar
+    result.fused/alerts'te toplanır; on_chunk: her feed()/finish() sonunda o çağrının sonuçlarıyla.
+    """
+
+    def __init__(self, health_every_s: int = 3, collect: bool = True, on_chunk: Optional[OnChunk] = None):
+        self.health_every_s = health_every_s
+        self.collect = collect
+        self.on_chunk = on_chunk
+        self.clock: Optional[int] = None
+        self.next_health = 0
+        self.result = ReplayResult()
+        self._fused: List[Fused] = [] # on_chunk'a verilecekler
+        self._alerts: List[dict] = []
+
+    def _emit(self, fused: List[Fused], alerts: List[dict]) -> None:
+        self.result.n_fused += len(fused)
+        self.result.n_alerts += len(alerts)
+        if self.collect:
+            self.result.fused.extend(fused)
+            self.result.alerts.extend(alerts)
+        if self.on_chunk is not None:
+            self._fused.extend(fused)
+            self._alerts.extend(alerts)
+
+    def _flush(self) -> None:
+        if self._fused or self._alerts:
+            fused, alerts, self._fused, self._alerts = self._fused, self._alerts, [], []
+            self.on_chunk(fused, alerts)
+
+    def _advance(self, now_ts: int) -> None:
+        fused, alerts = process_tick(now_ts)
+        self._emit(fused, alerts)
+        if self.health_every_s > 0:
+            # boşluklarda yalnızca ilk ve son sweep anlamlı: arada yeni paket yok
+            if self.next_health <= now_ts:
+                self._emit([], health_sweep(self.next_health))
+                last = now_ts - (now_ts - self.next_health) % self.health_every_s
+                if last > self.next_health:
+                    self._emit([], health_sweep(last))
+                self.next_health = last + self.health_every_s
+        self.clock = now_ts
+
+    def feed(self, pkts: Sequence[StepPacket]) -> None:
+        res = self.result
+        run: List[StepPacket] = [] # saat ilerlemeden işlenecek paketler
+        for pkt in pkts:
+            if self.clock is None:
+                self.clock = pkt.ts
+                self.next_health = pkt.ts + self.health_every_s
+                res.sim_start = pkt.ts
+            elif pkt.ts > self.clock:
+                self._emit([], process_packets(run))
+                run = []
+                self._advance(pkt.ts)
+            run.append(pkt)
+        self._emit([], process_packets(run))
+        res.packets += len(pkts)
+        self._flush()
+
+    def finish(self) -> ReplayResult:
+        """
+        Açık kalan tüm bucket'ları kapatır (sondaki offline sweep'i yapılmaz).
+        """
+        if self.clock is not None:
+            self.result.sim_end = self.clock
+            fused, alerts = process_tick(self.clock + FUSION_THR.close_lag_s + 1)
+            self._emit(fused, alerts)
+            self._flush()
+        return self.result
+
+
+def replay(
+    paths: Sequence[str],
+    chunk_size: int = 8192,
+    health_every_s: int = 3,
+    keep_site: Optional[Callable[[str], bool]] = None,
+    snapshot_path: Optional[str] = None,
+    collect: bool = True,
+    on_chunk: Optional[OnChunk] = None,
+    reset: bool = True,
+) -> ReplayResult:
+    """
+    Logları sırayla (her dosya kendi içinde ts sıralı kabul edilir) bu process'te replay eder.
+    Pipeline state'i önce sıfırlanır (reset=False: ör. restore() edilmiş snapshot'ın üstüne;
+    önceki replay'in watermark'ları kalırsa tüm paketler geç sayılır). snapshot_path verilirse
+    sonunda model state'i yazılır.
+    """
+    start = time.perf_counter()
+    if reset:
+        reset_state()
+    rp = Replayer(health_every_s=health_every_s, collect=collect, on_chunk=on_chunk)
+    bad = [0]
+    for path in paths:
+        for chunk in iter_log(path, chunk_size, keep_site, bad):
+            rp.feed(chunk)
+    res = rp.finish()
+    res.bad = bad[0]
+    if snapshot_path is not None:
+        from snapshot import write_snapshot
+
+        write_snapshot(snapshot_path)
+    res.elapsed_s = time.perf_counter() - start
+    return res
+
+
+def _shard_main(args) -> ReplayResult:
+    paths, shard, n_shards, chunk_size, health_every_s, snapshot_path, collect, queue = args
+    return replay(
+        paths,
+        chunk_size=chunk_size,
+        health_every_s=health_every_s,
+        keep_site=lambda site: shard_of(site, n_shards) == shard,
+        snapshot_path=f"{snapshot_path}.{shard}" if snapshot_path else None,
+        collect=collect,
+        on_chunk=None if queue is None else lambda fused, alerts: queue.put((fused, alerts)),
+    )
+
+
+def replay_parallel(
+    paths: Sequence[str],
+    n_workers: int,
+    chunk_size: int = 8192,
+    health_every_s: int = 3,
+    snapshot_path: Optional[str] = None,
+    collect: bool = True,
+    on_chunk: Optional[OnChunk] = None,
+) -> ReplayResult:
+    """
+    Siteleri n_workers process'e böler; her process logları okuyup yalnızca kendi sitelerini işler.
+    Site bazında sonuçlar tek process replay ile aynıdır. Snapshot'lar path.<shard> olarak yazılır
+    (ShardedPipeline(snapshot_path=...) ile doğrudan yüklenebilir). on_chunk bu process'te, worker'ların
+    chunk sonuçları geldikçe çağrılır (sınırlı kuyruk: yavaş tüketici worker'ları bekletir).
+    """
+    if n_workers <= 1:
+        return replay(paths, chunk_size, health_every_s, snapshot_path=snapshot_path, collect=collect, on_chunk=on_chunk)
+
+    start = time.perf_counter()
+    with mp.Manager() as manager, mp.Pool(n_workers) as pool:
+        queue = manager.Queue(maxsize=4 * n_workers) if on_chunk is not None else None
+        jobs = [(list(paths), i, n_workers, chunk_size, health_every_s, snapshot_path, collect, queue) for i in range(n_workers)]
+        pending = pool.map_async(_shard_main, jobs)
+        while queue is not None:
+            try:
+                on_chunk(*queue.get(timeout=0.1))
+            except queue_mod.Empty:
+                if pending.ready() and queue.empty():
+                    break
+        parts = pending.get()
+
+    res = ReplayResult()
+    for part in parts:
+        if part.packets:
+            res.merge(part)
+    res.bad = parts[0].bad # her worker tüm dosyayı okur
+    res.fused.sort(key=lambda r: (r[1], r[0]))
+    res.elapsed_s = time.perf_counter() - start
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("logs", nargs="+", help="JSONL veya .bin paket logları (zaman sırasıyla)")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--chunk", type=int, default=8192)
+    ap.add_argument("--health-every", type=int, default=3, help="simüle saniye; 0 = health sweep yok")
+    ap.add_argument("--snapshot", default=None, help="sonunda model snapshot'ı yazılacak yol")
+    ap.add_argument("--history", default=None, help="fused/alarmların yazılacağı HistoryStore dizini")
+    ap.add_argument("--to-bin", default=None, help="replay yerine tek JSONL logu binary loga çevir")
+    args = ap.parse_args()
+
+    if args.to_bin:
+        n = convert_to_bin(args.logs[0], args.to_bin, args.chunk)
+        print(f"[replay] {n} packets -> {args.to_bin}")
+        return
+
+    on_chunk = None
+    if args.history:
+        from history import HistoryStore
+
+        store = HistoryStore(args.history)
+
+        def on_chunk(fused: List[Fused], alerts: List[dict]) -> None:
+            store.add_fused(fused)
+            store.add_alerts(alerts)
+            store.flush()
+
+    res = replay_parallel(
+        args.logs, args.workers, args.chunk, args.health_every, args.snapshot, collect=False, on_chunk=on_chunk
+    )
+
+    span = max(res.sim_end - res.sim_start, 1)
+    print(f"[replay] packets={res.packets} bad={res.bad} fused={res.n_fused} alerts={res.n_alerts}")
+    print(f"  simulated {span / 3600:.1f} h in {res.elapsed_s:.2f} s ({span / max(res.elapsed_s, 1e-9):,.0f}x real time)")
+    print(f"  {res.packets / max(res.elapsed_s, 1e-9):,.0f} pkt/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Sabit kapasiteli, kolonsal (alan başına ayrı NumPy dizisi) ring buffer.
+
+    Diziler capacity + slack uzunluğunda önceden ayrılır; canlı pencere her zaman
+    bitişik [start, end) aralığındadır. Sona gelindiğinde son `capacity` örnek başa
+    kopyalanır (amortize O(1)), böylece last()/since() kopyasız view döndürür.
+
+    Not: view'lar bir sonraki append'e kadar geçerlidir; saklanacaksa kopyalanmalıdır.
+    """
+
+    def __init__(self, capacity: int, fields: Sequence[Tuple[str, Any]], ts_field: Optional[str] = None):
+        if capacity <= 0:
+            raise ValueError("capacity must be > 0")
+        self.capacity = int(capacity)
+        self.fields = tuple(name for name, _ in fields)
+        self.ts_field = ts_field
+        size = self.capacity + max(self.capacity // 4, 16)
+        self._cols: Dict[str, np.ndarray] = {name: np.zeros(size, dtype=dt) for name, dt in fields}
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        cols = [self._cols[f] for f in self.fields]
+        for i in range(self._start, self._end):
+            yield tuple(c[i].item() for c in cols)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self._cols.values())
+
+    def append(self, *values: Any) -> None:
+        """
+        Alan sırasıyla tek örnek ekler.
+        """
+        end = self._end
+        if end == len(self._cols[self.fields[0]]):
+            n = end - self._start
+            for c in self._cols.values():
+                c[:n] = c[self._start:end]
+            self._start, end = 0, n
+        for f, v in zip(self.fields, values):
+            self._cols[f][end] = v
+        self._end = end + 1
+        if self._end - self._start > self.capacity:
+            self._start += 1
+
+    def clear(self) -> None:
+        self._start = self._end = 0
+
+    def col(self, name: str, n: Optional[int] = None) -> np.ndarray:
+        """
+        Tek alanın son n örneği (n=None: tümü) — view.
+        """
+        start = self._start if n is None else max(self._end - int(n), self._start)
+        return self._cols[name][start:self._end]
+
+    def last(self, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Son n örnek (n=None: tümü), alan adı -> view.
+        """
+        return {f: self.col(f, n) for f in self.fields}
+
+    def since(self, ts: int) -> Dict[str, np.ndarray]:
+        """
+        ts_field >= ts olan örnekler — view. ts_field'in artan sırada eklendiği varsayılır.
+        """
+        if self.ts_field is None:
+            raise ValueError("RingBuffer has no ts_field")
+        ts_col = self.col(self.ts_field)
+        i = int(np.searchsorted(ts_col, ts, side="left"))
+        return {f: self._cols[f][self._start + i:self._end] for f in self.fields}
@@ -0,0 +1,213 @@
+from __future__ import annotations
+"""
+Fused akıştan artımlı çok çözünürlüklü rollup'lar (10 s / 1 dk / 15 dk / 1 saat).
+
+Her site ve çözünürlük için periyot başına (count, sum, min, max, sumsq, dir1) tutulur;
+dir1 = Σ flow * ratio, böylece periyodun yön oranı akış ağırlıklı ortalamadır (dir1 / sum).
+Açık periyotlar tek dizide (sites x R x 7) güncellenir; periyot kapanınca satır sitenin
+o çözünürlükteki RingBuffer'ına eklenir. Aralık sorguları gösterilecek nokta sayısıyla
+orantılıdır (kapsanan saniye sayısıyla değil).
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from ringbuf import RingBuffer
+from seasonal import key_rounds
+
+# (periyot saniyesi, ring kapasitesi): 1 saat, 6 saat, 2 gün, 5 hafta
+RESOLUTIONS: Tuple[Tuple[int, int], ...] = ((10, 360), (60, 360), (900, 192), (3600, 840))
+
+ROLLUP_FIELDS = [
+    ("ts", np.int64), # periyot başlangıcı
+    ("count", np.int32),
+    ("sum", np.float64),
+    ("min", np.float32),
+    ("max", np.float32),
+    ("sumsq", np.float64),
+    ("dir1", np.float64),
+]
+
+# açık periyot kolonları
+_START, _COUNT, _SUM, _MIN, _MAX, _SUMSQ, _DIR1 = range(7)
+
+
+def _empty_open(n_sites: int, n_res: int) -> np.ndarray:
+    a = np.zeros((n_sites, n_res, 7))
+    a[:, :, _START] = -1
+    a[:, :, _MIN] = np.inf
+    a[:, :, _MAX] = -np.inf
+    return a
+
+
+def _view(d: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Ham rollup kolonlarından grafik/analiz alanları: mean, std, ratio.
+    """
+    n = d["count"].astype(np.float64)
+    s = d["sum"]
+    mean = s / np.maximum(n, 1)
+    var = np.where(n > 1, (d["sumsq"] - s * mean) / np.maximum(n - 1, 1), 0.0)
+    out = dict(d)
+    out["mean"] = mean
+    out["std"] = np.sqrt(np.maximum(var, 0.0))
+    out["ratio"] = np.where(s > 0, d["dir1"] / np.where(s > 0, s, 1.0), 0.5)
+    return out
+
+
+def aggregate(ts: np.ndarray, flow: np.ndarray, ratio: np.ndarray, res: int) -> Dict[str, np.ndarray]:
+    """
+    Ham 1 s noktaları res saniyelik periyotlara toplar (query() ile aynı kolonlar, ts artan).
+    Rollup ring'lerinin kapsamadığı geçmiş (ör. yeniden başlatma sonrası) için kullanılır.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    flow = np.asarray(flow, dtype=np.float64)
+    period, inv = np.unique(ts // res * res, return_inverse=True)
+    m = len(period)
+    mn = np.full(m, np.inf)
+    mx = np.full(m, -np.inf)
+    np.minimum.at(mn, inv, flow)
+    np.maximum.at(mx, inv, flow)
+    return _view({
+        "ts": period,
+        "count": np.bincount(inv, minlength=m).astype(np.int32),
+        "sum": np.bincount(inv, flow, minlength=m),
+        "min": mn.astype(np.float32),
+        "max": mx.astype(np.float32),
+        "sumsq": np.bincount(inv, flow * flow, minlength=m),
+        "dir1": np.bincount(inv, flow * np.asarray(ratio, dtype=np.float64), minlength=m),
+    })
+
+
+def pick_resolution(span_s: int, max_points: int) -> int:
+    """
+    span_s'yi max_points'i aşmadan ve ring kapasitesi içinde gösteren en ince çözünürlük
+    (yoksa en kaba çözünürlük).
+    """
+    for res, cap in RESOLUTIONS:
+        if span_s <= res * max_points and span_s <= res * cap:
+            return res
+    return RESOLUTIONS[-1][0]
+
+
+class RollupStore:
+    """
+    Tüm sitelerin rollup'ları. update() fuse_ready çıktısını alır (site başına ts artan sırada).
+    """
+
+    def __init__(self, resolutions: Sequence[Tuple[int, int]] = RESOLUTIONS, capacity: int = 16):
+        self.resolutions = tuple(resolutions)
+        self.res = np.array([r for r, _ in self.resolutions], dtype=np.int64)
+        self.open = _empty_open(max(capacity, 1), len(self.resolutions))
+        self.rings: List[List[RingBuffer]] = []
+        self.index: Dict[str, int] = {}
+        self.sites: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.sites)
+
+    @property
+    def nbytes(self) -> int:
+        return self.open.nbytes + sum(rb.nbytes for rings in self.rings for rb in rings)
+
+    def site(self, site_id: str) -> int:
+        """
+        site_id -> satır indeksi (yoksa eklenir).
+        """
+        row = self.index.get(site_id)
+        if row is None:
+            row = self.index[site_id] = len(self.sites)
+            self.sites.append(site_id)
+            self.rings.append([RingBuffer(cap, ROLLUP_FIELDS, ts_field="ts") for _, cap in self.resolutions])
+            if row >= len(self.open):
+                grown = _empty_open(2 * len(self.open), len(self.resolutions))
+                grown[: len(self.open)] = self.open
+                self.open = grown
+        return row
+
+    def clear(self) -> None:
+        self.open = _empty_open(16, len(self.resolutions))
+        self.rings = []
+        self.index = {}
+        self.sites = []
+
+    def update(self, fused: Sequence[Tuple[str, int, float, float, int]]) -> None:
+        """
+        Fused noktaları açık periyotlara ekler; periyodu geçen noktalar önce eski periyodu ring'e kapatır.
+        Aynı site birden fazla kez geçerse key_rounds ile site bazında sıra korunur.
+        """
+        if not fused:
+            return
+        rows = np.fromiter((self.site(r[0]) for r in fused), dtype=np.int64, count=len(fused))
+        ts = np.fromiter((r[1] for r in fused), dtype=np.int64, count=len(fused))
+        flow = np.fromiter((r[2] for r in fused), dtype=np.float64, count=len(fused))
+        ratio = np.fromiter((r[3] for r in fused), dtype=np.float64, count=len(fused))
+
+        res = self.res
+        rounds = [np.arange(len(rows))] if len(np.unique(rows)) == len(rows) else key_rounds(rows)
+        for r in rounds:
+            k = rows[r]
+            x = flow[r][:, None]
+            period = (ts[r][:, None] // res) * res # (n, R)
+            o = self.open[k] # kopya (fancy index)
+
+            # yeni periyoda geçen nokta açık periyodu kapatır; daha eski periyottan gelen
+            # (geç) nokta açık periyoda yazılır
+            roll = (o[:, :, _COUNT] > 0) & (period > o[:, :, _START])
+            for i, j in zip(*np.nonzero(roll)):
+                start, n, s, mn, mx, ss, d1 = o[i, j].tolist()
+                self.rings[k[i]][j].append(int(start), int(n), s, mn, mx, ss, d1)
+            fresh = roll | (o[:, :, _COUNT] == 0)
+            o[fresh] = (0, 0, 0.0, np.inf, -np.inf, 0.0, 0.0)
+            o[:, :, _START] = np.where(fresh, period, o[:, :, _START])
+
+            o[:, :, _COUNT] += 1
+            o[:, :, _SUM] += x
+            o[:, :, _MIN] = np.minimum(o[:, :, _MIN], x)
+            o[:, :, _MAX] = np.maximum(o[:, :, _MAX], x)
+            o[:, :, _SUMSQ] += x * x
+            o[:, :, _DIR1] += x * ratio[r][:, None]
+            self.open[k] = o
+
+    def query(
+        self, site_id: str, t0: int, t1: int, res: int, include_open: bool = True
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        [t0, t1] ile kesişen res periyotları (kapalı + isteğe bağlı açık periyot),
+        ROLLUP_FIELDS kolonları + mean/std/ratio. Site bilinmiyorsa None.
+        """
+        row = self.index.get(site_id)
+        if row is None:
+            return None
+        j = [r for r, _ in self.resolutions].index(res)
+        rb = self.rings[row][j]
+        d = rb.since(t0 // res * res)
+        hi = int(np.searchsorted(d["ts"], t1, side="right"))
+        d = {f: c[:hi] for f, c in d.items()}
+        o = self.open[row, j]
+        if include_open and o[_COUNT] > 0 and t0 // res * res <= o[_START] <= t1:
+            d = {f: np.append(d[f], o[i]).astype(d[f].dtype) for i, f in enumerate(rb.fields)}
+        else:
+            d = {f: c.copy() for f, c in d.items()}
+        return _view(d)
+
+    def earliest(self, site_id: str, res: int) -> Optional[int]:
+        """
+        res çözünürlüğünde tutulan en eski periyot başlangıcı (veri yoksa None).
+        """
+        row = self.index.get(site_id)
+        if row is None:
+            return None
+        j = [r for r, _ in self.resolutions].index(res)
+        rb = self.rings[row][j]
+        if len(rb):
+            return int(rb.col("ts")[0])
+        o = self.open[row, j]
+        return int(o[_START]) if o[_COUNT] > 0 else None
+
+
+ROLLUPS = RollupStore()
+
+
+def reset_state() -> None:
+    ROLLUPS.clear()
@@ -1,21 +1,80 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from typing import Dict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 import math
 import time
+import numpy as np
+
+from common import SLOTS
+
+N_SLOTS = 168
+
+# UTC gün indeksi -> o gün boyunca sabit UTC offset'i (saniye); gün içinde DST geçişi varsa None.
+_DAY_OFFSETS: Dict[int, Optional[int]] = {}
+
+
+def _day_offset(day: int) -> Optional[int]:
+    off = _DAY_OFFSETS.get(day, -1)
+    if off == -1:
+        start = time.localtime(day * 86400).tm_gmtoff
+        end = time.localtime(day * 86400 + 86399).tm_gmtoff
+        off = _DAY_OFFSETS[day] = start if start == end else None
+    return off
 
 
 def hour_of_week(ts: int) -> int:
     """
     Unix seconds -> hour-of-week [0..167]
     localtime kullanır (makinenin local saatine göre).
+    UTC offset gün bazında önbelleklenir; localtime yalnızca DST geçiş günlerinde çağrılır.
+    """
+    off = _day_offset(ts // 86400)
+    if off is None:
+        lt = time.localtime(ts)
+        return int(lt.tm_wday) * 24 + int(lt.tm_hour)
+    local = ts + off
+    # 1970-01-01 Perşembe (tm_wday=3)
+    return ((local // 86400 + 3) % 7) * 24 + (local % 86400) // 3600
+
+
+def hour_of_week_batch(ts: np.ndarray) -> np.ndarray:
+    """
+    hour_of_week'in dizi karşılığı: offset tablosu gün başına bir kez okunur.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    days, inv = np.unique(ts // 86400, return_inverse=True)
+    inv = inv.reshape(ts.shape)
+    offs = [_day_offset(int(d)) for d in days]
+    off_arr = np.array([0 if o is None else o for o in offs], dtype=np.int64)
+
+    local = ts + off_arr[inv]
+    how = ((local // 86400 + 3) % 7) * 24 + (local % 86400) // 3600
+
+    transition = np.array([o is None for o in offs], dtype=bool)[inv]
+    for i in np.flatnonzero(transition):
+        how.flat[i] = hour_of_week(int(ts.flat[i]))
+    return how
+
+
+def key_rounds(keys: np.ndarray) -> List[np.ndarray]:
+    """
+    Satırları "tur"lara böler: tur r, her anahtarın r'inci örneğini içerir.
+    Bir turda bir anahtar en fazla bir kez bulunur; turlar sırayla işlenince
+    anahtar bazında sıralı (skaler) güncelleme ile aynı sonuç elde edilir.
     """
-    lt = time.localtime(ts)
-    return int(lt.tm_wday) * 24 + int(lt.tm_hour)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    by_rank = np.argsort(rank, kind="stable")
+    bounds = np.cumsum(np.bincount(rank))
+    rows = order[by_rank]
+    return np.split(rows, bounds[:-1])
 
 
-@dataclass
+@dataclass(**SLOTS)
 class SlotStats:
     n: int = 0
     mean: float = 0.0
@@ -35,30 +94,120 @@ class SlotStats:
         return math.sqrt(max(self.variance(), 0.0))
 
 
-@dataclass
-class SeasonalModel:
+class SeasonalStore:
     """
-    Site bazında hour-of-week slotları için online mean/std tutar.
+    Tüm sitelerin hour-of-week slot istatistikleri tek dizide:
+    stats[site_row, slot] = (n, mean, m2) — site başına 168 * 3 * 8 B ≈ 4 KB.
     """
-    min_n_for_z: int = 20
-    slots: Dict[int, SlotStats] = field(default_factory=dict)
 
-    def _slot(self, idx: int) -> SlotStats:
-        if idx not in self.slots:
-            self.slots[idx] = SlotStats()
-        return self.slots[idx]
+    def __init__(self, min_n_for_z: int = 20, capacity: int = 16):
+        self.min_n_for_z = min_n_for_z
+        self.stats = np.zeros((max(capacity, 1), N_SLOTS, 3))
+        self.index: Dict[str, int] = {}
+        self.sites: List[str] = []
 
-    def update(self, ts: int, flow: float) -> None:
-        idx = hour_of_week(ts)
-        self._slot(idx).update(float(flow))
+    def __len__(self) -> int:
+        return len(self.sites)
 
-    def zscore(self, ts: int, flow: float) -> float:
-        idx = hour_of_week(ts)
-        st = self._slot(idx)
-        if st.n < self.min_n_for_z:
+    def site(self, site_id: str) -> int:
+        """
+        site_id -> satır indeksi (yoksa eklenir).
+        """
+        row = self.index.get(site_id)
+        if row is None:
+            row = self.index[site_id] = len(self.sites)
+            self.sites.append(site_id)
+            if row >= len(self.stats):
+                grown = np.zeros((2 * len(self.stats), N_SLOTS, 3))
+                grown[: len(self.stats)] = self.stats
+                self.stats = grown
+        return row
+
+    def load(self, sites: List[str], stats: np.ndarray) -> None:
+        """
+        Tüm içeriği (snapshot'tan) verilen sitelerle değiştirir.
+        """
+        self.sites = list(sites)
+        self.index = {s: i for i, s in enumerate(self.sites)}
+        self.stats = np.zeros((max(len(self.sites), 16), N_SLOTS, 3))
+        self.stats[: len(self.sites)] = stats
+
+    def slot(self, row: int, idx: int) -> SlotStats:
+        n, mean, m2 = self.stats[row, idx].tolist()
+        return SlotStats(int(n), mean, m2)
+
+    def zscore(self, row: int, idx: int, flow: float) -> float:
+        n, mean, m2 = self.stats[row, idx].tolist()
+        if n < self.min_n_for_z:
             return 0.0
-        sd = st.std()
+        sd = math.sqrt(max((m2 / (n - 1)) if n > 1 else 0.0, 0.0))
         if sd <= 1e-9:
             return 0.0
-        return (float(flow) - st.mean) / sd
+        return (float(flow) - mean) / sd
+
+    def update(self, row: int, idx: int, flow: float) -> None:
+        n, mean, m2 = self.stats[row, idx].tolist()
+        x = float(flow)
+        n += 1
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+        self.stats[row, idx] = (n, mean, m2)
+
+    def score_and_update(self, rows: np.ndarray, how: np.ndarray, flow: np.ndarray) -> np.ndarray:
+        """
+        Her örnek için (satır sırasıyla) önce zscore, sonra Welford update — batch halinde.
+        Aynı (site, slot) birden fazla kez geçerse sıralı güncelleme turlarla korunur.
+        """
+        z = np.zeros(len(flow))
+        flat = self.stats.reshape(-1, 3)
+        keys = np.asarray(rows, dtype=np.int64) * N_SLOTS + np.asarray(how, dtype=np.int64)
+        for r in key_rounds(keys):
+            k = keys[r]
+            x = flow[r]
+            n = flat[k, 0]
+            mean = flat[k, 1]
+            m2 = flat[k, 2]
+
+            var = np.where(n > 1, m2 / np.maximum(n - 1, 1), 0.0)
+            sd = np.sqrt(np.maximum(var, 0.0))
+            ok = (n >= self.min_n_for_z) & (sd > 1e-9)
+            z[r] = np.where(ok, (x - mean) / np.where(ok, sd, 1.0), 0.0)
+
+            n = n + 1
+            delta = x - mean
+            new_mean = mean + delta / n
+            flat[k, 0] = n
+            flat[k, 1] = new_mean
+            flat[k, 2] = m2 + delta * (x - new_mean)
+        return z
+
+
+class SeasonalModel:
+    """
+    Site bazında hour-of-week slotları için online mean/std tutar.
+    State bir SeasonalStore satırındadır; store verilmezse tek satırlık store oluşturulur.
+    """
+
+    def __init__(self, min_n_for_z: int = 20, store: Optional[SeasonalStore] = None, site_id: str = ""):
+        self.store = store if store is not None else SeasonalStore(min_n_for_z=min_n_for_z, capacity=1)
+        self.row = self.store.site(site_id)
+
+    @property
+    def min_n_for_z(self) -> int:
+        return self.store.min_n_for_z
+
+    def slot(self, idx: int) -> SlotStats:
+        return self.store.slot(self.row, idx)
 
+    def update_slot(self, idx: int, flow: float) -> None:
+        self.store.update(self.row, idx, flow)
+
+    def zscore_slot(self, idx: int, flow: float) -> float:
+        return self.store.zscore(self.row, idx, flow)
+
+    def update(self, ts: int, flow: float) -> None:
+        self.update_slot(hour_of_week(ts), flow)
+
+    def zscore(self, ts: int, flow: float) -> float:
+        return self.zscore_slot(hour_of_week(ts), flow)
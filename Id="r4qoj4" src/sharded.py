@@ -0,0 +1,240 @@
+from __future__ import annotations
+"""
+Site bazında shard'lanmış çok process'li ingest:
+- Paketler crc32(site_id) ile worker process'lere dağıtılır
+- Her worker kendi sitelerinin fusion/health/anomaly state'ine sahiptir (pipeline.py)
+- Fused noktalar ve alarmlar tek bir sonuç kuyruğu ile aggregator'a döner
+
+Bir sitenin tüm paketleri aynı worker'a ve aynı FIFO kuyruğa gittiği için
+site bazındaki sonuçlar tek process çalıştırmayla aynıdır.
+
+Hata veren worker PIPELINE_ERROR alarmı ve "done" gönderip çıkar; beklenmedik şekilde ölen
+worker da drain()/close()'da PIPELINE_ERROR olarak raporlanır (beklenmez).
+"""
+
+import glob
+import multiprocessing as mp
+import queue
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from common import StepPacket
+from pipeline import Fused
+
+PacketTuple = Tuple[str, str, int, int, int, int, Optional[float]]
+
+
+def shard_of(site_id: str, n_shards: int) -> int:
+    """
+    Process'ler arası kararlı site -> shard eşlemesi (hash() PYTHONHASHSEED'e bağlıdır).
+    """
+    return zlib.crc32(site_id.encode("utf-8")) % n_shards
+
+
+def snapshot_paths(path: str) -> List[str]:
+    """
+    path.<shard> snapshot dosyaları (shard sayısı değişmiş olabilir).
+    """
+    return sorted(p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[-1].isdigit())
+
+
+def _shard_error(shard: int, error: str) -> dict:
+    return {"type": "PIPELINE_ERROR", "shard": shard, "error": f"shard {shard}: {error}", "ts": int(time.time())}
+
+
+def _worker_main(shard: int, n_shards: int, inbox, outbox, snapshot_path: Optional[str] = None) -> None:
+    # state bu process'e ait olmalı: import'lar worker içinde
+    from pipeline import process_packets, process_tick, health_sweep
+    from snapshot import restore, write_snapshot
+
+    try:
+        # tüm shard dosyalarından bu shard'a düşen siteler (shard sayısı değişse de doğru)
+        if snapshot_path is not None:
+            paths = snapshot_paths(snapshot_path)
+            if paths:
+                restore(paths, keep=lambda site: shard_of(site, n_shards) == shard)
+
+        while True:
+            msg = inbox.get()
+            if msg is None:
+                break
+            kind, arg = msg
+            if kind == "pkts":
+                alerts = process_packets([StepPacket(*t) for t in arg])
+                if alerts:
+                    outbox.put(("alerts", shard, [], alerts))
+            elif kind == "tick":
+                fused, alerts = process_tick(arg)
+                if fused or alerts:
+                    outbox.put(("tick", shard, fused, alerts))
+            elif kind == "health":
+                alerts = health_sweep(arg)
+                if alerts:
+                    outbox.put(("alerts", shard, [], alerts))
+            elif kind == "snapshot":
+                write_snapshot(f"{arg}.{shard}")
+    except Exception as e:
+        outbox.put(("error", shard, [], [_shard_error(shard, f"{type(e).__name__}: {e}")]))
+    finally:
+        outbox.put(("done", shard, [], []))
+
+
+class ShardedPipeline:
+    """
+    n_workers process'lik havuz. submit() paketleri shard tamponlarına ekler,
+    tick()/health_sweep() tüm worker'lara yayınlanır, drain() sonuçları toplar.
+    snapshot_path verilirse worker'lar açılışta path.<shard> dosyalarından model state'ini yükler.
+    failed: hata veren / ölen shard'lar (her biri bir kez PIPELINE_ERROR olarak raporlanır).
+    """
+
+    def __init__(self, n_workers: int, batch_size: int = 256, snapshot_path: Optional[str] = None):
+        if n_workers <= 0:
+            raise ValueError("n_workers must be > 0")
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self._pending: List[List[PacketTuple]] = [[] for _ in range(n_workers)]
+        self._outbox = mp.Queue()
+        self._inboxes = [mp.Queue() for _ in range(n_workers)]
+        self.failed: Set[int] = set()
+        self._done: Set[int] = set() # "done" göndermiş shard'lar
+        self._procs = [
+            mp.Process(
+                target=_worker_main,
+                args=(i, n_workers, self._inboxes[i], self._outbox, snapshot_path),
+                daemon=True,
+            )
+            for i in range(n_workers)
+        ]
+        for p in self._procs:
+            p.start()
+
+    def submit(self, pkt: StepPacket) -> None:
+        i = shard_of(pkt.site_id, self.n_workers)
+        buf = self._pending[i]
+        buf.append((pkt.site_id, pkt.module_id, pkt.ts, pkt.window_s, pkt.steps_dir1, pkt.steps_dir2, pkt.vcap))
+        if len(buf) >= self.batch_size:
+            self._flush_shard(i)
+
+    def _flush_shard(self, i: int) -> None:
+        if self._pending[i]:
+            self._inboxes[i].put(("pkts", self._pending[i]))
+            self._pending[i] = []
+
+    def flush(self) -> None:
+        for i in range(self.n_workers):
+            self._flush_shard(i)
+
+    def tick(self, now_ts: int) -> None:
+        """
+        Bekleyen paketleri gönderir ve tüm worker'larda fuse_ready + detect çalıştırır.
+        """
+        self.flush()
+        for q in self._inboxes:
+            q.put(("tick", now_ts))
+
+    def health_sweep(self, now_ts: int) -> None:
+        self.flush()
+        for q in self._inboxes:
+            q.put(("health", now_ts))
+
+    def snapshot(self, path: str) -> None:
+        """
+        Her worker model state'ini path.<shard> dosyasına yazar (kuyruk sırasıyla).
+        """
+        for q in self._inboxes:
+            q.put(("snapshot", path))
+
+    def _collect(self, msg, fused: List[Fused], alerts: List[dict]) -> int:
+        kind, shard, f, a = msg
+        if kind == "error":
+            self.failed.add(shard)
+        elif kind == "done":
+            self._done.add(shard)
+        fused.extend(f)
+        alerts.extend(a)
+        return kind == "done"
+
+    def _read_all(self, fused: List[Fused], alerts: List[dict]) -> int:
+        done = 0
+        while True:
+            try:
+                done += self._collect(self._outbox.get_nowait(), fused, alerts)
+            except queue.Empty:
+                return done
+
+    def _report_dead(self, dead: List[int], alerts: List[dict]) -> None:
+        """
+        Hata mesajı göndermeden ölmüş (ör. kill, segfault) shard'lar için PIPELINE_ERROR alarmı.
+        dead, kuyruk okunmadan önce alınmalıdır (ölen worker'ın mesajları o anda kuyruktadır).
+        """
+        for i in dead:
+            if i not in self.failed and i not in self._done:
+                self.failed.add(i)
+                alerts.append(_shard_error(i, f"worker exited (exitcode {self._procs[i].exitcode})"))
+
+    def _dead(self) -> List[int]:
+        return [i for i, p in enumerate(self._procs) if not p.is_alive()]
+
+    def drain(self, timeout: Optional[float] = None) -> Tuple[List[Fused], List[dict]]:
+        """
+        Hazır sonuçları bloklamadan toplar (timeout verilirse ilk sonuç için bekler).
+        Yeni ölen worker'lar alarm olarak döner.
+        """
+        fused: List[Fused] = []
+        alerts: List[dict] = []
+        if timeout is not None:
+            try:
+                self._collect(self._outbox.get(True, timeout), fused, alerts)
+            except queue.Empty:
+                pass
+        dead = self._dead()
+        self._read_all(fused, alerts)
+        self._report_dead(dead, alerts)
+        return fused, alerts
+
+    def close(self, timeout: Optional[float] = None) -> Tuple[List[Fused], List[dict]]:
+        """
+        Worker'ları durdurur; kapanışa kadar üretilen sonuçları döndürür. Ölmüş worker'lar
+        beklenmez, PIPELINE_ERROR alarmı olarak döner; timeout dolunca kalan worker'lar sonlandırılır.
+        """
+        self.flush()
+        for q in self._inboxes:
+            q.put(None)
+
+        fused: List[Fused] = []
+        alerts: List[dict] = []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = 0
+        while done < self.n_workers:
+            try:
+                done += self._collect(self._outbox.get(timeout=0.5), fused, alerts)
+                continue
+            except queue.Empty:
+                pass
+            dead = self._dead()
+            if len(dead) == self.n_workers:
+                # kimse canlı değil: kalan mesajlar kuyrukta, gelmeyen "done"lar ölen worker'ların
+                done += self._read_all(fused, alerts)
+                self._report_dead(dead, alerts)
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        for i, p in enumerate(self._procs):
+            if p.is_alive() and i not in self._done:
+                p.terminate()
+                if i not in self.failed:
+                    self.failed.add(i)
+                    alerts.append(_shard_error(i, "did not stop before close timeout"))
+            p.join()
+        return fused, alerts
+
+
+def per_site(fused: List[Fused]) -> Dict[str, List[Fused]]:
+    """
+    Fused sonuçları site bazında (ts sırasıyla) gruplar; shard'lar arası karşılaştırma için.
+    """
+    out: Dict[str, List[Fused]] = {}
+    for row in fused:
+        out.setdefault(row[0], []).append(row)
+    return out
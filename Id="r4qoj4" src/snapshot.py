@@ -0,0 +1,157 @@
+from __future__ import annotations
+"""
+Anomali model state'inin (seasonal slot istatistikleri + EWMA) binary snapshot'ı.
+
+Dosya düzeni:
+  magic (8 B) | version (u32) | header_len (u32) | JSON header | diziler (64 B hizalı)
+
+Header, her dizi için site listesi, shape ve dosya offset'ini tutar; okuma
+tarafı dizileri memory-map eder, dolayısıyla açılış JSON parse maliyeti kadardır.
+Yazma geçici dosyaya yapılır, fsync + os.replace ile atomik olarak yerine konur.
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence
+import json
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+import anomaly
+from seasonal import N_SLOTS
+
+SNAPSHOT_MAGIC = b"PIYNSNP\0"
+SNAPSHOT_VERSION = 1
+_PREFIX = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+def _aligned(off: int) -> int:
+    return (off + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _copy_rows(get_array: Callable[[], np.ndarray], n: int, lock, chunk_rows: int) -> np.ndarray:
+    """
+    İlk n satırı parça parça kopyalar; kilit her parça için kısa süre tutulur.
+    Dizi bu arada büyüyüp yeniden ayrılabileceği için her parçada yeniden okunur.
+    """
+    first = get_array()
+    out = np.empty((n,) + first.shape[1:], dtype=first.dtype)
+    for lo in range(0, n, chunk_rows):
+        hi = min(lo + chunk_rows, n)
+        if lock is None:
+            out[lo:hi] = get_array()[lo:hi]
+        else:
+            with lock:
+                out[lo:hi] = get_array()[lo:hi]
+    return out
+
+
+def write_snapshot(path: str, lock: Optional[threading.Lock] = None, chunk_rows: int = 1024) -> dict:
+    """
+    anomaly.SEASONAL_STORE ve anomaly.EWMA_STORE'u path'e yazar.
+    lock verilirse site listeleri ve her satır parçası kilit altında kopyalanır
+    (ingest/tick thread'leri parça aralarında çalışmaya devam eder).
+    Returns: yazılan header.
+    """
+    seas = anomaly.SEASONAL_STORE
+    ew = anomaly.EWMA_STORE
+    if lock is not None:
+        with lock:
+            seas_sites = list(seas.sites)
+            ew_sites = list(ew.sites)
+    else:
+        seas_sites = list(seas.sites)
+        ew_sites = list(ew.sites)
+
+    arrays = {
+        "seasonal": _copy_rows(lambda: anomaly.SEASONAL_STORE.stats, len(seas_sites), lock, chunk_rows),
+        "ewma": _copy_rows(lambda: anomaly.EWMA_STORE.state, len(ew_sites), lock, chunk_rows),
+    }
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "created_ts": int(time.time()),
+        "seasonal": {"sites": seas_sites, "shape": list(arrays["seasonal"].shape), "min_n_for_z": seas.min_n_for_z},
+        "ewma": {"sites": ew_sites, "shape": list(arrays["ewma"].shape)},
+    }
+
+    # offset'ler header boyutuna bağlı: offset'ler değişmeyene kadar yeniden hesapla
+    while True:
+        blob = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        off = _aligned(_PREFIX.size + len(blob))
+        changed = False
+        for name, arr in arrays.items():
+            changed |= header[name].get("offset") != off
+            header[name]["offset"] = off
+            off = _aligned(off + arr.nbytes)
+        if not changed:
+            break
+
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(blob)))
+        f.write(blob)
+        for name, arr in arrays.items():
+            f.seek(header[name]["offset"])
+            f.write(np.ascontiguousarray(arr, dtype="<f8").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return header
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Header'ı okur ve dizileri memory-map eder (kopya yok).
+    Returns: header + "seasonal_stats" / "ewma_state" dizileri.
+    """
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"not a model snapshot: {path}")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    for name, key in (("seasonal", "seasonal_stats"), ("ewma", "ewma_state")):
+        shape = tuple(header[name]["shape"])
+        if shape[0] == 0:
+            header[key] = np.zeros(shape)
+        else:
+            header[key] = np.memmap(path, dtype="<f8", mode="r", offset=header[name]["offset"], shape=shape)
+    if header["seasonal_stats"].shape[1:] != (N_SLOTS, 3) or header["ewma_state"].shape[1:] != (3,):
+        raise ValueError(f"snapshot shape mismatch: {path}")
+    return header
+
+
+def restore(paths: Sequence[str], keep: Optional[Callable[[str], bool]] = None) -> Dict[str, int]:
+    """
+    Bir veya birden çok snapshot'ı (ör. shard başına dosyalar) store'lara yükler.
+    keep verilirse yalnızca keep(site_id) True olan siteler alınır.
+    Mevcut state tamamen değiştirilir. Returns: yüklenen site sayıları.
+    """
+    seas_sites: List[str] = []
+    seas_rows: List[np.ndarray] = []
+    ew_sites: List[str] = []
+    ew_rows: List[np.ndarray] = []
+    min_n = anomaly.SEASONAL_STORE.min_n_for_z
+    for path in paths:
+        snap = read_snapshot(path)
+        min_n = snap["seasonal"]["min_n_for_z"]
+        for sites, arr, out_sites, out_rows in (
+            (snap["seasonal"]["sites"], snap["seasonal_stats"], seas_sites, seas_rows),
+            (snap["ewma"]["sites"], snap["ewma_state"], ew_sites, ew_rows),
+        ):
+            sel = [i for i, s in enumerate(sites) if keep is None or keep(s)]
+            out_sites.extend(sites[i] for i in sel)
+            out_rows.append(np.array(arr[sel]))
+
+    anomaly.reset_state()
+    anomaly.SEASONAL_STORE.min_n_for_z = min_n
+    anomaly.SEASONAL_STORE.load(seas_sites, np.concatenate(seas_rows) if seas_rows else np.zeros((0, N_SLOTS, 3)))
+    anomaly.EWMA_STORE.load(ew_sites, np.concatenate(ew_rows) if ew_rows else np.zeros((0, 3)))
+    return {"seasonal": len(seas_sites), "ewma": len(ew_sites)}
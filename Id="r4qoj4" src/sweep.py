@@ -0,0 +1,725 @@
+from __future__ import annotations
+"""
+Eşik taraması: Thresholds / HealthThresholds / FusionThresholds ızgarasını kayıtlı bir paket
+logu üzerinde tek geçişte değerlendirir; her konfigürasyon için ham alarm sayıları ve
+etiketli olaylara (fake_publisher --load --truth JSONL) göre precision / recall.
+
+Eşikten bağımsız sinyaller bir kez çıkarılır, eşik karşılaştırmaları konfigürasyon ekseninde
+vektörel yapılır:
+- health geçişi (tek): paket başına zero/const serileri, her sweep'te modül yaşı (offline) ve
+  her outlier_window için MAD skoru; yalnızca ızgaradaki en gevşek eşiği geçebilen satırlar tutulur
+- fusion geçişi (her farklı FusionThresholds için): fused akış, seasonal z ve her ewma_alpha
+  için EWMA z (alpha ekseninde vektörel)
+Geçişler ve konfigürasyon parçaları process'lere dağıtılır. Zamanlama replay.Replayer ile
+aynıdır (simüle saat, health_every saniyede bir sweep); varsayılan konfigürasyonun ham alarm
+sayıları replay'inkine eşittir. Alarm yaşam döngüsü (alerts.py) uygulanmaz.
+
+Eşleşme: alarm, aynı tip grubundaki (spike / stuck / offline / outlier) aynı site (ve modül)
+olayının [start, end + slack] aralığına düşüyorsa doğrudur. precision = doğru alarm / etiketli
+tiplerdeki alarm, recall = en az bir alarm alan olay / olay.
+
+ÇALIŞTIRMA:
+  python src/sweep.py logs/day.bin --truth logs/truth.jsonl --workers 4 \\
+      --grid ewma_z_spike=3,4,5 --grid seasonal_z_spike=3,4,5 --grid offline_s=5,10,20 --grid close_lag_s=1,2
+  python src/sweep.py logs/day.bin --truth logs/truth.jsonl --site SITE_00042 --grid health.outlier_mad_k=4,6,8
+"""
+
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import argparse
+import bisect
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+
+from anomaly import Thresholds
+from common import StepPacket
+from fusion import FusionThresholds
+from health import HealthThresholds
+
+# ızgara parametresi -> (eşik sınıfı, alan). Birden çok sınıfta olan alanlar (outlier_mad_k)
+# yalnızca nitelikli adla ("health.outlier_mad_k"), diğerleri çıplak adla da verilebilir.
+THRESHOLD_CLASSES = {"anomaly": Thresholds, "health": HealthThresholds, "fusion": FusionThresholds}
+UNSWEPT = {"low_demand_hours"} # tuple alanlar sabit kalır
+
+
+def _params() -> Dict[str, Tuple[str, str]]:
+    owners: Dict[str, List[str]] = {}
+    for kind, cls in THRESHOLD_CLASSES.items():
+        for f in fields(cls):
+            if f.name not in UNSWEPT:
+                owners.setdefault(f.name, []).append(kind)
+    out: Dict[str, Tuple[str, str]] = {}
+    for name, kinds in owners.items():
+        if len(kinds) == 1:
+            out[name] = (kinds[0], name)
+        for kind in kinds:
+            out[f"{kind}.{name}"] = (kind, name)
+    return out
+
+
+PARAMS = _params()
+
+# etiket tipi -> o olayı yakalayan alarm tipleri
+TRUTH_TYPES: Dict[str, Tuple[str, ...]] = {
+    "spike": ("SPIKE_EWMA", "SPIKE_SEASONAL"),
+    "stuck": ("STUCK_ZERO", "STUCK_CONST"),
+    "offline": ("SENSOR_OFFLINE",),
+    "outlier": ("OUTLIER_MODULE",),
+}
+GROUP_OF = {a: g for g, types in TRUTH_TYPES.items() for a in types}
+ALERT_TYPES = (
+    "SPIKE_EWMA",
+    "SPIKE_SEASONAL",
+    "ONE_SIDED",
+    "LOW_DEMAND_CROWD",
+    "STUCK_ZERO",
+    "STUCK_CONST",
+    "SENSOR_OFFLINE",
+    "OUTLIER_MODULE",
+)
+
+
+@dataclass(frozen=True)
+class SweepConfig:
+    anomaly: Thresholds
+    health: HealthThresholds
+    fusion: FusionThresholds
+
+    def values(self) -> Dict[str, Any]:
+        """
+        Tüm taranabilir alanlar, çıplak adı olanlar çıplak adla.
+        """
+        return {
+            name: getattr(getattr(self, kind), attr)
+            for name, (kind, attr) in PARAMS.items()
+            if "." not in name or attr not in PARAMS
+        }
+
+
+def parse_grid(specs: Sequence[str]) -> Dict[str, List[Any]]:
+    """
+    ["ewma_z_spike=3,4,5", ...] -> {alan: [değerler]}; değerler varsayılanın tipine çevrilir.
+    """
+    grid: Dict[str, List[Any]] = {}
+    for spec in specs:
+        name, _, vals = spec.partition("=")
+        name = name.strip()
+        if name not in PARAMS:
+            raise ValueError(f"Unknown, ambiguous or unsupported grid parameter: {name}")
+        kind, attr = PARAMS[name]
+        if attr in PARAMS:
+            name = attr # "health.offline_s" -> "offline_s"
+        default = getattr(THRESHOLD_CLASSES[kind](), attr)
+        cast = (lambda v: v.lower() in ("1", "true", "yes")) if isinstance(default, bool) else type(default)
+        grid[name] = [cast(v.strip()) for v in vals.split(",") if v.strip()]
+        if not grid[name]:
+            raise ValueError(f"Empty grid for {name}")
+    return grid
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[SweepConfig]:
+    """
+    Kartezyen çarpım; ızgarada olmayan alanlar varsayılan değerinde kalır.
+    """
+    names = list(grid)
+    out: List[SweepConfig] = []
+    for combo in itertools.product(*(grid[n] for n in names)):
+        parts: Dict[str, Dict[str, Any]] = {kind: {} for kind in THRESHOLD_CLASSES}
+        for name, v in zip(names, combo):
+            kind, attr = PARAMS[name]
+            parts[kind][attr] = v
+        out.append(SweepConfig(**{kind: cls(**parts[kind]) for kind, cls in THRESHOLD_CLASSES.items()}))
+    return out
+
+
+def load_truth(path: Optional[str], site: Optional[str] = None) -> List[dict]:
+    """
+    Etiketli olaylar (bilinen tipler; site verilirse yalnızca o site).
+    """
+    if path is None:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return [e for e in events if e.get("type") in TRUTH_TYPES and (site is None or e["site_id"] == site)]
+
+
+class _TruthIndex:
+    """
+    (tip grubu, site, modül) -> başlangıca göre sıralı (start, end + slack, olay no).
+    """
+
+    def __init__(self, events: Sequence[dict], slack_s: int):
+        self.by_ent: Dict[Tuple[str, str, str], List[Tuple[int, int, int]]] = {}
+        for i, e in enumerate(events):
+            key = (e["type"], e["site_id"], e.get("module_id", "") or "")
+            self.by_ent.setdefault(key, []).append((int(e["start"]), int(e["end"]) + slack_s, i))
+        for v in self.by_ent.values():
+            v.sort()
+
+    def match(self, group: str, site_id: str, module_id: str, ts: int) -> int:
+        evs = self.by_ent.get((group, site_id, module_id))
+        if not evs:
+            return -1
+        j = bisect.bisect_right(evs, (ts, 1 << 62, 0)) - 1
+        while j >= 0:
+            start, end, i = evs[j]
+            if ts <= end:
+                return i
+            j -= 1
+            if j >= 0 and evs[j][1] < start - 86400:
+                break
+        return -1
+
+    def events(self, alert_type: str, site_ids: Sequence[str], module_ids: Sequence[str], ts: np.ndarray) -> np.ndarray:
+        group = GROUP_OF.get(alert_type)
+        if group is None or not self.by_ent:
+            return np.full(len(ts), -1, dtype=np.int64)
+        return np.fromiter(
+            (self.match(group, s, m, t) for s, m, t in zip(site_ids, module_ids, ts.tolist())), dtype=np.int64, count=len(ts)
+        )
+
+
+# --- sinyal çıkarımı -------------------------------------------------------------------------
+
+
+@dataclass
+class Signals:
+    """
+    Bir geçişin aday satırları: alarm tipi -> kolonlar ("ts", "event" + tipe özgü).
+    """
+    families: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict)
+    packets: int = 0
+    fused: int = 0
+    sweeps: int = 0
+    span_s: int = 0
+    elapsed_s: float = 0.0
+
+
+def _iter_packets(paths: Sequence[str], chunk_size: int, site: Optional[str]) -> Iterator[List[StepPacket]]:
+    from replay import iter_log
+
+    keep = (lambda s: s == site) if site else None
+    for path in paths:
+        yield from iter_log(path, chunk_size, keep)
+
+
+def _drive(chunks, on_run, on_tick, on_sweep, health_every_s: int) -> Tuple[Optional[int], Optional[int]]:
+    """
+    replay.Replayer ile aynı simüle saat: yeni ts'te önce bekleyen paketler, sonra tick, sonra
+    (boşluklarda yalnızca ilk ve son) health sweep'leri. Returns: (ilk ts, son saat).
+    """
+    clock: Optional[int] = None
+    first: Optional[int] = None
+    next_health = 0
+    run: List[StepPacket] = []
+    for pkts in chunks:
+        for pkt in pkts:
+            if clock is None:
+                clock = first = pkt.ts
+                next_health = pkt.ts + health_every_s
+            elif pkt.ts > clock:
+                on_run(run)
+                run = []
+                now_ts = pkt.ts
+                on_tick(now_ts)
+                if health_every_s > 0 and next_health <= now_ts:
+                    on_sweep(next_health)
+                    last = now_ts - (now_ts - next_health) % health_every_s
+                    if last > next_health:
+                        on_sweep(last)
+                    next_health = last + health_every_s
+                clock = now_ts
+            run.append(pkt)
+    on_run(run)
+    return first, clock
+
+
+def _group_medians(group: np.ndarray, vals: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Grup başına np.median (grup boşsa nan); sıralama ile vektörel.
+    """
+    order = np.lexsort((vals, group))
+    sv = vals[order]
+    counts = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ok = counts > 0
+    lo = starts + np.maximum(counts - 1, 0) // 2
+    hi = starts + counts // 2
+    med = np.full(n_groups, np.nan)
+    med[ok] = (sv[lo[ok]] + sv[hi[ok]]) / 2
+    return med
+
+
+def extract_health(
+    paths: Sequence[str],
+    configs: Sequence[HealthThresholds],
+    truth: Sequence[dict],
+    slack_s: int,
+    health_every_s: int = 3,
+    chunk_size: int = 8192,
+    site: Optional[str] = None,
+) -> Signals:
+    """
+    Paket akışından stuck / offline / outlier aday satırları (health.py'nin kendi state'iyle).
+    """
+    import health
+    import pipeline
+    from ids import IDS
+
+    start = time.perf_counter()
+    pipeline.reset_state()
+    zero_min = min(c.stuck_zero_s for c in configs)
+    const_min = min(c.stuck_const_s for c in configs)
+    off_min = min(c.offline_s for c in configs)
+    windows = sorted({c.outlier_window for c in configs})
+    k_min = min(c.outlier_mad_k for c in configs)
+    thr = HealthThresholds(outlier_window=windows[0])
+
+    stuck: List[Tuple[int, int, int, int, int]] = [] # key, ts, len, zero_run, const_run
+    off: List[np.ndarray] = [] # (key, sweep ts, age) blokları
+    outl: List[np.ndarray] = [] # (key, sweep ts, window idx, score)
+    last_ts = np.full(1024, np.iinfo(np.int64).min, dtype=np.int64)
+    n_sweeps = [0]
+    n_pkts = [0]
+
+    def on_run(run: List[StepPacket]) -> None:
+        nonlocal last_ts
+        for pkt in run:
+            st = health.update_health(pkt, thr)
+            key = st.key
+            if key >= len(last_ts):
+                grown = np.full(max(2 * len(last_ts), key + 1), np.iinfo(np.int64).min, dtype=np.int64)
+                grown[: len(last_ts)] = last_ts
+                last_ts = grown
+            last_ts[key] = pkt.ts
+            if st.zero_run >= zero_min or st.const_run >= const_min:
+                stuck.append((key, pkt.ts, len(st), st.zero_run, st.const_run))
+        n_pkts[0] += len(run)
+
+    # MODULES yalnızca büyür: anahtar / site dizileri modül sayısı değişince yeniden kurulur
+    layout: Dict[str, Any] = {"n": -1}
+
+    def on_sweep(t: int) -> None:
+        n_sweeps[0] += 1
+        mods = health.MODULES
+        if layout["n"] != len(mods):
+            keys = np.fromiter((st.key for st in mods), dtype=np.int64, count=len(mods))
+            site_no: Dict[str, int] = {}
+            site_of = np.fromiter(
+                (site_no.setdefault(IDS.names(k)[0], len(site_no)) for k in keys.tolist()), dtype=np.int64, count=len(keys)
+            )
+            layout.update(n=len(mods), keys=keys, site_of=site_of, n_sites=len(site_no),
+                          n_registered=np.bincount(site_of, minlength=len(site_no)))
+        keys, site_of, n_sites = layout["keys"], layout["site_of"], layout["n_sites"]
+        n_registered = layout["n_registered"]
+        age = t - last_ts[keys]
+        hit = age >= off_min
+        if hit.any():
+            off.append(np.stack([keys[hit], np.full(int(hit.sum()), t), age[hit]], axis=1))
+
+        # outlier: site başına modül pencere medyanlarının medyan / MAD'ı (health.check_outliers)
+        n = np.fromiter((st.n_totals for st in mods), dtype=np.int64, count=len(mods))
+        depth = health.TOTALS.depth
+        size = np.minimum(n, depth)
+        for wi, w in enumerate(windows):
+            ok = (size >= w) & (n_registered[site_of] >= 3)
+            if not ok.any():
+                continue
+            k_ok, n_ok, s_ok = keys[ok], n[ok], site_of[ok]
+            cols = (n_ok[:, None] - w + np.arange(w)[None, :]) % depth
+            v = np.median(health.TOTALS.buf[k_ok[:, None], cols], axis=1)
+            n_valid = np.bincount(s_ok, minlength=n_sites)
+            med = _group_medians(s_ok, v, n_sites)
+            dev = np.abs(v - med[s_ok])
+            mad = np.maximum(_group_medians(s_ok, dev, n_sites), 1e-6)
+            score = dev / mad[s_ok]
+            hit = (n_valid[s_ok] >= 3) & (score >= k_min)
+            if hit.any():
+                m = int(hit.sum())
+                outl.append(np.stack([k_ok[hit], np.full(m, t), np.full(m, wi), score[hit]], axis=1))
+
+    first, clock = _drive(_iter_packets(paths, chunk_size, site), on_run, lambda _t: None, on_sweep, health_every_s)
+
+    tix = _TruthIndex(truth, slack_s)
+    sig = Signals(packets=n_pkts[0], sweeps=n_sweeps[0], span_s=(clock - first) if first is not None else 0)
+
+    def names(keys: np.ndarray) -> Tuple[List[str], List[str]]:
+        pairs = [IDS.names(k) for k in keys.tolist()]
+        return [p[0] for p in pairs], [p[1] for p in pairs]
+
+    a = np.array(stuck, dtype=np.int64).reshape(-1, 5)
+    s_names, m_names = names(a[:, 0])
+    for alert_type in ("STUCK_ZERO", "STUCK_CONST"):
+        sig.families[alert_type] = {
+            "ts": a[:, 1],
+            "event": tix.events(alert_type, s_names, m_names, a[:, 1]),
+            "len": a[:, 2],
+            "zero": a[:, 3],
+            "const": a[:, 4],
+        }
+    a = np.concatenate(off) if off else np.zeros((0, 3), dtype=np.int64)
+    s_names, m_names = names(a[:, 0])
+    sig.families["SENSOR_OFFLINE"] = {
+        "ts": a[:, 1],
+        "event": tix.events("SENSOR_OFFLINE", s_names, m_names, a[:, 1]),
+        "age": a[:, 2],
+    }
+    a = np.concatenate(outl) if outl else np.zeros((0, 4))
+    keys = a[:, 0].astype(np.int64)
+    s_names, m_names = names(keys)
+    ts = a[:, 1].astype(np.int64)
+    sig.families["OUTLIER_MODULE"] = {
+        "ts": ts,
+        "event": tix.events("OUTLIER_MODULE", s_names, m_names, ts),
+        "window": np.array(windows, dtype=np.int64)[a[:, 2].astype(np.int64)],
+        "score": a[:, 3],
+    }
+    sig.elapsed_s = time.perf_counter() - start
+    return sig
+
+
+def extract_fused(
+    paths: Sequence[str],
+    fthr: FusionThresholds,
+    configs: Sequence[Thresholds],
+    truth: Sequence[dict],
+    slack_s: int,
+    health_every_s: int = 3,
+    chunk_size: int = 8192,
+    site: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+) -> Signals:
+    """
+    fthr ile fused akış; seasonal z bir kez, EWMA z her farklı ewma_alpha için (alpha ekseninde).
+    pipeline.detect_fused ile aynı girdi (fused akış/oran adım sayılarına yuvarlanır).
+    """
+    import anomaly
+    import fusion
+    import pipeline
+    from seasonal import hour_of_week_batch, key_rounds
+
+    start = time.perf_counter()
+    pipeline.reset_state()
+    if snapshot_path:
+        from snapshot import restore
+
+        restore([snapshot_path])
+
+    fused: List[Tuple[str, int, float, float, int]] = []
+    n_pkts = [0]
+
+    def on_run(run: List[StepPacket]) -> None:
+        for pkt in run:
+            fusion.ingest(pkt, thr=fthr)
+        n_pkts[0] += len(run)
+
+    def on_tick(now_ts: int) -> None:
+        fused.extend(fusion.fuse_ready(now_ts=now_ts, thr=fthr))
+
+    first, clock = _drive(_iter_packets(paths, chunk_size, site), on_run, on_tick, lambda _t: None, health_every_s)
+    if clock is not None:
+        on_tick(clock + fthr.close_lag_s + 1)
+
+    site_names = sorted({r[0] for r in fused})
+    pos = {s: i for i, s in enumerate(site_names)}
+    n = len(fused)
+    site_idx = np.fromiter((pos[r[0]] for r in fused), dtype=np.int64, count=n)
+    ts = np.fromiter((r[1] for r in fused), dtype=np.int64, count=n)
+    f = np.fromiter((r[2] for r in fused), dtype=np.float64, count=n)
+    rt = np.fromiter((r[3] for r in fused), dtype=np.float64, count=n)
+    s1 = np.rint(f * rt).astype(np.int64)
+    s2 = np.rint(f * (1.0 - rt)).astype(np.int64)
+    flow = (s1 + s2).astype(np.float64)
+    ratio = s1 / np.maximum(s1 + s2, 1)
+    how = hour_of_week_batch(ts)
+
+    seas = anomaly.SEASONAL_STORE
+    rows_of = np.array([seas.site(s) for s in site_names], dtype=np.int64)
+    z_seas = seas.score_and_update(rows_of[site_idx], how, flow) if n else np.zeros(0)
+
+    # EWMA: (alpha, site, 3) state, detect_batch ile aynı güncelleme
+    alphas = np.array(sorted({c.ewma_alpha for c in configs}))
+    ew = anomaly.EWMA_STORE
+    init = np.array([ew.state[ew.index[s]] if s in ew.index else (0.0, 0.0, 1.0) for s in site_names]).reshape(-1, 3)
+    st = np.repeat(init[None], len(alphas), axis=0)
+    z_ew = np.zeros((len(alphas), n))
+    a = alphas[:, None]
+    for rows in key_rounds(site_idx) if n else []:
+        x = flow[rows][None, :]
+        r = site_idx[rows]
+        first_pt = st[:, r, 0] == 0
+        prev = st[:, r, 1]
+        new_mean = np.where(first_pt, x, a * x + (1 - a) * prev)
+        new_var = np.where(first_pt, 1.0, a * ((x - prev) ** 2) + (1 - a) * st[:, r, 2])
+        st[:, r, 0] += 1
+        st[:, r, 1] = new_mean
+        st[:, r, 2] = new_var
+        z_ew[:, rows] = (x - new_mean) / np.sqrt(np.maximum(new_var, 1e-6))
+
+    tix = _TruthIndex(truth, slack_s)
+    sites = [site_names[i] for i in site_idx.tolist()]
+    no_module = [""] * n
+
+    def family(alert_type: str, keep: np.ndarray, **cols: np.ndarray) -> None:
+        idx = np.flatnonzero(keep)
+        out = {"ts": ts[idx], "event": tix.events(alert_type, [sites[i] for i in idx.tolist()], no_module, ts[idx])}
+        out.update({k: (v[:, idx] if v.ndim == 2 else v[idx]) for k, v in cols.items()})
+        sig.families[alert_type] = out
+
+    sig = Signals(packets=n_pkts[0], fused=n, span_s=(clock - first) if first is not None else 0)
+    fmin = min(c.flow_min_spike for c in configs)
+    family("SPIKE_EWMA", (flow >= fmin) & (z_ew.max(axis=0, initial=-np.inf) >= min(c.ewma_z_spike for c in configs)),
+           flow=flow, z=z_ew)
+    family("SPIKE_SEASONAL", (flow >= fmin) & (z_seas >= min(c.seasonal_z_spike for c in configs)), flow=flow, z=z_seas)
+    hi = min(c.one_sided_ratio_hi for c in configs)
+    family("ONE_SIDED", (flow >= min(c.one_sided_flow_min for c in configs)) & ((ratio >= hi) | (ratio <= 1 - hi)),
+           flow=flow, ratio=ratio)
+    hour = how % 24
+    lo_h, hi_h = Thresholds().low_demand_hours
+    family("LOW_DEMAND_CROWD", (lo_h <= hour) & (hour <= hi_h) & (flow >= min(c.low_demand_flow for c in configs)),
+           flow=flow)
+    sig.families["SPIKE_EWMA"]["alphas"] = alphas
+    sig.elapsed_s = time.perf_counter() - start
+    return sig
+
+
+# --- değerlendirme ---------------------------------------------------------------------------
+
+
+def _masks(fam: str, cols: Dict[str, np.ndarray], cfgs: Sequence[SweepConfig]) -> np.ndarray:
+    """
+    (konfigürasyon, satır) ateşleme matrisi.
+    """
+    def vec(getter) -> np.ndarray:
+        return np.array([getter(c) for c in cfgs])[:, None]
+
+    if fam == "SPIKE_EWMA":
+        ai = np.searchsorted(cols["alphas"], [c.anomaly.ewma_alpha for c in cfgs])
+        return (cols["flow"][None, :] >= vec(lambda c: c.anomaly.flow_min_spike)) & (
+            cols["z"][ai] >= vec(lambda c: c.anomaly.ewma_z_spike)
+        )
+    if fam == "SPIKE_SEASONAL":
+        return (cols["flow"][None, :] >= vec(lambda c: c.anomaly.flow_min_spike)) & (
+            cols["z"][None, :] >= vec(lambda c: c.anomaly.seasonal_z_spike)
+        )
+    if fam == "ONE_SIDED":
+        hi = vec(lambda c: c.anomaly.one_sided_ratio_hi)
+        r = cols["ratio"][None, :]
+        return (cols["flow"][None, :] >= vec(lambda c: c.anomaly.one_sided_flow_min)) & ((r >= hi) | (r <= 1 - hi))
+    if fam == "LOW_DEMAND_CROWD":
+        return cols["flow"][None, :] >= vec(lambda c: c.anomaly.low_demand_flow)
+    if fam in ("STUCK_ZERO", "STUCK_CONST"):
+        z = vec(lambda c: c.health.stuck_zero_s)
+        k = vec(lambda c: c.health.stuck_const_s)
+        enough = cols["len"][None, :] >= np.maximum(z, k)
+        zero = cols["zero"][None, :] >= z
+        if fam == "STUCK_ZERO":
+            return enough & zero
+        return enough & ~zero & (cols["const"][None, :] >= k)
+    if fam == "SENSOR_OFFLINE":
+        return cols["age"][None, :] >= vec(lambda c: c.health.offline_s)
+    if fam == "OUTLIER_MODULE":
+        return (cols["window"][None, :] == vec(lambda c: c.health.outlier_window)) & (
+            cols["score"][None, :] >= vec(lambda c: c.health.outlier_mad_k)
+        )
+    raise ValueError(fam)
+
+
+def evaluate(
+    cfgs: Sequence[SweepConfig], health_sig: Signals, fused_sig: Signals, truth: Sequence[dict]
+) -> List[dict]:
+    """
+    Aynı FusionThresholds'u paylaşan konfigürasyonlar için sayım + precision / recall.
+    """
+    c = len(cfgs)
+    n_events = len(truth)
+    ev_group = np.array([list(TRUTH_TYPES).index(e["type"]) for e in truth], dtype=np.int64)
+    detected = np.zeros((c, n_events), dtype=bool)
+    counts: Dict[str, np.ndarray] = {}
+    tp: Dict[str, np.ndarray] = {}
+    for fam in ALERT_TYPES:
+        cols = (fused_sig if fam in fused_sig.families else health_sig).families[fam]
+        mask = _masks(fam, cols, cfgs)
+        counts[fam] = mask.sum(axis=1)
+        ev = cols["event"]
+        matched = ev >= 0
+        tp[fam] = mask[:, matched].sum(axis=1)
+        if matched.any():
+            order = np.argsort(ev[matched], kind="stable")
+            ev_sorted = ev[matched][order]
+            uniq, starts = np.unique(ev_sorted, return_index=True)
+            hit = np.logical_or.reduceat(mask[:, matched][:, order], starts, axis=1)
+            detected[:, uniq] |= hit
+
+    out: List[dict] = []
+    for i, cfg in enumerate(cfgs):
+        row: Dict[str, Any] = {"config": cfg.values(), "alerts": {k: int(v[i]) for k, v in counts.items()}}
+        scores: Dict[str, dict] = {}
+        tot_tp = tot_alerts = tot_det = 0
+        for gi, (group, types) in enumerate(TRUTH_TYPES.items()):
+            n_ev = int((ev_group == gi).sum())
+            n_al = sum(int(counts[t][i]) for t in types)
+            n_tp = sum(int(tp[t][i]) for t in types)
+            n_det = int(detected[i, ev_group == gi].sum())
+            scores[group] = _prf(n_tp, n_al, n_det, n_ev)
+            tot_tp, tot_alerts, tot_det = tot_tp + n_tp, tot_alerts + n_al, tot_det + n_det
+        row["scores"] = scores
+        row.update(_prf(tot_tp, tot_alerts, tot_det, n_events))
+        out.append(row)
+    return out
+
+
+def _prf(n_tp: int, n_alerts: int, n_detected: int, n_events: int) -> dict:
+    p = n_tp / n_alerts if n_alerts else (1.0 if n_events == 0 else 0.0)
+    r = n_detected / n_events if n_events else 1.0
+    f1 = 2 * p * r / (p + r) if p + r > 0 else 0.0
+    return {"precision": p, "recall": r, "f1": f1, "events": n_events, "labeled_alerts": n_alerts}
+
+
+# --- paralel sürücü --------------------------------------------------------------------------
+
+_EVAL: Dict[str, Any] = {}
+
+
+def _extract_job(job) -> Tuple[Any, Signals]:
+    kind, key, args, kw = job
+    if kind == "health":
+        return key, extract_health(*args, **kw)
+    return key, extract_fused(*args, **kw)
+
+
+def _eval_init(health_sig: Signals, fused_sigs: Dict[FusionThresholds, Signals], truth: List[dict]) -> None:
+    _EVAL.update(health=health_sig, fused=fused_sigs, truth=truth)
+
+
+def _eval_job(cfgs: List[SweepConfig]) -> List[dict]:
+    return evaluate(cfgs, _EVAL["health"], _EVAL["fused"][cfgs[0].fusion], _EVAL["truth"])
+
+
+def sweep(
+    paths: Sequence[str],
+    configs: Sequence[SweepConfig],
+    truth: Sequence[dict],
+    workers: int = 1,
+    slack_s: int = 15,
+    health_every_s: int = 3,
+    chunk_size: int = 8192,
+    site: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+    chunk_configs: int = 64,
+) -> Tuple[List[dict], dict]:
+    """
+    Returns: (konfigürasyon sırasıyla sonuçlar, geçiş istatistikleri).
+    """
+    start = time.perf_counter()
+    truth = list(truth)
+    by_fusion: Dict[FusionThresholds, List[SweepConfig]] = {}
+    for cfg in configs:
+        by_fusion.setdefault(cfg.fusion, []).append(cfg)
+
+    common = dict(health_every_s=health_every_s, chunk_size=chunk_size, site=site)
+    jobs = [("health", None, (paths, [c.health for c in configs], truth, slack_s), common)]
+    for fthr, group in by_fusion.items():
+        jobs.append(("fused", fthr, (paths, fthr, [c.anomaly for c in group], truth, slack_s),
+                     dict(common, snapshot_path=snapshot_path)))
+
+    if workers > 1:
+        with mp.Pool(min(workers, len(jobs))) as pool:
+            extracted = pool.map(_extract_job, jobs)
+    else:
+        extracted = [_extract_job(j) for j in jobs]
+    health_sig = extracted[0][1]
+    fused_sigs = dict(extracted[1:])
+    t_extract = time.perf_counter() - start
+
+    tasks = [group[i : i + chunk_configs] for group in by_fusion.values() for i in range(0, len(group), chunk_configs)]
+    if workers > 1 and len(tasks) > 1:
+        with mp.Pool(min(workers, len(tasks)), initializer=_eval_init, initargs=(health_sig, fused_sigs, truth)) as pool:
+            parts = pool.map(_eval_job, tasks)
+    else:
+        _eval_init(health_sig, fused_sigs, truth)
+        parts = [_eval_job(t) for t in tasks]
+
+    index = {id(c): i for i, c in enumerate(configs)}
+    results: List[Optional[dict]] = [None] * len(configs)
+    for task, part in zip(tasks, parts):
+        for cfg, row in zip(task, part):
+            results[index[id(cfg)]] = row
+
+    any_fused = next(iter(fused_sigs.values()))
+    stats = {
+        "configs": len(configs),
+        "fusion_passes": len(fused_sigs),
+        "packets": health_sig.packets,
+        "fused": any_fused.fused,
+        "sweeps": health_sig.sweeps,
+        "span_s": health_sig.span_s,
+        "events": len(truth),
+        "extract_s": t_extract,
+        "elapsed_s": time.perf_counter() - start,
+        "candidate_rows": {
+            fam: len(s.families[fam]["ts"]) for s in [health_sig, any_fused] for fam in s.families
+        },
+    }
+    return results, stats
+
+
+def _print_table(results: List[dict], varied: List[str], sort_key: str, top: int) -> None:
+    rows = sorted(results, key=lambda r: (-r[sort_key] if sort_key != "alerts" else sum(r["alerts"].values())))
+    widths = [max(len(n), 8) for n in varied]
+    head = [f"{n:>{w}}" for n, w in zip(varied, widths)] + [f"{h:>8}" for h in ("alerts", "prec", "rec", "f1")]
+    print(" ".join(head + [f"{g:>11}" for g in TRUTH_TYPES]))
+    for r in rows[:top]:
+        cells = [f"{r['config'][n]!s:>{w}}" for n, w in zip(varied, widths)]
+        cells += [f"{sum(r['alerts'].values()):>8}"] + [f"{r[k]:8.3f}" for k in ("precision", "recall", "f1")]
+        cells += [f"{r['scores'][g]['precision']:5.2f}/{r['scores'][g]['recall']:4.2f}" for g in TRUTH_TYPES]
+        print(" ".join(cells))
+    print(f"(tip sütunları: precision/recall; {len(rows)} konfigürasyondan ilk {min(top, len(rows))}, sıralama: {sort_key})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("logs", nargs="+", help="JSONL veya .bin paket logları (zaman sırasıyla)")
+    ap.add_argument("--truth", default=None, help="fake_publisher --load --truth JSONL")
+    ap.add_argument("--grid", action="append", default=[], metavar="ALAN=v1,v2,...",
+                    help="Thresholds / HealthThresholds / FusionThresholds alanı (tekrarlanabilir)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--site", default=None, help="yalnızca bu site (tek site ayarı)")
+    ap.add_argument("--slack", type=int, default=15, help="olay bitişinden sonra doğru sayılan saniye")
+    ap.add_argument("--health-every", type=int, default=3, help="simüle saniye; health sweep periyodu")
+    ap.add_argument("--chunk", type=int, default=8192)
+    ap.add_argument("--snapshot", default=None, help="başlangıç model state'i (seasonal/EWMA bootstrap)")
+    ap.add_argument("--sort", choices=("f1", "precision", "recall", "alerts"), default="f1")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--out", default=None, help="tüm sonuçların yazılacağı JSONL")
+    args = ap.parse_args()
+
+    try:
+        grid = parse_grid(args.grid)
+        configs = expand_grid(grid) # eşik sınırları (ör. outlier_window) __post_init__'te denetlenir
+    except ValueError as e:
+        ap.error(str(e))
+    truth = load_truth(args.truth, args.site)
+    print(f"[sweep] {len(configs)} configs ({' x '.join(f'{k}:{len(v)}' for k, v in grid.items()) or 'defaults'}), "
+          f"{len(truth)} labeled events, {args.workers} workers")
+    results, stats = sweep(
+        args.logs, configs, truth, args.workers, args.slack, args.health_every, args.chunk, args.site, args.snapshot
+    )
+    print(
+        f"[sweep] packets={stats['packets']} fused={stats['fused']} sweeps={stats['sweeps']} "
+        f"span={stats['span_s'] / 3600:.1f} h, {stats['fusion_passes']} fusion passes, "
+        f"extract {stats['extract_s']:.2f} s, total {stats['elapsed_s']:.2f} s"
+    )
+    _print_table(results, [k for k, v in grid.items() if len(v) > 1] or list(grid)[:1], args.sort, args.top)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+"""
+Dash callback'leri için tick başına yayınlanan, değişmez ve versiyonlu görünüm state'i.
+
+Yazan taraf (dashboard.periodic_fusion) her tick'te yalnızca değişen sitelerin verisini kopyalar,
+diğer siteler önceki ViewState'ten paylaşılır (copy-on-write); yeni state tek referans atamasıyla
+yayınlanır. Okuyan taraf (her tarayıcı sekmesinin callback'leri) publisher.current'ı bir kez alır ve
+canlı global'lere (FLOW_BUF, MODULE_LAST) dokunmaz; figür/panel çıktıları (site, versiyon)
+anahtarıyla Memo'da paylaşılır, böylece izleyici sayısı arttıkça iş artmaz.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+import threading
+import numpy as np
+
+ModuleRow = Tuple[str, str, int, int, int, Optional[float]] # (site, module, ts, steps1, steps2, vcap)
+
+_EMPTY: Mapping = MappingProxyType({})
+
+
+def _frozen(a: np.ndarray) -> np.ndarray:
+    a = np.array(a) # kopya
+    a.flags.writeable = False
+    return a
+
+
+@dataclass(frozen=True)
+class SiteView:
+    version: int # sitenin verisinin son değiştiği ViewState versiyonu
+    flow: Mapping[str, np.ndarray] # FLOW_BUF kolonlarının salt okunur kopyası (ts, flow, ratio, n_used)
+    modules: Tuple[ModuleRow, ...] # modül sırasıyla son paketler
+    modules_version: int
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        ts = self.flow.get("ts")
+        return int(ts[-1]) if ts is not None and len(ts) else None
+
+    def since(self, ts: int) -> Dict[str, np.ndarray]:
+        """
+        ts'ten (dahil) sonraki canlı noktalar.
+        """
+        i = int(np.searchsorted(self.flow["ts"], ts, side="left"))
+        return {k: v[i:] for k, v in self.flow.items()}
+
+
+@dataclass(frozen=True)
+class ViewState:
+    version: int
+    sites: Tuple[str, ...] # sıralı
+    site_options: Tuple[dict, ...] # dcc.Dropdown options (değiştirilmemeli)
+    by_site: Mapping[str, SiteView]
+    alert_seq: int
+
+
+class ViewPublisher:
+    """
+    Tek yazar, çok okuyucu. publish() yalnızca yazan thread'den çağrılır.
+    """
+
+    def __init__(self):
+        self.current = ViewState(0, (), (), _EMPTY, 0)
+
+    def publish(
+        self,
+        flow_buf,
+        flow_changed: Iterable[str],
+        module_rows: Mapping[str, Iterable[ModuleRow]],
+        alert_seq: int,
+    ) -> ViewState:
+        """
+        flow_changed: son yayından beri FLOW_BUF'ına nokta eklenen siteler.
+        module_rows: son yayından beri paket gelen sitelerin tüm modül satırları.
+        Hiçbir şey değişmediyse aynı ViewState (aynı versiyon) korunur.
+        """
+        prev = self.current
+        flow_changed = set(flow_changed)
+        if not flow_changed and not module_rows and alert_seq == prev.alert_seq:
+            return prev
+
+        version = prev.version + 1
+        by_site: Dict[str, SiteView] = dict(prev.by_site)
+        for site_id in flow_changed | set(module_rows):
+            old = by_site.get(site_id)
+            if site_id in flow_changed:
+                rb = flow_buf[site_id]
+                flow = MappingProxyType({f: _frozen(rb.col(f)) for f in rb.fields})
+            else:
+                flow = old.flow if old is not None else _EMPTY
+            if site_id in module_rows:
+                mods, mods_version = tuple(sorted(module_rows[site_id], key=lambda r: r[1])), version
+            else:
+                mods, mods_version = (old.modules, old.modules_version) if old is not None else ((), version)
+            by_site[site_id] = SiteView(version, flow, mods, mods_version)
+
+        if len(by_site) != len(prev.by_site):
+            sites = tuple(sorted(by_site))
+            options = tuple({"label": s, "value": s} for s in sites)
+        else:
+            sites, options = prev.sites, prev.site_options
+        self.current = ViewState(version, sites, options, MappingProxyType(by_site), alert_seq)
+        return self.current
+
+
+def module_rows_of(sites: Iterable[str], module_last: Mapping[str, Mapping[str, dict]]) -> Dict[str, List[ModuleRow]]:
+    """
+    MODULE_LAST[site] -> ModuleRow listesi. İç dict'ler dict() ile kopyalanır (yazan thread'e karşı atomik).
+    """
+    out: Dict[str, List[ModuleRow]] = {}
+    for site_id in sites:
+        mods = dict(module_last.get(site_id, _EMPTY))
+        out[site_id] = [(site_id, m, v["ts"], v["steps1"], v["steps2"], v.get("vcap")) for m, v in mods.items()]
+    return out
+
+
+_MISS = object()
+
+
+class Memo:
+    """
+    Boyut sınırlı (en eski düşer) anahtar -> çıktı önbelleği; callback thread'leri arasında paylaşılır.
+    Aynı anahtar eşzamanlı iki kez kurulabilir (sonuç aynıdır), kilit yalnızca sözlük erişimini korur.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        with self._lock:
+            v = self.data.get(key, _MISS)
+            if v is not _MISS:
+                self.hits += 1
+                self.data.move_to_end(key)
+                return v
+            self.misses += 1
+        v = build()
+        with self._lock:
+            self.data[key] = v
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return v
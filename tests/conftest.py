@@ -0,0 +1,6 @@
+import os
+import sys
+
+# kaynaklar düz modüller halinde src dizininde (PYTHONPATH=src ile çalıştırılanlarla aynı)
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Id="r4qoj4" src')
+sys.path.insert(0, SRC)
@@ -0,0 +1,27 @@
+from alerts import AlertEngine, AlertPolicy, AlertStore
+
+T0 = 1_700_000_000
+
+
+def test_tokens_pruned_once_refilled():
+    eng = AlertEngine(AlertPolicy(open_burst=2, open_refill_s=10, resolve_after_s=5))
+    for i in range(50):
+        eng.process([{"type": "STUCK_ZERO", "site_id": f"S{i}", "module_id": "A", "ts": T0}], T0)
+    assert len(eng.tokens) == 50
+    eng.process([], T0 + 30)
+    assert not eng.tokens and not eng.active
+
+
+def test_store_keeps_offline_ts_and_error_text():
+    store = AlertStore(capacity=4)
+    eng = AlertEngine(store=store)
+    last_ts = T0 + 77
+    eng.process([{"type": "SENSOR_OFFLINE", "site_id": "S", "module_id": "A", "last_ts": last_ts, "ts": T0 + 100}], T0 + 100)
+    eng.process([{"type": "PIPELINE_ERROR", "error": "boom", "ts": T0 + 101}], T0 + 101)
+    offline, err = store.query(alert_type="SENSOR_OFFLINE")[0], store.query(alert_type="PIPELINE_ERROR")[0]
+    assert offline["value"] == last_ts
+    assert err["error"] == "boom" and "error" not in offline
+
+    for i in range(4): # PIPELINE_ERROR ring'den düşer
+        eng.process([{"type": "BAD_MSG", "site_id": f"X{i}", "ts": T0 + 102}], T0 + 102)
+    assert not store.errors
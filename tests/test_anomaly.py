@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+
+import anomaly
+from anomaly import alerts_to_dicts, detect, detect_batch
+
+T0 = 1_700_000_000
+
+
+def _points():
+    """
+    Üç sitenin sırası karışık örnekleri: gece/gündüz saatleri, spike'lar ve tek yönlü akış.
+    """
+    rnd = random.Random(7)
+    pts = []
+    for dt in range(0, 6 * 3600, 60):
+        for site in rnd.sample(["A", "B", "C"], 3):
+            s1, s2 = rnd.randint(0, 6), rnd.randint(0, 6)
+            if rnd.random() < 0.05:
+                s1 *= 20
+            pts.append((site, T0 + dt, s1, s2))
+    return pts
+
+
+def test_detect_batch_matches_detect():
+    pts = _points()
+    anomaly.reset_state()
+    scalar = [detect(site, s1, s2, 1, ts) for site, ts, s1, s2 in pts]
+
+    anomaly.reset_state()
+    site_ids = ["A", "B", "C"]
+    alerts, dbg = detect_batch(
+        site_ids,
+        np.array([site_ids.index(p[0]) for p in pts]),
+        np.array([p[1] for p in pts]),
+        np.array([p[2] for p in pts]),
+        np.array([p[3] for p in pts]),
+        np.ones(len(pts), dtype=np.int64),
+    )
+    by_row = [[] for _ in pts]
+    for row, a in zip(alerts["row"], alerts_to_dicts(alerts)):
+        by_row[row].append(a)
+
+    assert by_row == [a for a, _ in scalar]
+    assert {a["type"] for alerts, _ in scalar for a in alerts} >= {"SPIKE_SEASONAL", "ONE_SIDED", "LOW_DEMAND_CROWD"}
+    for key in ("flow", "ratio", "z_seasonal", "z_ewma"):
+        assert dbg[key].tolist() == [d[key] for _, d in scalar]
@@ -0,0 +1,31 @@
+from federation import Aggregator, GatewayExporter
+
+T0 = 1_700_000_000
+CLOSE_LAG = 2
+
+
+def test_lagging_site_is_not_late():
+    # S1'in cihaz saati 3 sn geride: fused ts'leri duvar saatinin 3 sn gerisinden gelir
+    exp = GatewayExporter("G", epoch=T0)
+    agg = Aggregator(expected=["G"])
+    for dt in range(30):
+        now = T0 + dt
+        fused = [("S0", now - CLOSE_LAG, 1.0, 0.5, 3), ("S1", now - CLOSE_LAG - 3, 1.0, 0.5, 3)]
+        exp.add_fused(fused, now, CLOSE_LAG)
+        for fr in exp.fused_frames(now):
+            agg.ingest(fr, now=now)
+        agg.tick(now=now)
+    assert agg.late_points == 0
+    city = agg.city_series()
+    both = (city["ts"] >= T0 - CLOSE_LAG) & (city["ts"] <= T0 + 29 - CLOSE_LAG - 3) # iki sitenin de olduğu saniyeler
+    assert both.sum() == 27 and (city["sites"][both] == 2).all()
+
+
+def test_idle_site_releases_watermark():
+    exp = GatewayExporter("G", epoch=T0, site_idle_s=5)
+    exp.add_fused([("S0", T0 - 10, 1.0, 0.5, 3), ("S1", T0 - 2, 1.0, 0.5, 3)], T0, CLOSE_LAG)
+    assert exp.watermark == T0 - 10
+    # S0 susar: site_idle_s sonra watermark yalnızca S1'i izler
+    for dt in range(1, 10):
+        wm = exp.add_fused([("S1", T0 + dt - 2, 1.0, 0.5, 3)], T0 + dt, CLOSE_LAG)
+    assert wm == T0 + 7
@@ -0,0 +1,132 @@
+import fusion
+from common import StepPacket
+from fusion import FusionThresholds
+
+T0 = 1_700_000_000
+THR = FusionThresholds(close_lag_s=30, module_ttl_s=10)
+
+
+def _run(dts, modules, delays):
+    """
+    Her saniye modüllerden birer paket + fuse_ready; delays[bucket ts] = kapanış gecikmesi (s).
+    """
+    for dt in dts:
+        now = T0 + dt
+        for m in modules:
+            fusion.ingest(StepPacket("S", m, now, 1, 1, 1), now_ts=now, thr=THR)
+        for row in fusion.fuse_ready(now_ts=now, thr=THR):
+            delays[row[1]] = now - row[1]
+
+
+def test_adaptive_close_survives_silent_module():
+    fusion.reset_state()
+    delays = {}
+    _run(range(20), ["A", "B", "C"], delays)
+    assert all(delays[T0 + dt] == 0 for dt in range(20)) # tamamlanan bucket hemen kapanır
+
+    # C susar: module_ttl_s boyunca bucket'lar eksik sayılır, sonra yine adaptif (gecikmesiz) kapanır
+    _run(range(20, 80), ["A", "B"], delays)
+    assert "C" not in fusion.MODULE_LAST["S"]
+    assert all(delays[T0 + dt] == 0 for dt in range(20 + THR.module_ttl_s + 1, 80))
+
+    # C geri gelince yeniden bilinen modül olur
+    _run(range(80, 90), ["A", "B", "C"], delays)
+    assert set(fusion.MODULE_LAST["S"]) == {"A", "B", "C"}
+    assert all(delays[T0 + dt] == 0 for dt in range(80, 90))
+
+
+def test_fused_history_matches_fuse_ready():
+    fusion.reset_state()
+    out = []
+    for dt in range(5):
+        now = T0 + dt
+        for m, total in (("A", 7), ("B", 10), ("C", 13)):
+            fusion.ingest(StepPacket("S", m, now, 1, total // 3, total - total // 3), now_ts=now, thr=THR)
+        out.extend(fusion.fuse_ready(now_ts=now, thr=THR))
+    assert [r[1:] for r in out] == list(fusion.FUSED_HISTORY["S"])
+
+
+def _batch_case():
+    """
+    İki site, sırası karışık modüller; her adımda bir geç (LATE_MERGED / LATE_DROPPED) ve bir gelecek paket.
+    """
+    steps = []
+    for dt in range(40):
+        now = T0 + dt
+        pkts = [StepPacket(s, m, now, 1, (dt * 7 + i) % 5, i) for i, (s, m) in enumerate(
+            [("S1", "A"), ("S2", "A"), ("S1", "B"), ("S2", "B"), ("S1", "C"), ("S2", "C"), ("S1", "A")])]
+        if dt >= 35:
+            pkts.append(StepPacket("S1", "D", now - 33, 1, 9, 9))
+            pkts.append(StepPacket("S2", "D", now - 3, 1, 9, 9))
+        pkts.append(StepPacket("S1", "A", now + 60, 1, 1, 1))
+        steps.append((now, pkts))
+    return steps
+
+
+def test_ingest_batch_matches_ingest():
+    runs = []
+    for batched in (False, True):
+        fusion.reset_state()
+        statuses, out = {}, []
+        for now, pkts in _batch_case():
+            if batched:
+                counts = fusion.ingest_batch(pkts, now_ts=now, thr=THR)
+            else:
+                counts = {}
+                for p in pkts:
+                    st = fusion.ingest(p, now_ts=now, thr=THR)
+                    if st != fusion.ACCEPTED:
+                        counts[st] = counts.get(st, 0) + 1
+            for st, n in counts.items():
+                statuses[st] = statuses.get(st, 0) + n
+            out.extend(fusion.fuse_ready(now_ts=now, thr=THR))
+        runs.append((statuses, out, {s: dict(m) for s, m in fusion.MODULE_LAST.items()}))
+    assert runs[0] == runs[1]
+    assert set(runs[0][0]) == {fusion.LATE_MERGED, fusion.LATE_DROPPED, fusion.FUTURE_DROPPED}
+
+
+def test_corrections_match_fuse_bucket():
+    fusion.reset_state()
+    fusion.pop_corrections()
+    pkts = [StepPacket("S", m, T0, 1, d1, d2) for m, d1, d2 in (("A", 3, 4), ("B", 4, 4), ("C", 90, 1), ("D", 3, 5))]
+    for p in pkts[:3]:
+        fusion.ingest(p, now_ts=T0, thr=THR)
+    assert fusion.fuse_ready(now_ts=T0 + THR.close_lag_s, thr=THR)
+    assert fusion.ingest(pkts[3], now_ts=T0 + THR.close_lag_s, thr=THR) == fusion.LATE_MERGED
+    fusion.fuse_ready(now_ts=T0 + THR.close_lag_s, thr=THR)
+    (corr,) = fusion.pop_corrections()
+
+    fusion.reset_state()
+    for p in pkts:
+        fusion.ingest(p, now_ts=T0, thr=THR)
+    assert corr == ("S", T0) + fusion.fuse_bucket("S", T0, THR)
+
+
+def _fill_buckets():
+    """
+    Modül sayısı 1..6 olan bucket'lar; bazılarında uç (outlier) modüller.
+    """
+    keys = []
+    for i, n_mod in enumerate((1, 2, 3, 4, 5, 6, 3, 5)):
+        site, ts = f"S{i % 3}", T0 + i
+        for j in range(n_mod):
+            d1, d2 = 3 + (i + j) % 3, 4 + j % 2
+            if j == 1 and i % 2:
+                d1, d2 = 80, 0 # uç modül
+            fusion.ingest(StepPacket(site, f"M{j}", ts, 1, d1, d2), now_ts=ts, thr=THR)
+        keys.append((site, ts))
+    return keys
+
+
+def test_fuse_buckets_matches_fuse_bucket():
+    fusion.reset_state()
+    keys = _fill_buckets()
+    batched = fusion.fuse_buckets(keys, THR)
+    batched_hist = {s: list(h) for s, h in fusion.FUSED_HISTORY.items()}
+
+    fusion.reset_state()
+    keys = _fill_buckets()
+    scalar = [(s, t) + fusion.fuse_bucket(s, t, THR) for s, t in keys]
+    assert batched == scalar
+    assert batched_hist == {s: list(h) for s, h in fusion.FUSED_HISTORY.items()}
+    assert {r[4] for r in scalar} >= {1, 2} and any(r[4] < n for r, n in zip(scalar, (1, 2, 3, 4, 5, 6, 3, 5)))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import health
+from common import StepPacket
+from health import TOTALS_DEPTH, HealthThresholds
+
+
+def test_outlier_window_bounded_by_totals_depth():
+    with pytest.raises(ValueError):
+        HealthThresholds(outlier_window=TOTALS_DEPTH + 1)
+    with pytest.raises(ValueError):
+        HealthThresholds(outlier_window=0)
+
+    health.reset_state()
+    thr = HealthThresholds(outlier_window=TOTALS_DEPTH)
+    for dt in range(3 * TOTALS_DEPTH):
+        health.health_alerts_for_packet(StepPacket("S", "A", 1_700_000_000 + dt, 1, dt % 7, 1), thr)
+    (st,) = health.MODULES
+    assert len(st.window) == TOTALS_DEPTH
+
+
+def _trailing(vals, pred):
+    n = 0
+    for v in reversed(vals):
+        if not pred(v):
+            break
+        n += 1
+    return n
+
+
+def test_incremental_runs_and_median_match_recompute():
+    health.reset_state()
+    thr = HealthThresholds(outlier_window=15)
+    # sıfır ve sabit serileri olan, TOTALS_DEPTH'i birkaç kez saran dizi
+    seq = [0] * 30 + [5] * 40 + [(i * 7) % 11 for i in range(200)] + [0] * 150 + [3] * 10
+    for dt, total in enumerate(seq):
+        health.health_alerts_for_packet(StepPacket("S", "A", 1_700_000_000 + dt, 1, total, 0), thr)
+        (st,) = health.MODULES
+        vals = health.TOTALS.last(st.key, st.n_totals, TOTALS_DEPTH).tolist()
+        assert vals == seq[max(0, dt + 1 - TOTALS_DEPTH) : dt + 1]
+        assert min(st.zero_run, len(vals)) == _trailing(vals, lambda v: v == 0)
+        assert min(st.const_run, len(vals)) == _trailing(vals, lambda v: v == vals[-1])
+        assert st.window_median() == float(np.median(vals[-thr.outlier_window :]))
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from history import FUSED_DTYPE, HistoryStore, SegmentStream
+
+T0 = 1_700_000_000
+
+
+def _rows(ts, site=b"S"):
+    rows = np.zeros(len(ts), dtype=FUSED_DTYPE)
+    rows["ts"] = ts
+    rows["site_id"] = site
+    return rows
+
+
+def test_query_keeps_segments_compacted_mid_read(tmp_path):
+    st = SegmentStream(str(tmp_path), "fused", FUSED_DTYPE, segment_records=10)
+    for i in range(4):
+        st.append(_rows(T0 + np.arange(i * 10, i * 10 + 10)))
+        st.flush()
+    old = {s.path for s in st.segments()}
+    assert len(old) == 4
+
+    read = st._read_segment
+
+    def compact_then_read(*args):
+        # ilk segment okunurken eşzamanlı compaction: okunacak diğer dosyalar birleştirilip silinir
+        if st.segments()[0].path in old:
+            assert st.compact(40) == 4
+            assert all(os.path.exists(p) for p in old) # okuyucu varken silinmez
+        return read(*args)
+
+    st._read_segment = compact_then_read
+    out = st.query(T0, T0 + 100)
+    assert out["ts"].tolist() == list(range(T0, T0 + 40))
+    assert not any(os.path.exists(p) for p in old) # son okuyucu bırakınca silindi
+    assert len(st.segments()) == 1
+
+
+def test_long_site_ids_are_distinct_and_queryable(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    a, b = "KADIKOY_MODA_CADDESI_NO_1_A", "KADIKOY_MODA_CADDESI_NO_1_B" # SITE_ID_LEN'den uzun, ortak önek
+    store.add_fused([(a, T0, 1.0, 0.5, 3), (b, T0, 2.0, 0.5, 3)])
+    store.add_alerts([{"type": "SPIKE", "site_id": a, "ts": T0, "z": 9.0}])
+    store.flush()
+    assert store.query_fused(a, T0, T0)["flow"].tolist() == [1.0]
+    assert store.query_fused(b, T0, T0)["flow"].tolist() == [2.0]
+    assert store.query_alerts(T0, T0, a)["value"].tolist() == [9.0]
+    assert len(store.query_alerts(T0, T0, b)) == 0
@@ -0,0 +1,33 @@
+import time
+
+import paho.mqtt.client as mqtt
+
+from localbroker import LocalBroker
+
+
+def test_qos2_handshake_completes():
+    broker = LocalBroker(port=0).start()
+    got = []
+    sub = mqtt.Client()
+    sub.on_message = lambda c, u, m: got.append(m.payload)
+    pub = mqtt.Client()
+    try:
+        sub.connect("127.0.0.1", broker.port)
+        sub.subscribe("t/#")
+        sub.loop_start()
+        pub.connect("127.0.0.1", broker.port)
+        pub.loop_start()
+        time.sleep(0.3)
+        infos = [pub.publish("t/x", str(i), qos=q) for i, q in enumerate((0, 1, 2, 2))]
+        for info in infos:
+            info.wait_for_publish(3)
+        assert all(info.is_published() for info in infos) # QoS 2: PUBREC/PUBREL/PUBCOMP
+        deadline = time.time() + 3
+        while len(got) < 4 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(got) == [b"0", b"1", b"2", b"3"]
+    finally:
+        for c in (pub, sub):
+            c.loop_stop()
+            c.disconnect()
+        broker.stop()
@@ -0,0 +1,40 @@
+from common import StepPacket
+from sharded import ShardedPipeline
+
+T0 = 1_700_000_000
+
+
+def _errors(alerts):
+    return sorted(a["shard"] for a in alerts if a["type"] == "PIPELINE_ERROR")
+
+
+def test_worker_error_is_reported_not_waited_on(tmp_path):
+    snap = tmp_path / "snapshot.bin"
+    for i in range(2):
+        (tmp_path / f"snapshot.bin.{i}").write_bytes(b"\x00corrupt")
+    sp = ShardedPipeline(2, snapshot_path=str(snap))
+    _, alerts = sp.close(timeout=10)
+    assert _errors(alerts) == [0, 1]
+    assert sp.failed == {0, 1}
+
+
+def test_killed_worker_reported_by_drain_and_close():
+    sp = ShardedPipeline(2)
+    sp._procs[0].kill()
+    sp._procs[0].join()
+    _, alerts = sp.drain()
+    assert _errors(alerts) == [0]
+    assert _errors(sp.drain()[1]) == [] # bir kez raporlanır
+
+    for dt in range(5):
+        for s in range(4):
+            sp.submit(StepPacket(f"S{s}", "A", T0 + dt, 1, 1, 1))
+    _, alerts = sp.close(timeout=10)
+    assert _errors(alerts) == [] and sp.failed == {0}
+
+
+def test_clean_close_reports_nothing():
+    sp = ShardedPipeline(2)
+    sp.tick(T0)
+    _, alerts = sp.close(timeout=10)
+    assert _errors(alerts) == [] and not sp.failed